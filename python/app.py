@@ -4,44 +4,65 @@ Self-hosted alternative to AWS Lambda
 """
 
 import os
+import re
+import time
 import logging
-import json
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 
 from ask_sdk_core.skill_builder import SkillBuilder
 from ask_sdk_core.dispatch_components import AbstractRequestHandler, AbstractExceptionHandler
 from ask_sdk_core.utils import is_request_type, is_intent_name
 from ask_sdk_core.handler_input import HandlerInput
-from ask_sdk_model import Response
-from ask_sdk_core.serialize import DefaultSerializer
-from ask_sdk_model import RequestEnvelope
 from ask_sdk_model.interfaces.audioplayer import (
-    PlayDirective, PlayBehavior, AudioItem, Stream, AudioItemMetadata,
-    StopDirective
+    PlayDirective, PlayBehavior, AudioItem, Stream, StopDirective
 )
 from ask_sdk_model.ui import SimpleCard, LinkAccountCard
 
 from audiobookshelf_client import AudioBookshelfClient
+from client_registry import get_client
+from codec import decode_request, encode_response
+from catalog import get_catalog
+from progress_queue import get_progress_queue
+from playback_state import get_playback_state_store
+from prefetch import get_prefetch_cache
+from covers import get_cover_cache, nearest_size, open_account
+from search import search_order, search_libraries
+from tracks import StreamToken, choose_stream, next_track, track_stream, get_track_cache
+from episodes import get_episode_cache
+from chapters import chapter, chapter_at, chapter_count, next_chapter, previous_chapter
+from deadline import request_deadline
+from logs import configure_logging, request_log
+from verifier import VerificationException, verification_enabled, verify_request
+from metrics import REQUEST_LATENCY, CONTENT_TYPE, instrument_skill, render_metrics
+from responses import (
+    not_configured_response, error_response, no_items_in_progress_response,
+    book_not_found_response, continue_response, play_response,
+    build_enqueue_directive, progress_position, nothing_playing_response,
+    current_position, load_chapter_entry, seek_response, episode_response
+)
 from helpers import (
-    get_audiobookshelf_client, get_item_title, get_item_author,
-    get_item_cover_url, get_progress_percent
+    get_audiobookshelf_client, get_session_attributes, get_user_id, get_slot_value,
+    parse_duration
 )
-from constants import MESSAGES, SESSION_KEYS
+from constants import MESSAGES, SESSION_KEYS, DEFAULT_SKIP_SECONDS
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Log through a queue so requests never wait on log I/O
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# Alexa rejects skills that accept requests it did not sign
+VERIFY_REQUESTS = verification_enabled()
+
 # Initialize Flask app
 app = Flask(__name__)
 
+# AudioBookshelf item IDs are UUIDs or, on older servers, li_ prefixed
+COVER_ITEM_ID = re.compile(r'[\w-]{1,64}')
+
 
 # =============================================================================
 # ALEXA INTENT HANDLERS
@@ -64,6 +85,14 @@ class LaunchRequestHandler(AbstractRequestHandler):
                     .set_card(LinkAccountCard())
                     .response)
 
+        # Most sessions go on to "continue my book", so fetch it while the user answers
+        try:
+            prefetch = get_prefetch_cache()
+            prefetch.record_visit(get_user_id(handler_input), client)
+            prefetch.prefetch_in_background(client)
+        except Exception as e:
+            logger.error(f"Failed to start prefetch: {e}")
+
         speech_text = MESSAGES['WELCOME']
         reprompt_text = MESSAGES['HELP']
 
@@ -84,77 +113,29 @@ class ContinueBookIntentHandler(AbstractRequestHandler):
         client = get_audiobookshelf_client(session_attr)
 
         if not client:
-            return (handler_input.response_builder
-                    .speak(MESSAGES['NOT_CONFIGURED'])
-                    .set_card(LinkAccountCard())
-                    .response)
+            return not_configured_response(handler_input)
 
         try:
-            # Get items in progress
-            items_in_progress = client.get_items_in_progress()
+            # Get items in progress, prefetched on launch or by the warmer when possible,
+            # or last seen ones while the server is unavailable
+            prefetch = get_prefetch_cache()
+            prefetch.record_visit(get_user_id(handler_input), client)
+            items_in_progress = prefetch.load(client)
 
             if not items_in_progress:
-                return (handler_input.response_builder
-                        .speak(MESSAGES['NO_ITEMS_IN_PROGRESS'])
-                        .ask('Would you like to search for a book?')
-                        .response)
+                return no_items_in_progress_response(handler_input)
 
-            # Get the most recent item
+            # Continue the most recent item
             item = items_in_progress[0]
-            title = get_item_title(item)
-            author = get_item_author(item)
-
-            # Get progress information
-            progress = item.get('userMediaProgress', {})
-            current_time = progress.get('currentTime', 0)
-            duration = progress.get('duration', 0)
-            progress_percent = get_progress_percent(current_time, duration)
-
-            # Get stream URL
-            stream_url = client.get_stream_url(item['id'])
-
-            # Store session attributes
-            session_attr[SESSION_KEYS['CURRENT_ITEM']] = item['id']
-            session_attr[SESSION_KEYS['OFFSET']] = int(current_time * 1000)
-
-            # Build metadata
-            base_url = session_attr.get(SESSION_KEYS['BASE_URL']) or os.getenv('AUDIOBOOKSHELF_URL')
-            cover_url = get_item_cover_url(item, base_url)
-
-            # Build audio directive
-            audio_item = AudioItem(
-                stream=Stream(
-                    token=item['id'],
-                    url=stream_url,
-                    offset_in_milliseconds=int(current_time * 1000)
-                ),
-                metadata=AudioItemMetadata(
-                    title=title,
-                    subtitle=f"by {author}",
-                    art={"sources": [{"url": cover_url}]} if cover_url else None
-                )
-            )
+            offset_ms, episode_id = progress_position(item, get_user_id(handler_input))
+            stream = choose_stream(client, get_track_cache().load(client, item.id),
+                                   item.id, offset_ms, episode_id)
 
-            play_directive = PlayDirective(
-                play_behavior=PlayBehavior.REPLACE_ALL,
-                audio_item=audio_item
-            )
-
-            speech_text = (f"Continuing {title}. You're {progress_percent}% through."
-                          if progress_percent > 0
-                          else f"Playing {title} by {author}.")
-
-            return (handler_input.response_builder
-                    .speak(speech_text)
-                    .add_directive(play_directive)
-                    .response)
+            return continue_response(handler_input, item, stream)
 
         except Exception as e:
             logger.error(f"Error continuing book: {e}")
-            return (handler_input.response_builder
-                    .speak(MESSAGES['ERROR'])
-                    .ask(MESSAGES['HELP'])
-                    .response)
+            return error_response(handler_input)
 
 
 class PlayBookIntentHandler(AbstractRequestHandler):
@@ -168,10 +149,7 @@ class PlayBookIntentHandler(AbstractRequestHandler):
         client = get_audiobookshelf_client(session_attr)
 
         if not client:
-            return (handler_input.response_builder
-                    .speak(MESSAGES['NOT_CONFIGURED'])
-                    .set_card(LinkAccountCard())
-                    .response)
+            return not_configured_response(handler_input)
 
         # Get book name from slot
         slots = handler_input.request_envelope.request.intent.slots
@@ -184,74 +162,121 @@ class PlayBookIntentHandler(AbstractRequestHandler):
                     .response)
 
         try:
-            # Get libraries and search
-            libraries = client.get_libraries()
+            # Get the account's libraries from the local catalog (fetched once per account)
+            catalog = get_catalog()
+            libraries = catalog.get_libraries(client)
 
             if not libraries:
                 return (handler_input.response_builder
                         .speak("I couldn't find any libraries in your AudioBookshelf account.")
                         .response)
 
-            # Search in the first library (or use stored library ID)
-            library_id = session_attr.get(SESSION_KEYS['LIBRARY_ID']) or libraries[0]['id']
-            search_results = client.search_library(library_id, book_name)
+            # Search every library, the one last played from first
+            library_ids = search_order(libraries, session_attr.get(SESSION_KEYS['LIBRARY_ID']))
 
-            if not search_results.get('book') or not search_results['book']:
-                return (handler_input.response_builder
-                        .speak(f"I couldn't find any books matching {book_name}. Try searching for something else.")
-                        .ask('What would you like to do?')
-                        .response)
+            # Resolve the title locally, asking the server only on a miss
+            item = catalog.find_item(client, library_ids, book_name, media_type=None)
 
-            # Get the first result
-            item = search_results['book'][0]['libraryItem']
-            title = get_item_title(item)
-            author = get_item_author(item)
-
-            # Get stream URL
-            stream_url = client.get_stream_url(item['id'])
-
-            # Store session attributes
-            session_attr[SESSION_KEYS['CURRENT_ITEM']] = item['id']
-            session_attr[SESSION_KEYS['OFFSET']] = 0
-            session_attr[SESSION_KEYS['LIBRARY_ID']] = library_id
-
-            # Build metadata
-            base_url = session_attr.get(SESSION_KEYS['BASE_URL']) or os.getenv('AUDIOBOOKSHELF_URL')
-            cover_url = get_item_cover_url(item, base_url)
-
-            # Build audio directive
-            audio_item = AudioItem(
-                stream=Stream(
-                    token=item['id'],
-                    url=stream_url,
-                    offset_in_milliseconds=0
-                ),
-                metadata=AudioItemMetadata(
-                    title=title,
-                    subtitle=f"by {author}",
-                    art={"sources": [{"url": cover_url}]} if cover_url else None
-                )
-            )
+            if not item:
+                hits = search_libraries(client, library_ids, book_name)
 
-            play_directive = PlayDirective(
-                play_behavior=PlayBehavior.REPLACE_ALL,
-                audio_item=audio_item
-            )
+                if not hits:
+                    return book_not_found_response(handler_input, book_name)
 
-            speech_text = f"Playing {title} by {author}."
+                # Get the best match
+                item = hits[0]
 
-            return (handler_input.response_builder
-                    .speak(speech_text)
-                    .add_directive(play_directive)
-                    .response)
+            library_id = item.library_id or library_ids[0]
+
+            stream = choose_stream(client, get_track_cache().load(client, item.id),
+                                   item.id, 0)
+
+            return play_response(handler_input, item, stream, library_id)
 
         except Exception as e:
             logger.error(f"Error playing book: {e}")
+            return error_response(handler_input)
+
+
+class PlayEpisodeIntentHandler(AbstractRequestHandler):
+    """Handler for PlayLatestEpisodeIntent and PlayNextEpisodeIntent"""
+
+    def can_handle(self, handler_input):
+        return (is_intent_name("PlayLatestEpisodeIntent")(handler_input) or
+                is_intent_name("PlayNextEpisodeIntent")(handler_input))
+
+    def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        client = get_audiobookshelf_client(session_attr)
+
+        if not client:
+            return not_configured_response(handler_input)
+
+        latest = is_intent_name("PlayLatestEpisodeIntent")(handler_input)
+        podcast_name = get_slot_value(handler_input, 'podcastName')
+
+        if latest and not podcast_name:
             return (handler_input.response_builder
-                    .speak(MESSAGES['ERROR'])
-                    .ask(MESSAGES['HELP'])
+                    .speak('Which podcast would you like to hear?')
+                    .ask('Please tell me the name of a podcast.')
                     .response)
 
+        try:
+            episodes = get_episode_cache()
+            catalog = get_catalog()
+            library_ids = search_order(catalog.get_libraries(client),
+                                       session_attr.get(SESSION_KEYS['LIBRARY_ID']))
+
+            if podcast_name:
+                # Resolve the podcast locally, asking the server only on a miss
+                podcast = catalog.find_item(client, library_ids, podcast_name,
+                                                  media_type='podcast')
+                if not podcast:
+                    podcast = next((hit for hit in search_libraries(client, library_ids,
+                                                                    podcast_name)
+                                    if hit.media_type == 'podcast'), None)
+                if not podcast:
+                    return (handler_input.response_builder
+                            .speak(f"I couldn't find a podcast called {podcast_name}.")
+                            .ask('What would you like to do?')
+                            .response)
+                item_id, updated_at = podcast.id, podcast.updated_at
+                library_id = podcast.library_id
+            else:
+                item_id = episodes.recent_podcast(client)
+                if not item_id:
+                    return (handler_input.response_builder
+                            .speak("You haven't listened to any podcasts yet. "
+                                   "Try saying: play the latest episode of, and a podcast name.")
+                            .ask('What would you like to do?')
+                            .response)
+                updated_at, library_id = None, None
+
+            if latest:
+                episode, offset_ms = episodes.latest(client, item_id, updated_at), 0
+                if not episode:
+                    return (handler_input.response_builder
+                            .speak("That podcast doesn't have any episodes yet.")
+                            .response)
+            else:
+                choice = episodes.next_unplayed(client, item_id, updated_at)
+                if not choice:
+                    return (handler_input.response_builder
+                            .speak("You've heard every episode of that podcast.")
+                            .response)
+                episode, offset_ms = choice
+
+            # The episode list read above also refreshed the track list
+            entry = get_track_cache().load(client, item_id)
+            stream = choose_stream(client, entry, item_id, offset_ms, episode['id'])
+
+            return episode_response(handler_input, entry, episode, stream,
+                                    library_id or (library_ids[0] if library_ids else None))
+
+        except Exception as e:
+            logger.error(f"Error playing episode: {e}")
+            return error_response(handler_input)
+
 
 class PauseIntentHandler(AbstractRequestHandler):
     """Handler for AMAZON.PauseIntent"""
@@ -281,8 +306,16 @@ class ResumeIntentHandler(AbstractRequestHandler):
                     .set_card(LinkAccountCard())
                     .response)
 
-        item_id = session_attr.get(SESSION_KEYS['CURRENT_ITEM'])
-        offset = session_attr.get(SESSION_KEYS['OFFSET'], 0)
+        # The shared store sees AudioPlayer events, so it beats the session
+        state = get_playback_state_store().get(get_user_id(handler_input))
+        if state:
+            item_id = state['item_id']
+            episode_id = state['episode_id']
+            offset = state['offset_ms']
+        else:
+            item_id = session_attr.get(SESSION_KEYS['CURRENT_ITEM'])
+            episode_id = None
+            offset = session_attr.get(SESSION_KEYS['OFFSET'], 0)
 
         if not item_id:
             return (handler_input.response_builder
@@ -290,13 +323,15 @@ class ResumeIntentHandler(AbstractRequestHandler):
                     .ask(MESSAGES['HELP'])
                     .response)
 
-        stream_url = client.get_stream_url(item_id)
+        # The offset is within the whole item (or the episode); pick the file that contains it
+        stream = choose_stream(client, get_track_cache().load(client, item_id), item_id, offset,
+                               episode_id)
 
         audio_item = AudioItem(
             stream=Stream(
-                token=item_id,
-                url=stream_url,
-                offset_in_milliseconds=offset
+                token=stream.token,
+                url=stream.url,
+                offset_in_milliseconds=stream.offset_ms
             )
         )
 
@@ -311,6 +346,114 @@ class ResumeIntentHandler(AbstractRequestHandler):
                 .response)
 
 
+class SkipIntentHandler(AbstractRequestHandler):
+    """Handler for SkipForwardIntent and SkipBackwardIntent"""
+
+    def can_handle(self, handler_input):
+        return (is_intent_name("SkipForwardIntent")(handler_input) or
+                is_intent_name("SkipBackwardIntent")(handler_input))
+
+    def handle(self, handler_input):
+        session_attr = get_session_attributes(handler_input)
+        client = get_audiobookshelf_client(session_attr)
+
+        if not client:
+            return not_configured_response(handler_input)
+
+        position = current_position(handler_input)
+        if not position:
+            return nothing_playing_response(handler_input)
+
+        stream, offset = position
+        seconds = parse_duration(get_slot_value(handler_input, 'duration')) or DEFAULT_SKIP_SECONDS
+        if is_intent_name("SkipBackwardIntent")(handler_input):
+            seconds = -seconds
+
+        # The target offset comes from memory; only a cold track list is fetched
+        entry = get_track_cache().load(client, stream.item_id)
+        return seek_response(handler_input, client, stream, entry, offset + int(seconds * 1000))
+
+
+class SeekIntentHandler(AbstractRequestHandler):
+    """Handler for SeekIntent"""
+
+    def can_handle(self, handler_input):
+        return is_intent_name("SeekIntent")(handler_input)
+
+    def handle(self, handler_input):
+        session_attr = get_session_attributes(handler_input)
+        client = get_audiobookshelf_client(session_attr)
+
+        if not client:
+            return not_configured_response(handler_input)
+
+        position = current_position(handler_input)
+        if not position:
+            return nothing_playing_response(handler_input)
+
+        seconds = parse_duration(get_slot_value(handler_input, 'position'))
+        if seconds is None:
+            return (handler_input.response_builder
+                    .speak('Where would you like to go? For example, say go to one hour twenty minutes.')
+                    .ask('Please tell me a time, like one hour twenty minutes.')
+                    .response)
+
+        stream, _ = position
+        entry = get_track_cache().load(client, stream.item_id)
+        return seek_response(handler_input, client, stream, entry, int(seconds * 1000))
+
+
+class ChapterIntentHandler(AbstractRequestHandler):
+    """Handler for chapter navigation: next, previous and go-to-chapter intents"""
+
+    NEXT_INTENTS = ("NextChapterIntent", "AMAZON.NextIntent")
+    PREVIOUS_INTENTS = ("PreviousChapterIntent", "AMAZON.PreviousIntent")
+
+    def can_handle(self, handler_input):
+        return any(is_intent_name(name)(handler_input)
+                   for name in self.NEXT_INTENTS + self.PREVIOUS_INTENTS + ("GoToChapterIntent",))
+
+    def handle(self, handler_input):
+        session_attr = get_session_attributes(handler_input)
+        client = get_audiobookshelf_client(session_attr)
+
+        if not client:
+            return not_configured_response(handler_input)
+
+        position = current_position(handler_input)
+        if not position:
+            return nothing_playing_response(handler_input)
+
+        stream, offset = position
+        # Podcast episodes are played one by one and have no chapter index
+        entry = None if stream.episode_id else load_chapter_entry(client, stream.item_id)
+        if not chapter_count(entry):
+            return handler_input.response_builder.speak(MESSAGES['NO_CHAPTERS']).response
+
+        intent_name = handler_input.request_envelope.request.intent.name
+        if intent_name in self.NEXT_INTENTS:
+            target = next_chapter(entry, offset)
+            if target is None:
+                return (handler_input.response_builder
+                        .speak("You're in the last chapter.")
+                        .response)
+        elif intent_name in self.PREVIOUS_INTENTS:
+            target = previous_chapter(entry, offset)
+        else:
+            number = get_slot_value(handler_input, 'chapterNumber')
+            target = chapter(entry, int(number) - 1) if number and number.isdigit() else None
+            if target is None:
+                current = chapter_at(entry, offset)
+                return (handler_input.response_builder
+                        .speak(f"This book has {chapter_count(entry)} chapters, "
+                               f"and you're in chapter {current.index + 1}. Which one would you like?")
+                        .ask('Which chapter would you like?')
+                        .response)
+
+        speech = target.title or f'Chapter {target.index + 1}'
+        return seek_response(handler_input, client, stream, entry, target.start_ms, speech)
+
+
 class StopAndCancelIntentHandler(AbstractRequestHandler):
     """Handler for AMAZON.StopIntent and AMAZON.CancelIntent"""
 
@@ -375,13 +518,26 @@ class PlaybackStartedHandler(AbstractRequestHandler):
 
     def handle(self, handler_input):
         logger.info("Playback started")
-        token = handler_input.request_envelope.request.token
+        stream = StreamToken.parse(handler_input.request_envelope.request.token)
         offset = handler_input.request_envelope.request.offset_in_milliseconds
 
-        session_attr = handler_input.attributes_manager.session_attributes
-        session_attr[SESSION_KEYS['CURRENT_ITEM']] = token
+        if not stream:
+            return handler_input.response_builder.response
+
+        # Positions are kept within the whole item, not the current file
+        offset = stream.absolute_ms(offset)
+        get_playback_state_store().save(get_user_id(handler_input), stream.item_id, offset,
+                                        episode_id=stream.episode_id)
+
+        session_attr = get_session_attributes(handler_input)
+        session_attr[SESSION_KEYS['CURRENT_ITEM']] = stream.item_id
         session_attr[SESSION_KEYS['OFFSET']] = offset
 
+        # Have the track list ready before PlaybackNearlyFinished asks for it
+        client = get_audiobookshelf_client(session_attr)
+        if client:
+            get_track_cache().load_in_background(client, stream.item_id)
+
         return handler_input.response_builder.response
 
 
@@ -393,20 +549,41 @@ class PlaybackFinishedHandler(AbstractRequestHandler):
 
     def handle(self, handler_input):
         logger.info("Playback finished")
-        token = handler_input.request_envelope.request.token
+        stream = StreamToken.parse(handler_input.request_envelope.request.token)
         offset = handler_input.request_envelope.request.offset_in_milliseconds
 
-        # Update progress in AudioBookshelf
-        session_attr = handler_input.attributes_manager.session_attributes
+        if not stream:
+            return handler_input.response_builder.response
+
+        offset = stream.absolute_ms(offset)
+        get_playback_state_store().save(get_user_id(handler_input), stream.item_id, offset,
+                                        episode_id=stream.episode_id)
+
+        # Queue the final position for AudioBookshelf
+        session_attr = get_session_attributes(handler_input)
         client = get_audiobookshelf_client(session_attr)
 
-        if client and token:
+        if client:
             try:
-                offset_seconds = offset / 1000
-                client.update_progress(token, offset_seconds, offset_seconds)
-                logger.info("Progress updated successfully")
+                # Only the last file of a book finishes it; an episode finishes on its own
+                following = None
+                if not stream.episode_id and stream.index is not None:
+                    following = next_track(
+                        get_track_cache().get(client.base_url, stream.item_id), stream
+                    )
+
+                if following:
+                    get_progress_queue().enqueue(client, stream.item_id, following['start'])
+                else:
+                    get_progress_queue().enqueue(client, stream.item_id, offset / 1000,
+                                                 is_finished=True, episode_id=stream.episode_id)
+                if stream.episode_id:
+                    get_episode_cache().record_progress(client, stream.item_id, stream.episode_id,
+                                                        offset / 1000, is_finished=True)
+                get_prefetch_cache().invalidate(client)
+                logger.info("Progress queued")
             except Exception as e:
-                logger.error(f"Failed to update progress: {e}")
+                logger.error(f"Failed to queue progress: {e}")
 
         return handler_input.response_builder.response
 
@@ -419,23 +596,34 @@ class PlaybackStoppedHandler(AbstractRequestHandler):
 
     def handle(self, handler_input):
         logger.info("Playback stopped")
-        token = handler_input.request_envelope.request.token
+        stream = StreamToken.parse(handler_input.request_envelope.request.token)
         offset = handler_input.request_envelope.request.offset_in_milliseconds
 
+        if not stream:
+            return handler_input.response_builder.response
+
         # Save current position
-        session_attr = handler_input.attributes_manager.session_attributes
+        offset = stream.absolute_ms(offset)
+        get_playback_state_store().save(get_user_id(handler_input), stream.item_id, offset,
+                                        episode_id=stream.episode_id)
+
+        session_attr = get_session_attributes(handler_input)
         session_attr[SESSION_KEYS['OFFSET']] = offset
 
-        # Update progress in AudioBookshelf
+        # Queue the position for AudioBookshelf
         client = get_audiobookshelf_client(session_attr)
 
-        if client and token:
+        if client:
             try:
-                offset_seconds = offset / 1000
-                client.update_progress(token, offset_seconds, offset_seconds)
-                logger.info("Progress saved")
+                get_progress_queue().enqueue(client, stream.item_id, offset / 1000,
+                                             episode_id=stream.episode_id)
+                if stream.episode_id:
+                    get_episode_cache().record_progress(client, stream.item_id, stream.episode_id,
+                                                        offset / 1000)
+                get_prefetch_cache().invalidate(client)
+                logger.info("Progress queued")
             except Exception as e:
-                logger.error(f"Failed to save progress: {e}")
+                logger.error(f"Failed to queue progress: {e}")
 
         return handler_input.response_builder.response
 
@@ -448,8 +636,27 @@ class PlaybackNearlyFinishedHandler(AbstractRequestHandler):
 
     def handle(self, handler_input):
         logger.info("Playback nearly finished")
-        # Could enqueue next chapter/episode here
-        return handler_input.response_builder.response
+        token = handler_input.request_envelope.request.token
+        stream = StreamToken.parse(token)
+        client = get_audiobookshelf_client(get_session_attributes(handler_input))
+
+        # Whole-item streams have nothing to follow them
+        if not client or not stream or stream.index is None:
+            return handler_input.response_builder.response
+
+        # Normally cached on PlaybackStarted, so no upstream call is needed here
+        entry = get_track_cache().load(client, stream.item_id)
+        following = next_track(entry, stream)
+
+        if not following:
+            return handler_input.response_builder.response
+
+        next_stream = track_stream(client, stream.item_id, following)
+
+        return (handler_input.response_builder
+                .add_directive(build_enqueue_directive(entry, next_stream, token,
+                                                       client.base_url, client.token))
+                .response)
 
 
 class PlaybackFailedHandler(AbstractRequestHandler):
@@ -492,9 +699,13 @@ sb = SkillBuilder()
 sb.add_request_handler(LaunchRequestHandler())
 sb.add_request_handler(ContinueBookIntentHandler())
 sb.add_request_handler(PlayBookIntentHandler())
+sb.add_request_handler(PlayEpisodeIntentHandler())
 sb.add_request_handler(HelpIntentHandler())
 sb.add_request_handler(PauseIntentHandler())
 sb.add_request_handler(ResumeIntentHandler())
+sb.add_request_handler(SkipIntentHandler())
+sb.add_request_handler(SeekIntentHandler())
+sb.add_request_handler(ChapterIntentHandler())
 sb.add_request_handler(StopAndCancelIntentHandler())
 sb.add_request_handler(FallbackIntentHandler())
 sb.add_request_handler(PlaybackStartedHandler())
@@ -509,6 +720,7 @@ sb.add_exception_handler(ErrorHandler())
 
 # Build the skill
 skill = sb.create()
+instrument_skill(skill)
 
 
 # =============================================================================
@@ -521,41 +733,87 @@ def alexa_endpoint():
     Main Alexa skill endpoint
     Receives requests from Alexa and routes them to the skill
     """
-    try:
-        # Get request as dict
-        request_envelope = request.get_json()
-        
-        logger.info(f"Request type: {request_envelope.get('request', {}).get('type')}")
-
-        # Deserialize into proper RequestEnvelope object
-        serializer = DefaultSerializer()
-        request_envelope_obj = serializer.deserialize(
-            payload=json.dumps(request_envelope),
-            obj_type=RequestEnvelope
-        )
-        
-        # Invoke skill - returns ResponseEnvelope object
-        response_obj = skill.invoke(request_envelope_obj, None)
-        
-        # Serialize response back to dict
-        response_dict = serializer.serialize(response_obj)
-        
-        logger.info(f"Response generated")
-        
-        return jsonify(response_dict)
-
-    except Exception as e:
-        logger.error(f"Error processing request: {e}", exc_info=True)
-        return jsonify({
-            'version': '1.0',
-            'response': {
-                'outputSpeech': {
-                    'type': 'PlainText',
-                    'text': MESSAGES['ERROR']
-                },
-                'shouldEndSession': False
-            }
-        }), 500
+    start = time.perf_counter()
+    request_type = 'Invalid'
+
+    with request_log() as log:
+        try:
+            # Decode the raw body straight into a RequestEnvelope
+            body = request.get_data()
+            request_envelope_obj = decode_request(body)
+            request_type = request_envelope_obj.request.object_type
+            log.bind(request_envelope_obj.request.request_id, request_type)
+
+            if VERIFY_REQUESTS:
+                verify_request(request.headers, body, request_envelope_obj)
+
+            # Invoke skill - returns ResponseEnvelope object
+            # Every AudioBookshelf call shares the time Alexa gives us
+            with request_deadline():
+                response_obj = skill.invoke(request_envelope_obj, None)
+
+            return Response(encode_response(response_obj), mimetype='application/json')
+
+        except VerificationException as e:
+            logger.warning(f"Rejected request not verified as sent by Alexa: {e}")
+            return jsonify({'error': 'Request verification failed'}), 400
+
+        except Exception as e:
+            logger.error(f"Error processing request: {e}", exc_info=True)
+            return jsonify(error_envelope()), 500
+
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - start, request_type=request_type)
+
+
+def error_envelope():
+    """
+    Response envelope returned when a request cannot be processed at all
+    """
+    return {
+        'version': '1.0',
+        'response': {
+            'outputSpeech': {
+                'type': 'PlainText',
+                'text': MESSAGES['ERROR']
+            },
+            'shouldEndSession': False
+        }
+    }
+
+
+@app.route('/cover/<item_id>', methods=['GET'])
+def cover_art(item_id):
+    """
+    Cover art for Alexa devices, resized and cached on disk
+
+    Query parameters:
+        size: Wanted width in pixels, snapped to an offered art size
+        v: Cover version; versioned URLs may be cached forever
+        a: The account the URL was issued to, see covers.seal_account
+    """
+    account = open_account(request.args.get('a', ''))
+    if not account or not COVER_ITEM_ID.fullmatch(item_id):
+        return Response(status=404)
+    client = get_client(*account)
+
+    size = nearest_size(request.args.get('size', type=int))
+    version = request.args.get('v', '')
+    cache = get_cover_cache()
+    etag = cache.etag(client.base_url, item_id, version, size)
+    cache_control = 'public, max-age=31536000, immutable' if version else 'public, max-age=86400'
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        data = cache.load(client, item_id, version, size)
+        if data is None:
+            return Response(status=404)
+        response = Response(data, content_type='image/jpeg')
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 
 @app.route('/health', methods=['GET'])
@@ -564,6 +822,12 @@ def health_check():
     return jsonify({'status': 'healthy', 'service': 'audiobookshelf-alexa-skill'}), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics, summed over all workers"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
+
+
 @app.route('/', methods=['GET'])
 def index():
     """Index route"""
@@ -572,7 +836,9 @@ def index():
         'status': 'running',
         'endpoints': {
             '/alexa': 'POST - Alexa skill endpoint',
-            '/health': 'GET - Health check'
+            '/health': 'GET - Health check',
+            '/metrics': 'GET - Prometheus metrics',
+            '/cover/<item_id>': 'GET - Resized cover art'
         }
     }), 200
 
@@ -0,0 +1,139 @@
+"""
+ASGI entry point for the async serving mode
+Use with uvicorn, or gunicorn with uvicorn workers
+"""
+
+import os
+import json
+import time
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+from app import app as flask_app, skill, error_envelope
+from codec import decode_request, encode_response
+from async_handlers import dispatch_async
+from async_audiobookshelf_client import close_async_clients
+from deadline import request_deadline
+from logs import request_log
+from verifier import VerificationException, verification_enabled, verify_request
+from metrics import REQUEST_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Runs signature checks and the handlers without an async version. Resume, Skip,
+# Seek, Chapter, PlayEpisode and PlaybackNearlyFinished call AudioBookshelf
+# synchronously and hold a thread for up to the request deadline, so the pool
+# is sized for those calls being in flight at once, not just for local work
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('ASGI_SYNC_THREADS', 64)))
+
+# /health, / and any other route are served by the Flask app on a thread
+wsgi_app = WsgiToAsgi(flask_app)
+
+VERIFY_REQUESTS = verification_enabled()
+
+
+async def app(scope, receive, send):
+    """
+    ASGI application; /alexa is served natively on the event loop
+    """
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] == 'http' and scope['path'] == '/alexa' and scope['method'] == 'POST':
+        await alexa_endpoint(scope, receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+async def alexa_endpoint(scope, receive, send):
+    """
+    Main Alexa skill endpoint
+    Upstream calls are awaited, so one process can keep many requests in flight
+    """
+    body = await read_body(receive)
+    start = time.perf_counter()
+    request_type = 'Invalid'
+
+    with request_log() as log:
+        try:
+            request_envelope = decode_request(body)
+            request_type = request_envelope.request.object_type
+            log.bind(request_envelope.request.request_id, request_type)
+
+            if VERIFY_REQUESTS:
+                # A certificate chain download must not stall the event loop
+                headers = {name.decode('latin-1'): value.decode('latin-1')
+                           for name, value in scope['headers']}
+                context = contextvars.copy_context()
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(executor, context.run, verify_request,
+                                           headers, body, request_envelope)
+
+            with request_deadline():
+                response_obj = await dispatch_async(request_envelope)
+                if response_obj is None:
+                    # Carry the deadline over to the executor thread
+                    context = contextvars.copy_context()
+                    loop = asyncio.get_running_loop()
+                    response_obj = await loop.run_in_executor(
+                        executor, context.run, skill.invoke, request_envelope, None
+                    )
+
+            status, response_body = 200, encode_response(response_obj)
+
+        except VerificationException as e:
+            logger.warning(f"Rejected request not verified as sent by Alexa: {e}")
+            status, response_body = 400, b'{"error": "Request verification failed"}'
+
+        except Exception as e:
+            logger.error(f"Error processing request: {e}", exc_info=True)
+            status, response_body = 500, json.dumps(error_envelope()).encode('utf-8')
+
+    REQUEST_LATENCY.observe(time.perf_counter() - start, request_type=request_type)
+    await send_body(send, status, response_body)
+
+
+async def read_body(receive) -> bytes:
+    """
+    Read the full HTTP request body
+    """
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_body(send, status: int, body: bytes) -> None:
+    """
+    Send a JSON HTTP response
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode())
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    """
+    Handle ASGI startup and shutdown
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_clients()
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
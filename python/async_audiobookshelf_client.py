@@ -0,0 +1,524 @@
+"""
+Async AudioBookshelf API Client
+Non-blocking counterpart of AudioBookshelfClient for the ASGI serving mode
+"""
+
+import os
+import time
+import asyncio
+import contextvars
+import httpx
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+from audiobookshelf_client import DEFAULT_POOL_SIZE, DEFAULT_TIMEOUT, PLAY_SESSION_REQUEST
+from breaker import CircuitBreaker, get_breaker
+from deadline import call_timeout
+from httpcache import (
+    LIBRARIES_FRESHNESS, ITEM_FRESHNESS, ITEMS_IN_PROGRESS_FRESHNESS, get_http_cache, lookup, resolve
+)
+from models import Item
+from ratelimit import HostRateLimiter, get_rate_limiter
+from payloads import parse_items_in_progress, parse_search, parse_item, parse_libraries
+from client_registry import get_client
+from metrics import observe_cache, observe_upstream_async, HEDGED_REQUESTS
+from singleflight import AsyncSingleFlight
+from tokens import get_token_manager
+
+logger = logging.getLogger(__name__)
+
+
+def _succeeded(task: asyncio.Future) -> bool:
+    return task.exception() is None and task.result().status_code < 500
+
+
+class BreakerTransport(httpx.AsyncHTTPTransport):
+    """Connection pool that goes through the host's rate limit and the server's circuit breaker"""
+
+    def __init__(self, breaker: CircuitBreaker, limiter: Optional[HostRateLimiter] = None,
+                 account: str = '', **kwargs):
+        self.breaker = breaker
+        self.limiter = limiter
+        self.account = account
+        super().__init__(**kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.limiter is not None:
+            await self.limiter.acquire_async(self.account, DEFAULT_TIMEOUT)
+        self.breaker.before_call()
+        try:
+            response = await super().handle_async_request(request)
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+class AsyncTokenAuth(httpx.Auth):
+    """Bearer auth that replaces a rejected token once and replays the request"""
+
+    def __init__(self, client: 'AsyncAudioBookshelfClient'):
+        self.client = client
+
+    async def async_auth_flow(self, request: httpx.Request):
+        token = self.client.access_token
+        request.headers['Authorization'] = f'Bearer {token}'
+        response = yield request
+
+        if response.status_code == 401:
+            token = await self.client.refresh_access_token(token)
+            if token:
+                request.headers['Authorization'] = f'Bearer {token}'
+                yield request
+
+
+class AsyncAudioBookshelfClient:
+    """Async client for interacting with AudioBookshelf API"""
+
+    def __init__(self, base_url: str, token: str, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: float = DEFAULT_TIMEOUT, hedge_delay: float = 0):
+        """
+        Initialize the async AudioBookshelf client
+
+        Args:
+            base_url: The base URL of the AudioBookshelf server
+            token: JWT token or API token for authentication; identifies the
+                client even after the token is refreshed
+            pool_size: Maximum number of keep-alive connections to the server
+            timeout: Timeout in seconds for calls made outside an Alexa request;
+                inside one, calls get whatever is left of the request deadline
+            hedge_delay: Seconds to wait on a GET before sending a second copy;
+                0 disables hedging
+        """
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
+        self._flights = AsyncSingleFlight()
+        self.session = httpx.AsyncClient(
+            headers={'Content-Type': 'application/json'},
+            auth=AsyncTokenAuth(self),
+            transport=BreakerTransport(
+                get_breaker(self.base_url),
+                get_rate_limiter(self.base_url),
+                token,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size
+                )
+            ),
+            timeout=timeout
+        )
+
+    @property
+    def access_token(self) -> str:
+        """
+        Token currently sent to the server, see tokens.TokenManager
+        """
+        return get_token_manager().current(self.base_url, self.token)
+
+    async def refresh_access_token(self, failed_token: str) -> Optional[str]:
+        """
+        Replace a token the server rejected, if credentials are configured
+
+        The refresh may wait on another worker's login, so it runs on the
+        default executor and logs in with the pooled sync client.
+
+        Args:
+            failed_token: Token the server answered 401 to
+
+        Returns:
+            New access token, or None if it cannot be refreshed
+        """
+        manager = get_token_manager()
+        if not manager.can_refresh(self.base_url, self.token):
+            return None
+
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, context.run, manager.refresh, self.base_url, self.token, failed_token,
+            get_client(self.base_url, self.token).login
+        )
+
+    def _timeout(self) -> httpx.Timeout:
+        connect, read = call_timeout(self.timeout)
+        return httpx.Timeout(read, connect=connect)
+
+    async def _get(self, path: str, params: Optional[Dict] = None,
+                   headers: Optional[Dict] = None) -> httpx.Response:
+        """
+        Send an idempotent GET within the request deadline
+
+        Identical GETs already in flight on this client are not sent again;
+        callers await that request and share its response.
+
+        Args:
+            path: API path starting with /api
+            params: Query parameters
+            headers: Extra request headers, e.g. conditional ones
+
+        Returns:
+            HTTP response, possibly shared with other callers
+        """
+        query = tuple(sorted((params or {}).items()))
+        extra = tuple(sorted((headers or {}).items()))
+        return await self._flights.do((path, query, extra),
+                                      lambda: self._send_get(path, params, headers))
+
+    async def _get_cached(self, path: str, parse: Callable[[str], Any],
+                          default_freshness: float) -> Any:
+        """
+        Send a GET through the HTTP cache shared with the sync client
+
+        See AudioBookshelfClient._get_cached.
+
+        Args:
+            path: API path starting with /api
+            parse: Turns the response body into the returned value
+            default_freshness: Seconds a response is used without asking the
+                server when it states no lifetime of its own
+
+        Returns:
+            Parsed response body, shared with other callers; do not modify it
+
+        Raises:
+            httpx.HTTPStatusError: If the server answers with an error status
+        """
+        cache = get_http_cache()
+        if cache is None:
+            response = await self._get(path)
+            response.raise_for_status()
+            return parse(response.content.decode('utf-8'))
+
+        key = (self.base_url, self.token, path)
+        entry, fresh = lookup(cache, key, parse)
+        if fresh:
+            return entry.value
+
+        response = await self._get(path, headers=entry.validators() if entry else None)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return resolve(cache, key, entry, response.status_code, response.headers,
+                       response.content, parse, default_freshness)
+
+    async def _send_get(self, path: str, params: Optional[Dict] = None,
+                        headers: Optional[Dict] = None) -> httpx.Response:
+        """
+        Send a GET, hedged when enabled
+
+        When hedging is enabled and the first attempt has not succeeded
+        after hedge_delay, a second copy is sent; whichever succeeds first
+        is used and the other is cancelled.
+
+        Args:
+            path: API path starting with /api
+            params: Query parameters
+            headers: Extra request headers
+
+        Returns:
+            HTTP response
+        """
+        url = f"{self.base_url}{path}"
+        timeout = self._timeout()
+
+        if not self.hedge_delay or timeout.read <= self.hedge_delay:
+            return await self.session.get(url, params=params, headers=headers, timeout=timeout)
+
+        first = asyncio.ensure_future(
+            self.session.get(url, params=params, headers=headers, timeout=timeout)
+        )
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay)
+        if done and _succeeded(first):
+            return first.result()
+
+        hedge = asyncio.ensure_future(
+            self.session.get(url, params=params, headers=headers, timeout=self._timeout())
+        )
+        pending = {hedge} if done else {first, hedge}
+        failed = first
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if _succeeded(task):
+                        HEDGED_REQUESTS.inc(result='hedge' if task is hedge else 'first')
+                        return task.result()
+                    failed = task
+        finally:
+            for task in pending:
+                task.cancel()
+
+        HEDGED_REQUESTS.inc(result='failed')
+        return failed.result()
+
+    @observe_upstream_async
+    async def get_libraries(self) -> List[Dict]:
+        """
+        Get all libraries
+
+        Returns:
+            List of library objects
+
+        Raises:
+            Exception: If request fails
+        """
+        try:
+            return list(await self._get_cached('/api/libraries', parse_libraries,
+                                               LIBRARIES_FRESHNESS))
+
+        except Exception as e:
+            logger.error(f'Failed to get libraries: {e}')
+            raise Exception('Failed to retrieve libraries')
+
+    @observe_upstream_async
+    async def search_library(self, library_id: str, query: str,
+                             limit: int = 10) -> Dict[str, List[Item]]:
+        """
+        Search for items in a library
+
+        Args:
+            library_id: The library ID to search in
+            query: Search query
+            limit: Maximum number of results
+
+        Returns:
+            Dict with 'book' and 'podcast' hits
+
+        Raises:
+            Exception: If search fails
+        """
+        try:
+            response = await self._get(
+                f"/api/libraries/{library_id}/search",
+                params={'q': query, 'limit': limit}
+            )
+            response.raise_for_status()
+            return parse_search(response.content.decode('utf-8'))
+
+        except Exception as e:
+            logger.error(f'Search failed: {e}')
+            raise Exception('Failed to search library')
+
+    @observe_upstream_async
+    async def get_items_in_progress(self) -> List[Item]:
+        """
+        Get items currently in progress
+
+        Returns:
+            List of items in progress, each with its progress
+
+        Raises:
+            Exception: If request fails
+        """
+        try:
+            return list(await self._get_cached('/api/me/items-in-progress',
+                                               parse_items_in_progress,
+                                               ITEMS_IN_PROGRESS_FRESHNESS))
+
+        except Exception as e:
+            logger.error(f'Failed to get items in progress: {e}')
+            raise Exception('Failed to retrieve in-progress items')
+
+    @observe_upstream_async
+    async def get_library_item(self, item_id: str) -> Item:
+        """
+        Get a specific library item by ID
+
+        Args:
+            item_id: The library item ID
+
+        Returns:
+            Library item with its track list
+
+        Raises:
+            Exception: If request fails
+        """
+        try:
+            return await self._get_cached(f"/api/items/{item_id}", parse_item, ITEM_FRESHNESS)
+
+        except Exception as e:
+            logger.error(f'Failed to get library item: {e}')
+            raise Exception('Failed to retrieve library item')
+
+    @observe_upstream_async
+    async def batch_update_progress(self, updates: List[Dict]) -> None:
+        """
+        Update playback progress for several items in one request
+
+        Args:
+            updates: Progress payloads, each with 'libraryItemId'
+
+        Raises:
+            Exception: If the update fails
+        """
+        try:
+            response = await self.session.patch(
+                f"{self.base_url}/api/me/progress/batch/update",
+                json=updates,
+                timeout=self._timeout()
+            )
+            response.raise_for_status()
+
+        except Exception as e:
+            logger.error(f'Failed to batch update progress: {e}')
+            raise Exception('Failed to update progress')
+
+    def get_stream_url(self, item_id: str) -> str:
+        """
+        Get streaming URL for an audiobook or podcast episode
+
+        Args:
+            item_id: The library item ID
+
+        Returns:
+            Stream URL with authentication
+        """
+        return f"{self.base_url}/api/items/{item_id}/play?token={self.access_token}"
+
+    def get_track_url(self, content_url: str) -> str:
+        """
+        Get streaming URL for a single audio file of an item
+
+        Args:
+            content_url: Server-relative file URL, e.g. /api/items/<id>/file/<ino>
+
+        Returns:
+            Track URL with authentication
+        """
+        return f"{self.base_url}{content_url}?token={self.access_token}"
+
+    @observe_upstream_async
+    async def start_play_session(self, item_id: str, episode_id: Optional[str] = None) -> Dict:
+        """
+        Open a playback session, letting the server pick direct play or transcoding
+
+        Args:
+            item_id: The library item ID
+            episode_id: Podcast episode ID, if any
+
+        Returns:
+            Playback session with 'id', 'playMethod' and 'audioTracks'
+
+        Raises:
+            Exception: If request fails
+        """
+        path = f"/api/items/{item_id}/play"
+        if episode_id:
+            path += f"/{episode_id}"
+
+        try:
+            response = await self.session.post(
+                f"{self.base_url}{path}",
+                json=PLAY_SESSION_REQUEST,
+                timeout=self._timeout()
+            )
+            response.raise_for_status()
+            return response.json()
+
+        except Exception as e:
+            logger.error(f'Failed to start play session: {e}')
+            raise Exception('Failed to start play session')
+
+    @observe_upstream_async
+    async def close_session(self, session_id: str) -> None:
+        """
+        Close a playback session
+
+        Args:
+            session_id: The playback session ID
+        """
+        try:
+            await self.session.post(f"{self.base_url}/api/session/{session_id}/close",
+                                    timeout=self._timeout())
+        except Exception as e:
+            logger.error(f'Failed to close session: {e}')
+            # Don't raise - session cleanup is not critical
+
+    async def aclose(self) -> None:
+        """
+        Close the underlying HTTP client and its pooled connections
+        """
+        await self.session.aclose()
+
+
+_clients = OrderedDict()
+
+
+def get_async_client(base_url: str, token: str, pool_size: int = DEFAULT_POOL_SIZE,
+                     hedge_delay: float = 0) -> AsyncAudioBookshelfClient:
+    """
+    Get a pooled async client for a server/token pair
+
+    Clients are bound to the running event loop; the ASGI app closes them
+    on shutdown with close_async_clients(). Like the sync client_registry,
+    at most ABS_CLIENT_CACHE_SIZE clients are kept and those unused for
+    ABS_CLIENT_IDLE_TTL seconds are dropped.
+
+    Args:
+        base_url: The base URL of the AudioBookshelf server
+        token: JWT token or API token for authentication
+        pool_size: Maximum number of keep-alive connections to the server
+        hedge_delay: Seconds to wait on a GET before sending a second copy
+
+    Returns:
+        AsyncAudioBookshelfClient instance
+    """
+    key = (base_url.rstrip('/'), token)
+    now = time.monotonic()
+
+    entry = _clients.get(key)
+    if entry:
+        client, _ = entry
+        _clients[key] = (client, now)
+        _clients.move_to_end(key)
+        observe_cache('abs_async_clients', True)
+        return client
+
+    client = AsyncAudioBookshelfClient(key[0], token, pool_size=pool_size,
+                                       hedge_delay=hedge_delay)
+    _clients[key] = (client, now)
+    _evict(now)
+    observe_cache('abs_async_clients', False)
+    return client
+
+
+def _evict(now: float) -> None:
+    """
+    Drop idle and least recently used clients
+
+    Dropped clients are not closed: requests that got them earlier may still
+    be awaiting them, and their connections are closed once the last
+    reference is gone.
+    """
+    max_clients = int(os.getenv('ABS_CLIENT_CACHE_SIZE', 32))
+    idle_ttl = float(os.getenv('ABS_CLIENT_IDLE_TTL', 900))
+    evicted = 0
+
+    # Oldest entries sit at the front, so stop at the first fresh one
+    while _clients:
+        key, (_, last_used) = next(iter(_clients.items()))
+        if len(_clients) <= max_clients and now - last_used < idle_ttl:
+            break
+        del _clients[key]
+        evicted += 1
+
+    if evicted:
+        logger.debug(f'Evicted {evicted} async AudioBookshelf client(s)')
+
+
+async def close_async_clients() -> None:
+    """
+    Close every pooled async client
+    """
+    clients = [client for client, _ in _clients.values()]
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
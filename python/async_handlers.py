@@ -0,0 +1,214 @@
+"""
+Async request handlers for the ASGI serving mode
+Only intents that wait on AudioBookshelf in the request path live here;
+everything else is answered by the regular skill in app.py
+"""
+
+import os
+import time
+import logging
+from typing import Dict, Optional
+
+from ask_sdk_core.attributes_manager import AttributesManager
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.utils import is_intent_name, RESPONSE_FORMAT_VERSION
+from ask_sdk_model import RequestEnvelope, ResponseEnvelope
+from ask_sdk_runtime.utils import UserAgentManager
+
+from async_audiobookshelf_client import AsyncAudioBookshelfClient, get_async_client
+from catalog import get_catalog
+from metrics import HANDLER_LATENCY, HANDLER_ERRORS
+from prefetch import get_prefetch_cache
+from search import search_order, search_libraries_async
+from tracks import StreamChoice, choose_stream, get_track_cache
+from client_registry import get_client
+from helpers import get_server_config, get_user_id
+from responses import (
+    not_configured_response, error_response, no_items_in_progress_response,
+    book_not_found_response, continue_response, play_response, progress_position
+)
+from constants import SESSION_KEYS
+
+logger = logging.getLogger(__name__)
+
+
+async def choose_stream_async(client: AsyncAudioBookshelfClient, item_id: str,
+                              offset_ms: int, episode_id: Optional[str] = None) -> StreamChoice:
+    """
+    Pick the track to stream, negotiating a playback session on a track cache miss
+
+    Args:
+        client: Async AudioBookshelf client for the server
+        item_id: The library item ID
+        offset_ms: Position within the item (or episode) in milliseconds
+        episode_id: Podcast episode to play, if any
+
+    Returns:
+        StreamChoice with the token, URL and offset within the track
+    """
+    entry = await get_track_cache().load_async(client, item_id)
+    return choose_stream(client, entry, item_id, offset_ms, episode_id)
+
+
+def get_async_audiobookshelf_client(session_attributes: Dict) -> Optional[AsyncAudioBookshelfClient]:
+    """
+    Get async AudioBookshelf client from session attributes or environment
+
+    Args:
+        session_attributes: Session attributes dictionary
+
+    Returns:
+        Pooled AsyncAudioBookshelfClient instance or None if not configured
+    """
+    base_url, token = get_server_config(session_attributes)
+
+    if not base_url or not token:
+        return None
+
+    return get_async_client(
+        base_url, token,
+        pool_size=int(os.getenv('ABS_ASYNC_POOL_SIZE', 100)),
+        hedge_delay=float(os.getenv('ABS_HEDGE_DELAY_MS', 0)) / 1000
+    )
+
+
+class AsyncContinueBookIntentHandler:
+    """Async handler for ContinueBookIntent"""
+
+    def can_handle(self, handler_input):
+        return is_intent_name("ContinueBookIntent")(handler_input)
+
+    async def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        client = get_async_audiobookshelf_client(session_attr)
+
+        if not client:
+            return not_configured_response(handler_input)
+
+        try:
+            prefetch = get_prefetch_cache()
+            prefetch.record_visit(get_user_id(handler_input), client)
+            items_in_progress = await prefetch.load_async(client)
+
+            if not items_in_progress:
+                return no_items_in_progress_response(handler_input)
+
+            item = items_in_progress[0]
+            offset_ms, episode_id = progress_position(item, get_user_id(handler_input))
+            stream = await choose_stream_async(client, item.id, offset_ms, episode_id)
+
+            return continue_response(handler_input, item, stream)
+
+        except Exception as e:
+            logger.error(f"Error continuing book: {e}")
+            return error_response(handler_input)
+
+
+class AsyncPlayBookIntentHandler:
+    """Async handler for PlayBookIntent"""
+
+    def can_handle(self, handler_input):
+        return is_intent_name("PlayBookIntent")(handler_input)
+
+    async def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        client = get_async_audiobookshelf_client(session_attr)
+
+        if not client:
+            return not_configured_response(handler_input)
+
+        slots = handler_input.request_envelope.request.intent.slots
+        book_name = slots.get('bookName', {}).value if slots.get('bookName') else None
+
+        if not book_name:
+            return (handler_input.response_builder
+                    .speak('What book would you like to play?')
+                    .ask('Please tell me the name of a book.')
+                    .response)
+
+        try:
+            # Catalog lookups are local; only the first library fetch goes upstream
+            catalog = get_catalog()
+            libraries = catalog.stored_libraries(client.base_url, client.token)
+
+            if not libraries:
+                libraries = await client.get_libraries()
+                catalog.store_libraries(client.base_url, client.token, libraries)
+
+            if not libraries:
+                return (handler_input.response_builder
+                        .speak("I couldn't find any libraries in your AudioBookshelf account.")
+                        .response)
+
+            library_ids = search_order(libraries, session_attr.get(SESSION_KEYS['LIBRARY_ID']))
+
+            # Background catalog syncs run on a thread with the pooled sync client
+            item = catalog.find_item(get_client(client.base_url, client.token), library_ids,
+                                     book_name, media_type=None)
+
+            if not item:
+                hits = await search_libraries_async(client, library_ids, book_name)
+
+                if not hits:
+                    return book_not_found_response(handler_input, book_name)
+
+                item = hits[0]
+
+            library_id = item.library_id or library_ids[0]
+
+            stream = await choose_stream_async(client, item.id, 0)
+
+            return play_response(handler_input, item, stream, library_id)
+
+        except Exception as e:
+            logger.error(f"Error playing book: {e}")
+            return error_response(handler_input)
+
+
+ASYNC_HANDLERS = [
+    AsyncContinueBookIntentHandler(),
+    AsyncPlayBookIntentHandler()
+]
+
+
+async def dispatch_async(request_envelope: RequestEnvelope) -> Optional[ResponseEnvelope]:
+    """
+    Answer a request with an async handler, if one can handle it
+
+    Args:
+        request_envelope: Deserialized Alexa request
+
+    Returns:
+        ResponseEnvelope, or None if the request should go to the sync skill
+    """
+    handler_input = HandlerInput(
+        request_envelope=request_envelope,
+        attributes_manager=AttributesManager(request_envelope=request_envelope)
+    )
+
+    for handler in ASYNC_HANDLERS:
+        if not handler.can_handle(handler_input):
+            continue
+
+        # Reported under the sync handler's name so both serving modes share series
+        name = type(handler).__name__[len('Async'):]
+        start = time.perf_counter()
+        try:
+            response = await handler.handle(handler_input)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name)
+            logger.error(f"Error handled: {e}", exc_info=True)
+            response = error_response(handler_input)
+        HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+        session_attributes = None
+        if request_envelope.session is not None:
+            session_attributes = handler_input.attributes_manager.session_attributes
+
+        return ResponseEnvelope(
+            response=response, version=RESPONSE_FORMAT_VERSION,
+            session_attributes=session_attributes,
+            user_agent=UserAgentManager.get_user_agent()
+        )
+
+    return None
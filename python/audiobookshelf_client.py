@@ -3,37 +3,328 @@ AudioBookshelf API Client
 Handles all interactions with the AudioBookshelf server API
 """
 
+import os
+import threading
+import contextvars
 import requests
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from typing import Any, Callable, Dict, List, Optional, Tuple
 import logging
 
+from breaker import CircuitBreaker, get_breaker
+from constants import ALEXA_MIME_TYPES
+from deadline import call_timeout
+from httpcache import (
+    LIBRARIES_FRESHNESS, ITEM_FRESHNESS, ITEMS_IN_PROGRESS_FRESHNESS, get_http_cache, lookup, resolve
+)
+from models import Item, Progress
+from ratelimit import HostRateLimiter, get_rate_limiter
+from payloads import (
+    parse_items_in_progress, parse_search, parse_item, parse_media_progress, parse_libraries
+)
+from metrics import observe_upstream, HEDGED_REQUESTS
+from singleflight import SingleFlight, get_shared_flights
+from tokens import get_token_manager
+
 logger = logging.getLogger(__name__)
 
+# Default number of keep-alive connections kept open to the AudioBookshelf host
+DEFAULT_POOL_SIZE = 10
+
+# Timeout in seconds for calls made outside an Alexa request, e.g. background syncs
+DEFAULT_TIMEOUT = 10
+
+# Play session request: the server direct-plays files whose MIME type Alexa
+# supports and transcodes the rest
+PLAY_SESSION_REQUEST = {
+    'deviceInfo': {'clientName': 'Alexa Skill', 'deviceId': 'alexa-skill'},
+    'mediaPlayer': 'alexa',
+    'supportedMimeTypes': ALEXA_MIME_TYPES,
+    'forceDirectPlay': False,
+    'forceTranscode': False
+}
+
+_hedge_pool = None
+_hedge_pool_pid = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> ThreadPoolExecutor:
+    """
+    Get this process's thread pool for hedged GETs
+    """
+    global _hedge_pool, _hedge_pool_pid
+
+    pid = os.getpid()
+    if _hedge_pool_pid != pid:
+        with _hedge_pool_lock:
+            if _hedge_pool_pid != pid:
+                # Threads do not survive a fork, so the child needs its own pool
+                _hedge_pool = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('ABS_HEDGE_THREADS', 32)),
+                    thread_name_prefix='abs-hedge'
+                )
+                _hedge_pool_pid = pid
+
+    return _hedge_pool
+
+
+def _succeeded(future: Future) -> bool:
+    return future.exception() is None and future.result().status_code < 500
+
+
+class BreakerAdapter(HTTPAdapter):
+    """Connection pool that goes through the host's rate limit and the server's circuit breaker"""
+
+    def __init__(self, breaker: CircuitBreaker, limiter: Optional[HostRateLimiter] = None,
+                 account: str = '', **kwargs):
+        self.breaker = breaker
+        self.limiter = limiter
+        self.account = account
+        super().__init__(**kwargs)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self.limiter is not None:
+            self.limiter.acquire(self.account, DEFAULT_TIMEOUT)
+        self.breaker.before_call()
+        try:
+            response = super().send(request, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.breaker.record_failure()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+def _anonymous(request: requests.PreparedRequest) -> requests.PreparedRequest:
+    return request
+
+
+class TokenAuth(requests.auth.AuthBase):
+    """Bearer auth that replaces a rejected token once and replays the request"""
+
+    def __init__(self, client: 'AudioBookshelfClient'):
+        self.client = client
+
+    def __call__(self, request: requests.PreparedRequest) -> requests.PreparedRequest:
+        request.headers['Authorization'] = f'Bearer {self.client.access_token}'
+        request.register_hook('response', self.handle_401)
+        return request
+
+    def handle_401(self, response: requests.Response, **kwargs) -> requests.Response:
+        """
+        Response hook that refreshes the token and resends the request on a 401
+        """
+        if response.status_code != 401 or getattr(response.request, 'replayed', False):
+            return response
+
+        failed_token = response.request.headers['Authorization'][len('Bearer '):]
+        token = self.client.refresh_access_token(failed_token)
+        if not token:
+            return response
+
+        # Release the connection before sending the replay on it
+        response.content
+        response.close()
+
+        replay = response.request.copy()
+        replay.headers['Authorization'] = f'Bearer {token}'
+        replay.replayed = True
+        retried = response.connection.send(replay, **kwargs)
+        retried.history.append(response)
+        retried.request = replay
+        return retried
+
 
 class AudioBookshelfClient:
     """Client for interacting with AudioBookshelf API"""
 
-    def __init__(self, base_url: str, token: str):
+    def __init__(self, base_url: str, token: str, pool_size: int = DEFAULT_POOL_SIZE,
+                 timeout: float = DEFAULT_TIMEOUT, hedge_delay: float = 0):
         """
         Initialize the AudioBookshelf client
 
         Args:
             base_url: The base URL of the AudioBookshelf server
-            token: JWT token or API token for authentication
+            token: JWT token or API token for authentication; identifies the
+                client even after the token is refreshed
+            pool_size: Maximum number of keep-alive connections to the server
+            timeout: Timeout in seconds for calls made outside an Alexa request;
+                inside one, calls get whatever is left of the request deadline
+            hedge_delay: Seconds to wait on a GET before sending a second copy;
+                0 disables hedging
         """
         self.base_url = base_url.rstrip('/')
         self.token = token
+        self.timeout = timeout
+        self.hedge_delay = hedge_delay
         self.session = requests.Session()
-        self.session.headers.update({
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json'
-        })
-        self.session.timeout = 10
+        self._flights = SingleFlight()
+
+        # Keep connections to the server alive between Alexa requests, share
+        # its host fairly with other accounts, and stop calling it while its
+        # circuit is open
+        adapter = BreakerAdapter(get_breaker(self.base_url), get_rate_limiter(self.base_url),
+                                 token, pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.session.auth = TokenAuth(self)
+
+    @property
+    def access_token(self) -> str:
+        """
+        Token currently sent to the server, see tokens.TokenManager
+        """
+        return get_token_manager().current(self.base_url, self.token)
+
+    def refresh_access_token(self, failed_token: str) -> Optional[str]:
+        """
+        Replace a token the server rejected, if credentials are configured
+
+        Args:
+            failed_token: Token the server answered 401 to
+
+        Returns:
+            New access token, or None if it cannot be refreshed
+        """
+        return get_token_manager().refresh(self.base_url, self.token, failed_token, self.login)
+
+    def _get(self, path: str, params: Optional[Dict] = None,
+             headers: Optional[Dict] = None) -> requests.Response:
+        """
+        Send an idempotent GET within the request deadline
+
+        Identical GETs already in flight on this client are not sent again;
+        callers wait for that request and share its response. With
+        ABS_SINGLE_FLIGHT_SHARED set, the same goes for other workers.
+
+        Args:
+            path: API path starting with /api
+            params: Query parameters
+            headers: Extra request headers, e.g. conditional ones
+
+        Returns:
+            HTTP response, possibly shared with other callers
+        """
+        query = tuple(sorted((params or {}).items()))
+        extra = tuple(sorted((headers or {}).items()))
+        wait = call_timeout(self.timeout)[1]
+        return self._flights.do((path, query, extra),
+                                lambda: self._get_shared(path, query, extra, params, headers),
+                                timeout=wait)
+
+    def _get_shared(self, path: str, query: tuple, extra: tuple, params: Optional[Dict],
+                    headers: Optional[Dict]) -> requests.Response:
+        shared = get_shared_flights()
+        if shared is None:
+            return self._send_get(path, params, headers)
+
+        key = f'{self.base_url}\n{self.token}\n{path}\n{query}'
+        if extra:
+            key += f'\n{extra}'
+        return shared.do(key, lambda: self._send_get(path, params, headers),
+                         timeout=call_timeout(self.timeout)[1])
+
+    def _get_cached(self, path: str, parse: Callable[[str], Any],
+                    default_freshness: float) -> Any:
+        """
+        Send a GET through the HTTP cache
+
+        A fresh stored response is used without calling the server; a
+        stale one is revalidated with a conditional GET, so an unchanged
+        resource costs a 304 instead of its full body.
+
+        Args:
+            path: API path starting with /api
+            parse: Turns the response body into the returned value
+            default_freshness: Seconds a response is used without asking the
+                server when it states no lifetime of its own
 
+        Returns:
+            Parsed response body, shared with other callers; do not modify it
+
+        Raises:
+            requests.HTTPError: If the server answers with an error status
+        """
+        cache = get_http_cache()
+        if cache is None:
+            response = self._get(path)
+            response.raise_for_status()
+            return parse(response.content.decode('utf-8'))
+
+        key = (self.base_url, self.token, path)
+        entry, fresh = lookup(cache, key, parse)
+        if fresh:
+            return entry.value
+
+        response = self._get(path, headers=entry.validators() if entry else None)
+        if response.status_code != 304:
+            response.raise_for_status()
+        return resolve(cache, key, entry, response.status_code, response.headers,
+                       response.content, parse, default_freshness)
+
+    def _send_get(self, path: str, params: Optional[Dict] = None,
+                  headers: Optional[Dict] = None) -> requests.Response:
+        """
+        Send a GET, hedged when enabled
+
+        When hedging is enabled and the first attempt has not succeeded
+        after hedge_delay, a second copy is sent and whichever succeeds
+        first is used.
+
+        Args:
+            path: API path starting with /api
+            params: Query parameters
+            headers: Extra request headers
+
+        Returns:
+            HTTP response
+        """
+        url = f"{self.base_url}{path}"
+        timeout = call_timeout(self.timeout)
+
+        if not self.hedge_delay or timeout[1] <= self.hedge_delay:
+            return self.session.get(url, params=params, headers=headers, timeout=timeout)
+
+        pool = _get_hedge_pool()
+        # Each attempt carries the request deadline and log context into its
+        # pool thread, so it is rate-limited, timed and logged as this request
+        first = pool.submit(contextvars.copy_context().run, self.session.get, url,
+                            params=params, headers=headers, timeout=timeout)
+        done, _ = wait([first], timeout=self.hedge_delay)
+        if done and _succeeded(first):
+            return first.result()
+
+        hedge = pool.submit(contextvars.copy_context().run, self.session.get, url,
+                            params=params, headers=headers, timeout=call_timeout(self.timeout))
+        pending = {hedge} if done else {first, hedge}
+        failed = first
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _succeeded(future):
+                    HEDGED_REQUESTS.inc(result='hedge' if future is hedge else 'first')
+                    return future.result()
+                failed = future
+
+        HEDGED_REQUESTS.inc(result='failed')
+        return failed.result()
+
+    @observe_upstream
     def login(self, username: str, password: str) -> Dict:
         """
         Login to AudioBookshelf and get JWT token
 
+        The client keeps sending its current token; see refresh_access_token
+        for replacing it.
+
         Args:
             username: AudioBookshelf username
             password: AudioBookshelf password
@@ -45,17 +336,16 @@ class AudioBookshelfClient:
             Exception: If login fails
         """
         try:
-            response = requests.post(
-                f"{self.base_url}/api/login",
+            response = self.session.post(
+                f"{self.base_url}/login",
                 json={'username': username, 'password': password},
-                timeout=10
+                auth=_anonymous,
+                timeout=call_timeout(self.timeout)
             )
             response.raise_for_status()
 
             data = response.json()
             if data and 'user' in data:
-                self.token = data['user']['token']
-                self.session.headers['Authorization'] = f'Bearer {self.token}'
                 return data
 
             raise Exception('Invalid login response')
@@ -64,6 +354,7 @@ class AudioBookshelfClient:
             logger.error(f'Login failed: {e}')
             raise Exception('Failed to authenticate with AudioBookshelf')
 
+    @observe_upstream
     def get_libraries(self) -> List[Dict]:
         """
         Get all libraries
@@ -75,16 +366,15 @@ class AudioBookshelfClient:
             Exception: If request fails
         """
         try:
-            response = self.session.get(f"{self.base_url}/api/libraries")
-            response.raise_for_status()
-            data = response.json()
-            return data.get('libraries', [])
+            return list(self._get_cached('/api/libraries', parse_libraries, LIBRARIES_FRESHNESS))
 
         except Exception as e:
             logger.error(f'Failed to get libraries: {e}')
             raise Exception('Failed to retrieve libraries')
 
-    def search_library(self, library_id: str, query: str, limit: int = 10) -> Dict:
+    @observe_upstream
+    def search_library(self, library_id: str, query: str,
+                       limit: int = 10) -> Dict[str, List[Item]]:
         """
         Search for items in a library
 
@@ -94,44 +384,101 @@ class AudioBookshelfClient:
             limit: Maximum number of results
 
         Returns:
-            Search results
+            Dict with 'book' and 'podcast' hits
 
         Raises:
             Exception: If search fails
         """
         try:
-            response = self.session.get(
-                f"{self.base_url}/api/libraries/{library_id}/search",
+            response = self._get(
+                f"/api/libraries/{library_id}/search",
                 params={'q': query, 'limit': limit}
             )
             response.raise_for_status()
-            return response.json()
+            return parse_search(response.content.decode('utf-8'))
 
         except Exception as e:
             logger.error(f'Search failed: {e}')
             raise Exception('Failed to search library')
 
-    def get_items_in_progress(self) -> List[Dict]:
+    @observe_upstream
+    def get_library_items(self, library_id: str, page: int = 0, limit: int = 500,
+                          sort: str = 'updatedAt', desc: bool = True) -> Dict:
         """
-        Get items currently in progress
+        Get one page of items in a library
+
+        Args:
+            library_id: The library ID
+            page: Zero-based page number
+            limit: Items per page
+            sort: Field to sort by
+            desc: Sort in descending order
 
         Returns:
-            List of items in progress
+            Page of minified library items with 'results' and 'total'
 
         Raises:
             Exception: If request fails
         """
         try:
-            response = self.session.get(f"{self.base_url}/api/me/items-in-progress")
+            response = self._get(
+                f"/api/libraries/{library_id}/items",
+                params={
+                    'page': page,
+                    'limit': limit,
+                    'sort': sort,
+                    'desc': 1 if desc else 0,
+                    'minified': 1
+                }
+            )
             response.raise_for_status()
-            data = response.json()
-            return data.get('libraryItems', [])
+            return response.json()
+
+        except Exception as e:
+            logger.error(f'Failed to get library items: {e}')
+            raise Exception('Failed to retrieve library items')
+
+    @observe_upstream
+    def get_items_in_progress(self) -> List[Item]:
+        """
+        Get items currently in progress
+
+        Returns:
+            List of items in progress, each with its progress
+
+        Raises:
+            Exception: If request fails
+        """
+        try:
+            return list(self._get_cached('/api/me/items-in-progress', parse_items_in_progress,
+                                         ITEMS_IN_PROGRESS_FRESHNESS))
 
         except Exception as e:
             logger.error(f'Failed to get items in progress: {e}')
             raise Exception('Failed to retrieve in-progress items')
 
-    def get_library_item(self, item_id: str) -> Dict:
+    @observe_upstream
+    def get_media_progress(self) -> List[Tuple[str, Progress]]:
+        """
+        Get the user's progress in every book and podcast episode
+
+        Returns:
+            List of (library item ID, progress) pairs
+
+        Raises:
+            Exception: If request fails
+        """
+        try:
+            response = self._get('/api/me')
+            response.raise_for_status()
+            return parse_media_progress(response.content.decode('utf-8'))
+
+        except Exception as e:
+            logger.error(f'Failed to get media progress: {e}')
+            raise Exception('Failed to retrieve media progress')
+
+    @observe_upstream
+    def get_library_item(self, item_id: str) -> Item:
         """
         Get a specific library item by ID
 
@@ -139,20 +486,42 @@ class AudioBookshelfClient:
             item_id: The library item ID
 
         Returns:
-            Library item details
+            Library item with its track list
 
         Raises:
             Exception: If request fails
         """
         try:
-            response = self.session.get(f"{self.base_url}/api/items/{item_id}")
-            response.raise_for_status()
-            return response.json()
+            return self._get_cached(f"/api/items/{item_id}", parse_item, ITEM_FRESHNESS)
 
         except Exception as e:
             logger.error(f'Failed to get library item: {e}')
             raise Exception('Failed to retrieve library item')
 
+    @observe_upstream
+    def get_cover(self, item_id: str) -> bytes:
+        """
+        Get the original cover image of a library item
+
+        Args:
+            item_id: The library item ID
+
+        Returns:
+            Image bytes as stored on the server
+
+        Raises:
+            Exception: If request fails
+        """
+        try:
+            response = self._get(f"/api/items/{item_id}/cover", params={'raw': 1})
+            response.raise_for_status()
+            return response.content
+
+        except Exception as e:
+            logger.error(f'Failed to get cover: {e}')
+            raise Exception('Failed to retrieve cover')
+
+    @observe_upstream
     def update_progress(self, item_id: str, current_time: float, duration: float) -> Optional[Dict]:
         """
         Update playback progress
@@ -173,7 +542,8 @@ class AudioBookshelfClient:
                     'currentTime': current_time,
                     'duration': duration,
                     'progress': progress
-                }
+                },
+                timeout=call_timeout(self.timeout)
             )
             response.raise_for_status()
             return response.json()
@@ -183,6 +553,30 @@ class AudioBookshelfClient:
             # Don't raise - progress updates are not critical
             return None
 
+    @observe_upstream
+    def batch_update_progress(self, updates: List[Dict]) -> None:
+        """
+        Update playback progress for several items in one request
+
+        Args:
+            updates: Progress payloads, each with 'libraryItemId' and any of
+                'episodeId', 'currentTime', 'duration', 'progress' and 'isFinished'
+
+        Raises:
+            Exception: If the update fails
+        """
+        try:
+            response = self.session.patch(
+                f"{self.base_url}/api/me/progress/batch/update",
+                json=updates,
+                timeout=call_timeout(self.timeout)
+            )
+            response.raise_for_status()
+
+        except Exception as e:
+            logger.error(f'Failed to batch update progress: {e}')
+            raise Exception('Failed to update progress') from e
+
     def get_stream_url(self, item_id: str) -> str:
         """
         Get streaming URL for an audiobook or podcast episode
@@ -193,8 +587,53 @@ class AudioBookshelfClient:
         Returns:
             Stream URL with authentication
         """
-        return f"{self.base_url}/api/items/{item_id}/play?token={self.token}"
+        return f"{self.base_url}/api/items/{item_id}/play?token={self.access_token}"
+
+    def get_track_url(self, content_url: str) -> str:
+        """
+        Get streaming URL for a single audio file of an item
+
+        Args:
+            content_url: Server-relative file URL, e.g. /api/items/<id>/file/<ino>
+
+        Returns:
+            Track URL with authentication
+        """
+        return f"{self.base_url}{content_url}?token={self.access_token}"
+
+    @observe_upstream
+    def start_play_session(self, item_id: str, episode_id: Optional[str] = None) -> Dict:
+        """
+        Open a playback session, letting the server pick direct play or transcoding
+
+        Args:
+            item_id: The library item ID
+            episode_id: Podcast episode ID, if any
+
+        Returns:
+            Playback session with 'id', 'playMethod' and 'audioTracks'
+
+        Raises:
+            Exception: If request fails
+        """
+        path = f"/api/items/{item_id}/play"
+        if episode_id:
+            path += f"/{episode_id}"
+
+        try:
+            response = self.session.post(
+                f"{self.base_url}{path}",
+                json=PLAY_SESSION_REQUEST,
+                timeout=call_timeout(self.timeout)
+            )
+            response.raise_for_status()
+            return response.json()
 
+        except Exception as e:
+            logger.error(f'Failed to start play session: {e}')
+            raise Exception('Failed to start play session')
+
+    @observe_upstream
     def close_session(self, session_id: str) -> None:
         """
         Close a playback session
@@ -203,7 +642,14 @@ class AudioBookshelfClient:
             session_id: The playback session ID
         """
         try:
-            self.session.post(f"{self.base_url}/api/session/{session_id}/close")
+            self.session.post(f"{self.base_url}/api/session/{session_id}/close",
+                              timeout=call_timeout(self.timeout))
         except Exception as e:
             logger.error(f'Failed to close session: {e}')
             # Don't raise - session cleanup is not critical
+
+    def close(self) -> None:
+        """
+        Close the underlying HTTP session and its pooled connections
+        """
+        self.session.close()
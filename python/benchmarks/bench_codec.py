@@ -0,0 +1,122 @@
+"""
+Micro-benchmark for the /alexa envelope codec
+Compares CPU time per request of the generic DefaultSerializer path with codec.py
+
+Usage (from the python/ directory):
+    python benchmarks/bench_codec.py [iterations]
+"""
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_core.response_helper import ResponseFactory
+from ask_sdk_core.utils import RESPONSE_FORMAT_VERSION
+from ask_sdk_model import RequestEnvelope, ResponseEnvelope
+
+from codec import decode_request, encode_response
+from models import Item
+from responses import build_play_directive
+from tracks import StreamChoice
+
+CONTEXT = {
+    'System': {
+        'application': {'applicationId': 'amzn1.ask.skill.bench'},
+        'user': {'userId': 'amzn1.ask.account.bench'},
+        'device': {'deviceId': 'amzn1.ask.device.bench',
+                   'supportedInterfaces': {'AudioPlayer': {}}},
+        'apiEndpoint': 'https://api.amazonalexa.com',
+        'apiAccessToken': 'token'
+    },
+    'AudioPlayer': {'playerActivity': 'PLAYING', 'token': 'li_1', 'offsetInMilliseconds': 5000}
+}
+
+SESSION = {
+    'new': False,
+    'sessionId': 'amzn1.echo-api.session.bench',
+    'application': {'applicationId': 'amzn1.ask.skill.bench'},
+    'user': {'userId': 'amzn1.ask.account.bench'},
+    'attributes': {'currentItem': 'li_1', 'offsetInMilliseconds': 5000}
+}
+
+REQUESTS = {
+    'IntentRequest': {
+        'version': '1.0', 'session': SESSION, 'context': CONTEXT,
+        'request': {
+            'type': 'IntentRequest', 'requestId': 'amzn1.echo-api.request.1',
+            'timestamp': '2026-01-11T12:00:00Z', 'locale': 'en-US',
+            'intent': {
+                'name': 'PlayBookIntent', 'confirmationStatus': 'NONE',
+                'slots': {'bookName': {'name': 'bookName', 'value': 'dune',
+                                       'confirmationStatus': 'NONE'}}
+            }
+        }
+    },
+    'AudioPlayer.PlaybackStopped': {
+        'version': '1.0', 'context': CONTEXT,
+        'request': {
+            'type': 'AudioPlayer.PlaybackStopped', 'requestId': 'amzn1.echo-api.request.2',
+            'timestamp': '2026-01-11T12:00:00Z', 'locale': 'en-US',
+            'token': 'li_1', 'offsetInMilliseconds': 5000
+        }
+    }
+}
+
+
+def build_response() -> ResponseEnvelope:
+    item = Item(id='li_1', title='Dune', author='Frank Herbert',
+                cover_path='/metadata/items/li_1/cover.jpg')
+    response = (ResponseFactory()
+                .speak('Playing Dune by Frank Herbert.')
+                .add_directive(build_play_directive(
+                    item, StreamChoice('li_1', 'https://abs.example.com/api/items/li_1/play?token=t', 0),
+                    'https://abs.example.com'))
+                .response)
+    return ResponseEnvelope(response=response, version=RESPONSE_FORMAT_VERSION,
+                            session_attributes=SESSION['attributes'])
+
+
+def generic_path(body: bytes, response_obj: ResponseEnvelope) -> bytes:
+    # What alexa_endpoint used to do: get_json, json.dumps, a fresh serializer
+    serializer = DefaultSerializer()
+    request_dict = json.loads(body)
+    serializer.deserialize(payload=json.dumps(request_dict), obj_type=RequestEnvelope)
+    return json.dumps(serializer.serialize(response_obj)).encode('utf-8')
+
+
+def codec_path(body: bytes, response_obj: ResponseEnvelope) -> bytes:
+    decode_request(body)
+    return encode_response(response_obj)
+
+
+def cpu_time_per_call(func, iterations: int, *args) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func(*args)
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    response_obj = build_response()
+
+    # The fast path must produce exactly what the generic path produces
+    serializer = DefaultSerializer()
+    assert json.loads(encode_response(response_obj)) == serializer.serialize(response_obj)
+
+    print(f"{'request':<30}{'generic (us)':>14}{'codec (us)':>14}{'speedup':>10}")
+    for name, envelope in REQUESTS.items():
+        body = json.dumps(envelope).encode('utf-8')
+        assert decode_request(body) == serializer.deserialize(body.decode(), RequestEnvelope)
+
+        generic = cpu_time_per_call(generic_path, iterations, body, response_obj)
+        fast = cpu_time_per_call(codec_path, iterations, body, response_obj)
+        print(f"{name:<30}{generic:>14.1f}{fast:>14.1f}{generic / fast:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
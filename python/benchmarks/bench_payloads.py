@@ -0,0 +1,137 @@
+"""
+Micro-benchmark for parsing AudioBookshelf payloads
+Compares json.loads of the whole response with the record parsers in payloads.py
+
+Usage (from the python/ directory):
+    python benchmarks/bench_payloads.py [items] [iterations]
+"""
+
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payloads import parse_items_in_progress, parse_search, parse_item
+
+DESCRIPTION = ('A sweeping story told across generations, with a long publisher blurb '
+               'of the kind AudioBookshelf stores for every item. ') * 4
+
+
+def audio_file(item_id: str, index: int) -> dict:
+    return {
+        'index': index,
+        'ino': f'{item_id}{index:04d}',
+        'metadata': {'filename': f'Part {index:02d}.mp3', 'ext': '.mp3',
+                     'path': f'/audiobooks/{item_id}/Part {index:02d}.mp3',
+                     'relPath': f'Part {index:02d}.mp3', 'size': 48000000,
+                     'mtimeMs': 1700000000000, 'ctimeMs': 1700000000000,
+                     'birthtimeMs': 1700000000000},
+        'addedAt': 1700000000000, 'updatedAt': 1700000000000,
+        'trackNumFromMeta': index, 'discNumFromMeta': None,
+        'format': 'MP2/3 (MPEG audio layer 2/3)', 'duration': 3600.5, 'bitRate': 128000,
+        'language': None, 'codec': 'mp3', 'timeBase': '1/14112000', 'channels': 2,
+        'channelLayout': 'stereo', 'chapters': [], 'embeddedCoverArt': None,
+        'metaTags': {'tagAlbum': 'Album', 'tagArtist': 'Author', 'tagGenre': 'Audiobook',
+                     'tagTitle': f'Part {index:02d}', 'tagTrack': str(index)},
+        'mimeType': 'audio/mpeg'
+    }
+
+
+def library_item(number: int, expanded: bool = False) -> dict:
+    item_id = f'li_{number:06d}'
+    files = [audio_file(item_id, index) for index in range(1, 13)] if expanded else []
+    media = {
+        'id': f'book_{number:06d}',
+        'metadata': {
+            'title': f'Book {number}', 'titleIgnorePrefix': f'Book {number}',
+            'subtitle': None, 'authorName': f'Author {number % 97}',
+            'authorNameLF': f'{number % 97}, Author', 'narratorName': 'Narrator',
+            'seriesName': f'Series {number % 13} #{number % 7}', 'genres': ['Fantasy', 'Fiction'],
+            'publishedYear': '1999', 'publishedDate': None, 'publisher': 'Publisher',
+            'description': DESCRIPTION, 'isbn': None, 'asin': 'B000000000',
+            'language': 'English', 'explicit': False, 'abridged': False
+        },
+        'coverPath': f'/metadata/items/{item_id}/cover.jpg',
+        'tags': ['favourite'],
+        'numTracks': len(files), 'numAudioFiles': len(files), 'numChapters': 40,
+        'duration': 43206.0, 'size': 576000000
+    }
+    if expanded:
+        media['audioFiles'] = files
+        media['chapters'] = [{'id': index, 'start': index * 1080.0,
+                              'end': (index + 1) * 1080.0, 'title': f'Chapter {index + 1}'}
+                             for index in range(40)]
+        media['tracks'] = [{
+            'index': index, 'startOffset': (index - 1) * 3600.5, 'duration': 3600.5,
+            'title': f'Part {index:02d}.mp3', 'contentUrl': f'/api/items/{item_id}/file/{item_id}{index:04d}',
+            'mimeType': 'audio/mpeg', 'metadata': dict(files[index - 1]['metadata'])
+        } for index in range(1, 13)]
+
+    return {
+        'id': item_id, 'ino': f'{number:012d}', 'oldLibraryItemId': None,
+        'libraryId': 'lib_books', 'folderId': 'fol_books',
+        'path': f'/audiobooks/{item_id}', 'relPath': item_id, 'isFile': False,
+        'mtimeMs': 1700000000000, 'ctimeMs': 1700000000000, 'birthtimeMs': 1700000000000,
+        'addedAt': 1700000000000, 'updatedAt': 1700000000000 + number,
+        'isMissing': False, 'isInvalid': False, 'mediaType': 'book', 'media': media,
+        'numFiles': len(files) + 2, 'size': 576000000
+    }
+
+
+def payloads(items: int) -> dict:
+    in_progress = {'libraryItems': [dict(library_item(number), progressLastUpdate=1700000000000,
+                                         userMediaProgress={
+                                             'id': f'mp_{number}', 'libraryItemId': f'li_{number:06d}',
+                                             'episodeId': None, 'duration': 43206.0,
+                                             'progress': 0.25, 'currentTime': 10801.5,
+                                             'isFinished': False, 'hideFromContinueListening': False,
+                                             'lastUpdate': 1700000000000, 'startedAt': 1690000000000,
+                                             'finishedAt': None})
+                                    for number in range(items)]}
+    search = {'book': [{'libraryItem': library_item(number), 'matchKey': 'title',
+                        'matchText': f'Book {number}'} for number in range(items)],
+              'podcast': [], 'tags': [], 'genres': [], 'authors': [], 'series': [],
+              'narrators': []}
+    return {
+        'items-in-progress': (json.dumps(in_progress), parse_items_in_progress),
+        'search': (json.dumps(search), parse_search),
+        'item (expanded)': (json.dumps(library_item(1, expanded=True)), parse_item)
+    }
+
+
+def cpu_time_per_call(func, iterations: int, *args) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func(*args)
+    return (time.process_time() - start) / iterations * 1e3
+
+
+def memory_kib(func, *args) -> tuple:
+    # Memory held by the parsed result, and the peak while parsing
+    tracemalloc.start()
+    result = func(*args)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size / 1024, peak / 1024
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    print(f"{'payload':<28}{'path':<9}{'CPU (ms)':>10}{'held (KiB)':>12}{'peak (KiB)':>12}")
+    for name, (text, parse) in payloads(items).items():
+        label = f'{name} ({len(text) // 1024} KiB)'
+        for path, func in (('json', json.loads), ('records', parse)):
+            cpu = cpu_time_per_call(func, iterations, text)
+            held, peak = memory_kib(func, text)
+            print(f"{label:<28}{path:<9}{cpu:>10.2f}{held:>12.0f}{peak:>12.0f}")
+            label = ''
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Startup benchmark for a cold worker
+Reports import time per module and the latency of a fresh process's first requests, with and without warm-up
+
+Usage (from the python/ directory):
+    python benchmarks/bench_startup.py [--module app] [--runs 5] [--top 25] [--depth 2]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Runs in a fresh interpreter: import the app, optionally warm it, then time
+# one envelope per handler that needs no AudioBookshelf server
+FIRST_REQUESTS = '''
+import json, sys, time
+sys.path.insert(0, {benchmark_dir!r})
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if {warm}:
+    import startup
+    startup.warm_up()
+warmed = time.perf_counter()
+from envelopes import build_corpus, encode
+corpus = build_corpus()
+client = app.app.test_client()
+timings = {{'import': imported - start, 'warm-up': warmed - imported}}
+for name in ('HelpIntentHandler', 'SessionEndedRequestHandler', 'PlaybackFailedHandler'):
+    body = encode(corpus[name])
+    for attempt in ('first', 'second'):
+        started = time.perf_counter()
+        client.post('/alexa', data=body, content_type='application/json')
+        timings[f'{{name}} ({{attempt}})'] = time.perf_counter() - started
+print(json.dumps(timings))
+'''
+
+
+def environment(data_dir: str) -> Dict[str, str]:
+    # No server is contacted; the URL only has to be configured
+    return dict(os.environ, DATA_DIR=data_dir, AUDIOBOOKSHELF_URL='http://127.0.0.1:9',
+                AUDIOBOOKSHELF_TOKEN='benchmark-token', ALEXA_VERIFY_REQUESTS='False',
+                PYTHONDONTWRITEBYTECODE='')
+
+
+def import_profile(module: str, env: Dict[str, str]) -> List[Tuple[str, int, int, int]]:
+    """
+    Import a module in a fresh interpreter with -X importtime
+
+    Returns:
+        (module, depth, self us, cumulative us) in import order
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=APP_DIR, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+    return rows
+
+
+def first_requests(warm: bool, env: Dict[str, str]) -> Dict[str, float]:
+    code = FIRST_REQUESTS.format(benchmark_dir=BENCHMARK_DIR, warm=warm)
+    result = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--module', default='app', help='module to import (app or asgi)')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per measurement')
+    parser.add_argument('--top', type=int, default=25, help='modules to list')
+    parser.add_argument('--depth', type=int, default=2,
+                        help='deepest nesting level listed (1 = direct imports of the module)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as data_dir:
+        env = environment(data_dir)
+        # The first run compiles bytecode; later runs measure what a restarted worker pays
+        import_profile(args.module, env)
+
+        cumulative, self_time = {}, {}
+        for _ in range(args.runs):
+            for name, depth, self_us, cumulative_us in import_profile(args.module, env):
+                if depth <= args.depth:
+                    cumulative.setdefault((name, depth), []).append(cumulative_us)
+                self_time.setdefault(name.split('.')[0], []).append(self_us)
+
+        print(f'Import of {args.module}, median of {args.runs} runs')
+        print(f"{'module':<50}{'cumulative (ms)':>16}")
+        ranked = sorted(cumulative.items(), key=lambda entry: -statistics.median(entry[1]))
+        for (name, depth), values in ranked[:args.top]:
+            print(f"{'  ' * depth + name:<50}{statistics.median(values) / 1000:>16.1f}")
+
+        print(f"\n{'package':<50}{'self (ms)':>16}")
+        totals = {package: sum(values) / args.runs for package, values in self_time.items()}
+        for package, total in sorted(totals.items(), key=lambda entry: -entry[1])[:args.top]:
+            print(f'{package:<50}{total / 1000:>16.1f}')
+
+        print(f"\n{'first requests of a fresh process':<50}{'cold (ms)':>16}{'warmed (ms)':>16}")
+        runs = {warm: [first_requests(warm, env) for _ in range(args.runs)] for warm in (False, True)}
+        for step in runs[False][0]:
+            cold = statistics.median(run[step] for run in runs[False]) * 1000
+            warmed = statistics.median(run[step] for run in runs[True]) * 1000
+            print(f'{step:<50}{cold:>16.1f}{warmed:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Offline checks of Alexa request verification against a locally generated CA
+Signs envelopes with a throwaway root, intermediate and leaf, serves the chain from a stubbed download, and checks what verifier.py accepts and rejects
+
+Usage (from the python/ directory):
+    python benchmarks/check_verifier.py
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import BaseAdapter
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CHAIN_URL = 'https://s3.amazonaws.com/echo.api/'
+
+# Seconds the stubbed download takes, long enough for concurrent requests to overlap
+FETCH_DELAY = 0.2
+
+
+def _key() -> rsa.RSAPrivateKey:
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _cert(subject: str, subject_key, issuer: str, issuer_key, ca: bool,
+          not_before: timedelta = timedelta(days=-1),
+          not_after: timedelta = timedelta(days=30)) -> x509.Certificate:
+    now = datetime.now(timezone.utc)
+    builder = (x509.CertificateBuilder()
+               .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, subject)]))
+               .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, issuer)]))
+               .public_key(subject_key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now + not_before)
+               .not_valid_after(now + not_after)
+               .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True))
+    if not ca:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName([x509.DNSName('echo-api.amazon.com')]), critical=False
+        )
+    return builder.sign(issuer_key, hashes.SHA256())
+
+
+def _pem(*certs: x509.Certificate) -> bytes:
+    return b''.join(cert.public_bytes(serialization.Encoding.PEM) for cert in certs)
+
+
+class ChainAdapter(BaseAdapter):
+    """Serves certificate chains by the last segment of their URL, counting downloads"""
+
+    def __init__(self, chains):
+        super().__init__()
+        self.chains = chains
+        self.fetches = 0
+
+    def send(self, request, **kwargs):
+        self.fetches += 1
+        time.sleep(FETCH_DELAY)
+        response = requests.Response()
+        response.status_code = 200
+        response.url = request.url
+        response._content = self.chains[request.url.rsplit('/', 1)[1]]
+        return response
+
+    def close(self):
+        pass
+
+
+def _envelope(timestamp: datetime = None) -> bytes:
+    timestamp = timestamp or datetime.now(timezone.utc)
+    return json.dumps({
+        'version': '1.0',
+        'request': {'type': 'LaunchRequest', 'requestId': 'amzn1.echo-api.request.check',
+                    'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:%SZ'), 'locale': 'en-US'}
+    }).encode('utf-8')
+
+
+def main() -> int:
+    root_key, intermediate_key, leaf_key, rogue_key = _key(), _key(), _key(), _key()
+    root = _cert('Check Root', root_key, 'Check Root', root_key, True,
+                 not_after=timedelta(days=3650))
+    intermediate = _cert('Check Intermediate', intermediate_key, 'Check Root', root_key, True)
+    leaf = _cert('echo-api.amazon.com', leaf_key, 'Check Intermediate', intermediate_key, False)
+    expired_leaf = _cert('echo-api.amazon.com', leaf_key, 'Check Intermediate', intermediate_key,
+                         False, not_before=timedelta(days=-30), not_after=timedelta(days=-1))
+    rogue_root = _cert('Rogue Root', rogue_key, 'Rogue Root', rogue_key, True)
+    rogue_leaf = _cert('echo-api.amazon.com', leaf_key, 'Rogue Root', rogue_key, False)
+    leaf_as_issuer = _cert('echo-api.amazon.com', leaf_key, 'Check Root', root_key, False)
+
+    bundle = os.path.join(tempfile.mkdtemp(), 'ca.pem')
+    with open(bundle, 'wb') as f:
+        f.write(_pem(root))
+    os.environ['ALEXA_CA_BUNDLE'] = bundle
+
+    import verifier
+    from codec import decode_request
+
+    adapter = ChainAdapter({
+        'good': _pem(leaf, intermediate),
+        'with-root': _pem(leaf, intermediate, root),
+        'no-intermediate': _pem(leaf),
+        'expired': _pem(expired_leaf, intermediate),
+        'untrusted': _pem(rogue_leaf, rogue_root),
+        'non-ca-issuer': _pem(_cert('echo-api.amazon.com', leaf_key, 'echo-api.amazon.com',
+                                    leaf_key, False), leaf_as_issuer),
+    })
+    signature_verifier, _ = verifier.get_verifiers()
+    signature_verifier.session.mount(CHAIN_URL, adapter)
+
+    def verify(chain: str, body: bytes = None, signer=leaf_key, tamper: bool = False,
+               url: str = None) -> str:
+        body = body or _envelope()
+        signature = base64.b64encode(signer.sign(body, padding.PKCS1v15(), hashes.SHA1()))
+        headers = {'SignatureCertChainUrl': url or CHAIN_URL + chain,
+                   'Signature': signature.decode('ascii')}
+        sent = body + b' ' if tamper else body
+        try:
+            verifier.verify_request(headers, sent, decode_request(sent))
+        except verifier.VerificationException:
+            return 'rejected'
+        return 'accepted'
+
+    failures = 0
+
+    def check(name: str, result, expected) -> None:
+        nonlocal failures
+        ok = result == expected
+        failures += not ok
+        suffix = '' if ok else f' (expected {expected})'
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {result}{suffix}")
+
+    with ThreadPoolExecutor(8) as pool:
+        results = set(pool.map(lambda _: verify('good'), range(8)))
+    check('concurrent requests on a new chain', results, {'accepted'})
+    check('downloads for concurrent requests', adapter.fetches, 1)
+
+    fetches = adapter.fetches
+    start = time.perf_counter()
+    for _ in range(100):
+        verify('good')
+    print(f"     cached verification: {(time.perf_counter() - start) * 10:.2f} ms per request")
+    check('downloads once cached', adapter.fetches - fetches, 0)
+
+    check('chain including its root', verify('with-root'), 'accepted')
+    check('tampered body', verify('good', tamper=True), 'rejected')
+    check('signed with another key', verify('good', signer=intermediate_key), 'rejected')
+    stale = _envelope(datetime(2020, 1, 1, tzinfo=timezone.utc))
+    check('stale timestamp', verify('good', body=stale), 'rejected')
+    check('chain missing its intermediate', verify('no-intermediate'), 'rejected')
+    check('expired signing certificate', verify('expired'), 'rejected')
+    check('chain to an untrusted root', verify('untrusted'), 'rejected')
+    check('issuer that is not a CA', verify('non-ca-issuer'), 'rejected')
+    check('chain URL off the Alexa host', verify('good', url='https://example.com/echo.api/good'),
+          'rejected')
+
+    body = _envelope()
+    try:
+        verifier.verify_request({}, body, decode_request(body))
+        result = 'accepted'
+    except verifier.VerificationException:
+        result = 'rejected'
+    check('missing signature headers', result, 'rejected')
+
+    # A cached chain past its expiry is downloaded and validated again
+    signature_verifier._chains[CHAIN_URL + 'good'] = (leaf, time.time() - 1)
+    fetches = adapter.fetches
+    verify('good')
+    check('downloads after the cached chain expired', adapter.fetches - fetches, 1)
+
+    print('all checks passed' if not failures else f'{failures} checks failed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
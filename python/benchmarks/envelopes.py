@@ -0,0 +1,138 @@
+"""
+Corpus of Alexa request envelopes
+One envelope per request handler registered on the skill in app.py
+"""
+
+import json
+import uuid
+from typing import Dict, Optional
+
+APPLICATION_ID = 'amzn1.ask.skill.benchmark'
+USER_ID = 'amzn1.ask.account.benchmark'
+DEVICE_ID = 'amzn1.ask.device.benchmark'
+TIMESTAMP = '2026-01-11T12:00:00Z'
+
+
+def _context(token: Optional[str] = None, offset_ms: int = 0, user_id: str = USER_ID) -> Dict:
+    context = {
+        'System': {
+            'application': {'applicationId': APPLICATION_ID},
+            'user': {'userId': user_id},
+            'device': {'deviceId': DEVICE_ID, 'supportedInterfaces': {'AudioPlayer': {}}},
+            'apiEndpoint': 'https://api.amazonalexa.com',
+            'apiAccessToken': 'benchmark-api-token'
+        }
+    }
+    if token:
+        context['AudioPlayer'] = {
+            'playerActivity': 'PLAYING',
+            'token': token,
+            'offsetInMilliseconds': offset_ms
+        }
+    return context
+
+
+def _session_envelope(request: Dict, user_id: str, new: bool = False,
+                      token: Optional[str] = None, offset_ms: int = 0) -> Dict:
+    return {
+        'version': '1.0',
+        'session': {
+            'new': new,
+            'sessionId': f'amzn1.echo-api.session.{uuid.uuid4()}',
+            'application': {'applicationId': APPLICATION_ID},
+            'user': {'userId': user_id},
+            'attributes': {}
+        },
+        'context': _context(token, offset_ms, user_id),
+        'request': dict({
+            'requestId': f'amzn1.echo-api.request.{uuid.uuid4()}',
+            'timestamp': TIMESTAMP,
+            'locale': 'en-US'
+        }, **request)
+    }
+
+
+def _intent(name: str, user_id: str, slots: Optional[Dict[str, str]] = None,
+            token: Optional[str] = None, offset_ms: int = 0) -> Dict:
+    intent = {'name': name, 'confirmationStatus': 'NONE'}
+    if slots:
+        intent['slots'] = {
+            slot: {'name': slot, 'value': value, 'confirmationStatus': 'NONE'}
+            for slot, value in slots.items()
+        }
+    return _session_envelope({'type': 'IntentRequest', 'intent': intent}, user_id,
+                             token=token, offset_ms=offset_ms)
+
+
+def _audio_player(event: str, token: str, offset_ms: int, user_id: str,
+                  **extra) -> Dict:
+    # AudioPlayer events are delivered without a session
+    return {
+        'version': '1.0',
+        'context': _context(token, offset_ms, user_id),
+        'request': dict({
+            'type': f'AudioPlayer.{event}',
+            'requestId': f'amzn1.echo-api.request.{uuid.uuid4()}',
+            'timestamp': TIMESTAMP,
+            'locale': 'en-US',
+            'token': token,
+            'offsetInMilliseconds': offset_ms
+        }, **extra)
+    }
+
+
+def build_corpus(book_name: str = 'Book 12', item_id: str = 'li_000012',
+                 user_id: str = USER_ID, podcast_name: str = 'Podcast 1') -> Dict[str, Dict]:
+    """
+    Build one envelope per registered request handler
+
+    Args:
+        book_name: Title spoken in PlayBookIntent
+        item_id: Library item ID used as the AudioPlayer token
+        user_id: Alexa userId
+        podcast_name: Title spoken in PlayLatestEpisodeIntent
+
+    Returns:
+        Dict mapping handler class name to request envelope
+    """
+    return {
+        'LaunchRequestHandler': _session_envelope({'type': 'LaunchRequest'}, user_id, new=True),
+        'ContinueBookIntentHandler': _intent('ContinueBookIntent', user_id),
+        'PlayBookIntentHandler': _intent('PlayBookIntent', user_id, {'bookName': book_name}),
+        'PlayEpisodeIntentHandler': _intent('PlayLatestEpisodeIntent', user_id,
+                                            {'podcastName': podcast_name}),
+        'HelpIntentHandler': _intent('AMAZON.HelpIntent', user_id),
+        'PauseIntentHandler': _intent('AMAZON.PauseIntent', user_id),
+        'ResumeIntentHandler': _intent('AMAZON.ResumeIntent', user_id),
+        # Sent while a book plays, so the position comes from the AudioPlayer context
+        'SkipIntentHandler': _intent('SkipForwardIntent', user_id, {'duration': 'PT30S'},
+                                     token=item_id, offset_ms=120000),
+        'SeekIntentHandler': _intent('SeekIntent', user_id, {'position': 'PT20M'},
+                                     token=item_id, offset_ms=120000),
+        'ChapterIntentHandler': _intent('NextChapterIntent', user_id,
+                                        token=item_id, offset_ms=120000),
+        'StopAndCancelIntentHandler': _intent('AMAZON.StopIntent', user_id),
+        'FallbackIntentHandler': _intent('AMAZON.FallbackIntent', user_id),
+        'PlaybackStartedHandler': _audio_player('PlaybackStarted', item_id, 0, user_id),
+        'PlaybackFinishedHandler': _audio_player('PlaybackFinished', item_id, 3600000, user_id),
+        'PlaybackStoppedHandler': _audio_player('PlaybackStopped', item_id, 120000, user_id),
+        # Token of the first file of a multi-file book, so the next one gets enqueued
+        'PlaybackNearlyFinishedHandler': _audio_player('PlaybackNearlyFinished',
+                                                       f'{item_id}||0|0', 3590000, user_id),
+        'PlaybackFailedHandler': _audio_player(
+            'PlaybackFailed', item_id, 0, user_id,
+            error={'type': 'MEDIA_ERROR_UNKNOWN', 'message': 'benchmark'},
+            currentPlaybackState={'token': item_id, 'offsetInMilliseconds': 0,
+                                  'playerActivity': 'PLAYING'}
+        ),
+        'SessionEndedRequestHandler': _session_envelope(
+            {'type': 'SessionEndedRequest', 'reason': 'USER_INITIATED'}, user_id
+        )
+    }
+
+
+def encode(envelope: Dict) -> bytes:
+    """
+    Serialize an envelope the way Alexa sends it
+    """
+    return json.dumps(envelope).encode('utf-8')
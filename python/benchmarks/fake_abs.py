@@ -0,0 +1,371 @@
+"""
+Local stand-in for an AudioBookshelf server
+Serves the API endpoints the skill uses from a generated library, with
+configurable size and injected latency
+
+Usage (from the python/ directory):
+    python benchmarks/fake_abs.py --port 13378 --items 5000 --latency-ms 50
+"""
+
+import re
+import sys
+import json
+import hashlib
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+LIBRARY_ID = 'lib_books'
+
+WORDS = ['Dragon', 'Empire', 'Shadow', 'River', 'Glass', 'Winter', 'Crown', 'Storm',
+         'Garden', 'Machine', 'Ocean', 'Tower', 'Ember', 'Silence', 'Harbor', 'Forest']
+NAMES = ['Ada', 'Brook', 'Chen', 'Dara', 'Ellis', 'Farah', 'Grey', 'Hale', 'Iris',
+         'Jules', 'Kato', 'Lane', 'Moss', 'Noor', 'Okafor', 'Pike']
+
+
+class FakeLibrary:
+    """Generated library of audiobooks and podcasts with per-user progress"""
+
+    def __init__(self, size: int = 1000, in_progress: int = 5, podcasts: int = 3,
+                 episodes: int = 50):
+        """
+        Initialize the library
+
+        Args:
+            size: Number of books to generate
+            in_progress: Number of books the user has started
+            podcasts: Number of podcasts to generate
+            episodes: Episodes per podcast
+        """
+        rng = random.Random(42)
+        now = int(time.time() * 1000)
+        self.items = []
+        for index in range(size):
+            duration = rng.randint(3600, 72000)
+            # Every fourth book is split into several files, like most MP3 rips
+            num_tracks = 3 if index % 4 == 0 else 1
+            audio_files = [{
+                'index': track + 1,
+                'ino': f'{index}{track:03d}',
+                'duration': duration / num_tracks,
+                'mimeType': 'audio/mpeg',
+                'metadata': {'filename': f'part{track + 1}.mp3'}
+            } for track in range(num_tracks)]
+            num_chapters = rng.randint(10, 40)
+            chapters = [{
+                'id': chapter,
+                'start': duration * chapter / num_chapters,
+                'end': duration * (chapter + 1) / num_chapters,
+                'title': f'Chapter {chapter + 1}'
+            } for chapter in range(num_chapters)]
+            self.items.append({
+                'id': f'li_{index:06d}',
+                'libraryId': LIBRARY_ID,
+                'mediaType': 'book',
+                'addedAt': now - index * 60000,
+                'updatedAt': now - index * 60000,
+                'media': {
+                    'metadata': {
+                        'title': f'Book {index} of the {rng.choice(WORDS)} {rng.choice(WORDS)}',
+                        'authorName': f'{rng.choice(NAMES)} {rng.choice(NAMES)}',
+                        'seriesName': f'{rng.choice(WORDS)} Saga' if index % 7 == 0 else ''
+                    },
+                    'duration': duration,
+                    'coverPath': f'/metadata/items/li_{index:06d}/cover.jpg',
+                    'numTracks': num_tracks,
+                    'audioFiles': audio_files,
+                    'chapters': chapters
+                }
+            })
+        # Podcasts are generated last so the books stay the same for a given size
+        for index in range(podcasts):
+            item_id = f'li_pod_{index:03d}'
+            self.items.append({
+                'id': item_id,
+                'libraryId': LIBRARY_ID,
+                'mediaType': 'podcast',
+                'addedAt': now,
+                'updatedAt': now,
+                'media': {
+                    'metadata': {
+                        'title': f'Podcast {index} of the {rng.choice(WORDS)}',
+                        'author': f'{rng.choice(NAMES)} {rng.choice(NAMES)}'
+                    },
+                    'coverPath': f'/metadata/items/{item_id}/cover.jpg',
+                    'episodes': [{
+                        'id': f'ep_{index:03d}_{episode:04d}',
+                        'index': episode,
+                        'title': f'Episode {episode + 1}',
+                        'publishedAt': now - (episodes - episode) * 86400000,
+                        'audioFile': {'ino': f'{index}9{episode:04d}', 'duration': 1800,
+                                      'mimeType': 'audio/mpeg'}
+                    } for episode in range(episodes)]
+                }
+            })
+        self.by_id = {item['id']: item for item in self.items}
+        self.progress = {}
+        for item in self.items[:in_progress]:
+            self.progress[item['id']] = {
+                'libraryItemId': item['id'],
+                'currentTime': item['media']['duration'] / 3,
+                'duration': item['media']['duration'],
+                'progress': 1 / 3,
+                'isFinished': False,
+                'lastUpdate': now
+            }
+        self.lock = threading.Lock()
+
+    def page(self, page: int, limit: int, sort: str, desc: bool) -> Dict:
+        items = sorted(self.items, key=lambda item: item.get(sort) or 0, reverse=desc)
+        return {'results': items[page * limit:(page + 1) * limit], 'total': len(items),
+                'page': page, 'limit': limit}
+
+    def search(self, query: str, limit: int) -> Dict:
+        words = query.lower().split()
+        hits = [item for item in self.items
+                if all(word in item['media']['metadata']['title'].lower() for word in words)]
+        result = {'authors': [], 'series': [], 'tags': []}
+        for kind in ('book', 'podcast'):
+            result[kind] = [{'libraryItem': item, 'matchKey': 'title', 'matchText': query}
+                            for item in hits if item['mediaType'] == kind][:limit]
+        return result
+
+    def play_session(self, item_id: str, supported_mime_types: List[str]) -> Optional[Dict]:
+        item = self.by_id.get(item_id)
+        # Like the real server, podcasts need an episode to open a session for
+        if item is None or item['mediaType'] == 'podcast':
+            return None
+
+        audio_files = item['media']['audioFiles']
+        direct = all(audio_file['mimeType'] in supported_mime_types for audio_file in audio_files)
+        session_id = f'play_{item_id}_{time.monotonic_ns()}'
+        start = 0
+        tracks = []
+        for audio_file in audio_files:
+            tracks.append({
+                'index': audio_file['index'],
+                'startOffset': start,
+                'duration': audio_file['duration'],
+                'title': audio_file['metadata']['filename'],
+                'contentUrl': (f"/api/items/{item_id}/file/{audio_file['ino']}" if direct
+                               else f'/hls/{session_id}/output.m3u8'),
+                'mimeType': audio_file['mimeType'] if direct else 'application/vnd.apple.mpegurl'
+            })
+            start += audio_file['duration']
+
+        return {
+            'id': session_id,
+            'libraryItemId': item_id,
+            'mediaType': item['mediaType'],
+            'displayTitle': item['media']['metadata']['title'],
+            'displayAuthor': item['media']['metadata']['authorName'],
+            'coverPath': item['media']['coverPath'],
+            'duration': item['media']['duration'],
+            'chapters': item['media']['chapters'],
+            'playMethod': 0 if direct else 2,
+            'audioTracks': tracks if direct else tracks[:1]
+        }
+
+    def items_in_progress(self) -> List[Dict]:
+        with self.lock:
+            progress = sorted(self.progress.values(), key=lambda p: -p['lastUpdate'])
+            return [dict(self.by_id[p['libraryItemId']], userMediaProgress=p)
+                    for p in progress if not p.get('isFinished')]
+
+    def update_progress(self, item_id: str, payload: Dict) -> Optional[Dict]:
+        with self.lock:
+            if item_id not in self.by_id:
+                return None
+            progress = self.progress.setdefault(item_id, {'libraryItemId': item_id})
+            progress.update({key: value for key, value in payload.items() if key != 'libraryItemId'})
+            progress['lastUpdate'] = int(time.time() * 1000)
+            return progress
+
+
+class FakeAudioBookshelfHandler(BaseHTTPRequestHandler):
+    """Request handler; the server instance carries the library and settings"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; avoid Nagle/delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._delay()
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        library = self.server.library
+
+        if url.path == '/api/libraries':
+            return self._json({'libraries': [{'id': LIBRARY_ID, 'name': 'Audiobooks',
+                                              'mediaType': 'book', 'displayOrder': 1}]})
+
+        if url.path == '/api/me':
+            with library.lock:
+                return self._json({'id': 'usr_bench', 'username': 'bench',
+                                   'mediaProgress': list(library.progress.values())})
+
+        if url.path == '/api/me/items-in-progress':
+            return self._json({'libraryItems': library.items_in_progress()})
+
+        match = re.fullmatch(r'/api/libraries/([^/]+)/items', url.path)
+        if match:
+            return self._json(library.page(
+                int(query.get('page', ['0'])[0]),
+                int(query.get('limit', ['500'])[0]),
+                query.get('sort', ['updatedAt'])[0],
+                query.get('desc', ['1'])[0] == '1'
+            ))
+
+        match = re.fullmatch(r'/api/libraries/([^/]+)/search', url.path)
+        if match:
+            return self._json(library.search(query.get('q', [''])[0],
+                                             int(query.get('limit', ['10'])[0])))
+
+        match = re.fullmatch(r'/api/items/([^/]+)', url.path)
+        if match and match.group(1) in library.by_id:
+            return self._json(library.by_id[match.group(1)])
+
+        match = re.fullmatch(r'/api/items/([^/]+)/play', url.path)
+        if match and match.group(1) in library.by_id:
+            return self._raw(200, b'\x00' * 1024, 'audio/mpeg')
+
+        match = re.fullmatch(r'/api/items/([^/]+)/file/([^/]+)', url.path)
+        if match and match.group(1) in library.by_id:
+            return self._raw(200, b'\x00' * 1024, 'audio/mpeg')
+
+        self._json({'error': 'Not found'}, 404)
+
+    def do_PATCH(self):
+        self._delay()
+        url = urlparse(self.path)
+        payload = self._body()
+        library = self.server.library
+
+        if url.path == '/api/me/progress/batch/update':
+            for update in payload or []:
+                library.update_progress(update.get('libraryItemId'), update)
+            return self._raw(200, b'OK', 'text/plain')
+
+        match = re.fullmatch(r'/api/me/progress/([^/]+)', url.path)
+        if match:
+            progress = library.update_progress(match.group(1), payload or {})
+            if progress is not None:
+                return self._json(progress)
+
+        self._json({'error': 'Not found'}, 404)
+
+    def do_POST(self):
+        self._delay()
+        url = urlparse(self.path)
+        payload = self._body()
+
+        if url.path == '/login':
+            return self._json({'user': {'id': 'usr_bench', 'username': 'bench', 'token': 'bench-token'}})
+
+        match = re.fullmatch(r'/api/items/([^/]+)/play', url.path)
+        if match:
+            session = self.server.library.play_session(
+                match.group(1), (payload or {}).get('supportedMimeTypes') or []
+            )
+            if session is not None:
+                return self._json(session)
+
+        if re.fullmatch(r'/api/session/([^/]+)/close', url.path):
+            return self._raw(200, b'OK', 'text/plain')
+
+        self._json({'error': 'Not found'}, 404)
+
+    def _delay(self):
+        latency = self.server.latency
+        if latency:
+            time.sleep(max(0.0, random.gauss(latency, self.server.jitter)))
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return None
+        return json.loads(self.rfile.read(length))
+
+    def _json(self, payload, status: int = 200):
+        body = json.dumps(payload).encode('utf-8')
+        if status != 200 or self.command != 'GET':
+            return self._raw(status, body, 'application/json')
+
+        # Weak ETag and conditional GET like the Express server AudioBookshelf runs on
+        etag = f'W/"{len(body):x}-{hashlib.sha1(body).hexdigest()[:27]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self._raw(status, body, 'application/json', {'ETag': etag})
+
+    def _raw(self, status: int, body: bytes, content_type: str, headers: Optional[Dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeAudioBookshelfServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the fake library"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, items: int = 1000, latency_ms: float = 0,
+                 jitter_ms: float = 0):
+        """
+        Initialize the server
+
+        Args:
+            port: Port to listen on; 0 picks a free one
+            items: Number of books in the library
+            latency_ms: Mean latency added to every request
+            jitter_ms: Standard deviation of the added latency
+        """
+        super().__init__(('127.0.0.1', port), FakeAudioBookshelfHandler)
+        self.library = FakeLibrary(items)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self) -> 'FakeAudioBookshelfServer':
+        """
+        Serve in a background thread
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=13378)
+    parser.add_argument('--items', type=int, default=1000, help='books in the library')
+    parser.add_argument('--latency-ms', type=float, default=0, help='mean added latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='latency standard deviation')
+    args = parser.parse_args()
+
+    server = FakeAudioBookshelfServer(args.port, args.items, args.latency_ms, args.jitter_ms)
+    print(f'Fake AudioBookshelf with {args.items} items at {server.url}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
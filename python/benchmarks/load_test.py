@@ -0,0 +1,293 @@
+"""
+Load test and latency benchmark for the /alexa endpoint
+Starts a fake AudioBookshelf server, runs the skill under gunicorn with each
+requested worker count and reports p50/p95/p99 latency and requests per
+second per handler at each concurrency level
+
+Usage (from the python/ directory):
+    python benchmarks/load_test.py --workers 1,4 --concurrency 1,16,64 --latency-ms 50
+    python benchmarks/load_test.py --target http://127.0.0.1:5000 --concurrency 8
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, APP_DIR)
+
+from envelopes import build_corpus, encode
+from fake_abs import FakeAudioBookshelfServer
+from constants import MESSAGES
+
+# Handlers whose corpus envelope must start or queue playback
+PLAY_HANDLERS = frozenset({
+    'ContinueBookIntentHandler', 'PlayBookIntentHandler', 'PlayEpisodeIntentHandler',
+    'ResumeIntentHandler', 'SkipIntentHandler', 'SeekIntentHandler', 'ChapterIntentHandler',
+    'PlaybackNearlyFinishedHandler'
+})
+
+# Speech the skill answers with, under HTTP 200, when a handler fails
+FAILURE_SPEECH = (MESSAGES['ERROR'], MESSAGES['NOT_CONFIGURED'])
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def check_coverage(corpus: Dict[str, Dict]) -> List[str]:
+    """
+    Find handlers registered on the skill that have no envelope in the corpus
+
+    Returns:
+        Names of uncovered handler classes
+    """
+    from app import skill
+
+    registered = [type(chain.request_handler).__name__
+                  for mapper in skill.request_dispatcher.request_mappers
+                  for chain in mapper.request_handler_chains]
+    return [name for name in registered if name not in corpus]
+
+
+class SkillServer:
+    """gunicorn running the skill as a subprocess"""
+
+    def __init__(self, workers: int, abs_url: str, mode: str = 'wsgi'):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.data_dir = tempfile.mkdtemp(prefix='alexa-bench-')
+
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{self.port}',
+                   '--workers', str(workers), '--log-level', 'warning']
+        if mode == 'asgi':
+            command += ['-k', 'uvicorn.workers.UvicornWorker', 'asgi:app']
+        else:
+            command += ['wsgi:app']
+
+        env = dict(os.environ,
+                   AUDIOBOOKSHELF_URL=abs_url,
+                   AUDIOBOOKSHELF_TOKEN='benchmark-token',
+                   DATA_DIR=self.data_dir,
+                   # Benchmark envelopes are not signed by Alexa
+                   ALEXA_VERIFY_REQUESTS='False')
+        # A file, not a pipe: nobody drains a pipe while the run goes on, and a
+        # full one blocks the workers' request logging
+        self.log = open(os.path.join(self.data_dir, 'gunicorn.log'), 'w+b')
+        self.process = subprocess.Popen(command, cwd=APP_DIR, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=self.log)
+
+    def wait_ready(self, timeout: float = 30) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise RuntimeError(f'gunicorn exited: {self.log.read().decode()}')
+            try:
+                if requests.get(f'{self.url}/health', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError('gunicorn did not become ready')
+
+    def stop(self) -> None:
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def succeeded(response: requests.Response, expect_play: bool) -> bool:
+    """
+    Check that the skill handled a request, not merely answered it
+
+    Handler failures still come back as HTTP 200, with error speech.
+
+    Args:
+        response: Response from /alexa
+        expect_play: Whether the answer must carry an AudioPlayer.Play directive
+
+    Returns:
+        True if the answer is neither an error nor missing its Play directive
+    """
+    if response.status_code != 200:
+        return False
+    try:
+        answer = response.json().get('response') or {}
+    except ValueError:
+        return False
+
+    speech = answer.get('outputSpeech') or {}
+    text = speech.get('ssml') or speech.get('text') or ''
+    if any(message in text for message in FAILURE_SPEECH):
+        return False
+    if expect_play:
+        return any(directive.get('type') == 'AudioPlayer.Play'
+                   for directive in answer.get('directives') or [])
+    return True
+
+
+def run_level(url: str, body: bytes, concurrency: int, total: int,
+              expect_play: bool = False) -> Dict:
+    """
+    Send `total` copies of one request with `concurrency` requests in flight
+
+    Args:
+        url: Base URL of the skill
+        body: Encoded request envelope
+        concurrency: Requests in flight at once
+        total: Requests to send
+        expect_play: Count answers without an AudioPlayer.Play directive as errors
+
+    Returns:
+        Dict with latency percentiles in ms, throughput and error count
+    """
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def send(_):
+        nonlocal errors
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            ok = succeeded(session.post(f'{url}/alexa', data=body, timeout=30,
+                                        headers={'Content-Type': 'application/json'}),
+                           expect_play)
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(send, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': total,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'rps': total / wall if wall else 0.0
+    }
+
+
+def run_suite(url: str, corpus: Dict[str, Dict], concurrency_levels: List[int],
+              total: int, workers: Optional[int]) -> List[Dict]:
+    # Warm up catalogs, connection pools and caches before measuring
+    for envelope in corpus.values():
+        requests.post(f'{url}/alexa', data=encode(envelope), timeout=30,
+                      headers={'Content-Type': 'application/json'})
+    time.sleep(1)
+
+    results = []
+    for concurrency in concurrency_levels:
+        for name, envelope in corpus.items():
+            result = run_level(url, encode(envelope), concurrency, total,
+                               expect_play=name in PLAY_HANDLERS)
+            result.update({'workers': workers, 'concurrency': concurrency, 'handler': name})
+            results.append(result)
+            print_row(result)
+    return results
+
+
+def print_header() -> None:
+    print(f"{'workers':>7} {'conc':>5} {'handler':<32}{'n':>6}{'err':>5}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}")
+
+
+def print_row(result: Dict) -> None:
+    print(f"{result['workers'] or '-':>7} {result['concurrency']:>5} {result['handler']:<32}"
+          f"{result['requests']:>6}{result['errors']:>5}{result['p50_ms']:>9.1f}"
+          f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['rps']:>9.1f}", flush=True)
+
+
+def int_list(value: str) -> List[int]:
+    return [int(part) for part in value.split(',') if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--target', help='benchmark an already running skill at this URL')
+    parser.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi',
+                        help='serving mode for the spawned gunicorn')
+    parser.add_argument('--workers', type=int_list, default=[1, 4],
+                        help='comma-separated gunicorn worker counts')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 8, 32],
+                        help='comma-separated numbers of requests in flight')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per handler and concurrency level')
+    parser.add_argument('--handlers', help='comma-separated handler names (default: all)')
+    parser.add_argument('--items', type=int, default=5000, help='books in the fake library')
+    parser.add_argument('--latency-ms', type=float, default=20, help='fake server latency')
+    parser.add_argument('--jitter-ms', type=float, default=5, help='fake server jitter')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+    if args.handlers:
+        wanted = args.handlers.split(',')
+        corpus = {name: envelope for name, envelope in corpus.items() if name in wanted}
+    else:
+        missing = check_coverage(corpus)
+        if missing:
+            print(f"Warning: no envelope for {', '.join(missing)}", file=sys.stderr)
+
+    results = []
+    print_header()
+
+    if args.target:
+        results += run_suite(args.target.rstrip('/'), corpus, args.concurrency, args.requests, None)
+    else:
+        fake = FakeAudioBookshelfServer(0, args.items, args.latency_ms, args.jitter_ms).start()
+        for workers in args.workers:
+            server = SkillServer(workers, fake.url, args.mode)
+            try:
+                server.wait_ready()
+                results += run_suite(server.url, corpus, args.concurrency, args.requests, workers)
+            finally:
+                server.stop()
+        fake.shutdown()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+Circuit breaker for calls to AudioBookshelf
+After repeated failures calls fail at once instead of waiting out their timeouts, until a trial call succeeds
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+from metrics import CIRCUIT_BREAKER_EVENTS
+from storage import SQLiteStore, data_path
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Seconds between checks for a circuit another worker opened
+SHARED_CHECK_INTERVAL = 1
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a server whose circuit is open"""
+
+
+class BreakerStore(SQLiteStore):
+    """Open circuits shared by all workers, so each does not have to find out on its own"""
+
+    def create_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS circuit_breakers (
+                    name TEXT PRIMARY KEY,
+                    open_until REAL NOT NULL
+                )
+            ''')
+
+    def get_open_until(self, name: str) -> float:
+        row = self.connection().execute(
+            'SELECT open_until FROM circuit_breakers WHERE name = ?', (name,)
+        ).fetchone()
+        return row['open_until'] if row else 0
+
+    def set_open_until(self, name: str, open_until: float) -> None:
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO circuit_breakers (name, open_until) VALUES (?, ?)
+                ON CONFLICT (name) DO UPDATE SET open_until = excluded.open_until
+            ''', (name, open_until))
+
+
+class CircuitBreaker:
+    """Closed, open or half-open circuit for one server"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30,
+                 store: Optional[BreakerStore] = None):
+        """
+        Initialize the circuit breaker
+
+        Args:
+            name: Server the circuit protects, e.g. its base URL
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before a trial call
+            store: Store for sharing open circuits with other workers
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.store = store
+        self._state = CLOSED
+        self._failures = 0
+        self._open_until = 0
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """
+        Check whether calls are currently being refused
+
+        Returns:
+            True while the circuit is open and not yet due for a trial call
+        """
+        with self._lock:
+            self._check_shared(time.time())
+            return self._state != CLOSED and time.time() < self._open_until
+
+    def before_call(self) -> None:
+        """
+        Let a call through, or refuse it
+
+        Once the open period is over, one trial call is let through; its
+        outcome closes or reopens the circuit. Should it never report back,
+        another trial follows after the next period.
+
+        Raises:
+            CircuitOpenError: If the call must not be made
+        """
+        now = time.time()
+        with self._lock:
+            self._check_shared(now)
+
+            if self._state == CLOSED:
+                return
+            if now >= self._open_until:
+                self._state = HALF_OPEN
+                self._open_until = now + self.reset_timeout
+                logger.info(f'Circuit for {self.name} half-open, sending a trial call')
+                return
+
+        CIRCUIT_BREAKER_EVENTS.inc(event='rejected')
+        raise CircuitOpenError(f'Circuit for {self.name} is open')
+
+    def record_success(self) -> None:
+        """
+        Record a call that reached a healthy server
+        """
+        with self._lock:
+            self._failures = 0
+            if self._state == CLOSED:
+                return
+            self._state = CLOSED
+            self._open_until = 0
+
+        logger.info(f'Circuit for {self.name} closed')
+        CIRCUIT_BREAKER_EVENTS.inc(event='closed')
+        if self.store:
+            self.store.set_open_until(self.name, 0)
+
+    def record_failure(self) -> None:
+        """
+        Record a call that failed to connect, timed out or got a server error
+        """
+        now = time.time()
+        with self._lock:
+            self._failures += 1
+            if self._state == OPEN or (self._state == CLOSED
+                                       and self._failures < self.failure_threshold):
+                return
+            self._state = OPEN
+            self._open_until = now + self.reset_timeout
+
+        logger.warning(f'Circuit for {self.name} opened for {self.reset_timeout:g}s '
+                       f'after {self._failures} failure(s)')
+        CIRCUIT_BREAKER_EVENTS.inc(event='opened')
+        if self.store:
+            self.store.set_open_until(self.name, self._open_until)
+
+    def _check_shared(self, now: float) -> None:
+        """
+        Adopt a circuit another worker opened (caller holds the lock)
+        """
+        if self.store is None or self._state != CLOSED:
+            return
+        if now - self._checked_at < SHARED_CHECK_INTERVAL:
+            return
+
+        self._checked_at = now
+        open_until = self.store.get_open_until(self.name)
+        if open_until > now:
+            self._state = OPEN
+            self._open_until = open_until
+
+
+_breakers = {}
+_breakers_pid = None
+_breakers_lock = threading.Lock()
+_store = None
+
+
+def get_breaker(base_url: str) -> CircuitBreaker:
+    """
+    Get this process's circuit breaker for a server, configured from the environment
+
+    Args:
+        base_url: The base URL of the AudioBookshelf server
+
+    Returns:
+        CircuitBreaker instance
+    """
+    global _breakers, _breakers_pid, _store
+
+    name = base_url.rstrip('/')
+    pid = os.getpid()
+    breaker = _breakers.get(name) if _breakers_pid == pid else None
+    if breaker is not None:
+        return breaker
+
+    with _breakers_lock:
+        if _breakers_pid != pid:
+            # Locks held by the parent's threads at fork time would never be released
+            _breakers = {}
+            _breakers_pid = pid
+        if _store is None:
+            _store = BreakerStore(os.getenv('BREAKER_DB_PATH') or data_path('breakers.db'))
+
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                name,
+                failure_threshold=int(os.getenv('ABS_BREAKER_FAILURES', 3)),
+                reset_timeout=float(os.getenv('ABS_BREAKER_RESET_SECONDS', 30)),
+                store=_store
+            )
+            _breakers[name] = breaker
+
+    return breaker
@@ -0,0 +1,516 @@
+"""
+Local catalog mirror of AudioBookshelf libraries
+Lets PlayBookIntent resolve titles without calling the server
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from audiobookshelf_client import AudioBookshelfClient
+from metrics import observe_cache
+from models import Item
+from storage import SQLiteStore, data_path
+
+logger = logging.getLogger(__name__)
+
+# How long a worker may hold a library's sync lease before others take over
+SYNC_LEASE_SECONDS = 120
+
+
+def _account(token: str) -> str:
+    # Identifies a linked account by a short, fixed-size key
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()
+
+
+class Catalog(SQLiteStore):
+    """
+    SQLite mirror of library items with a full-text title index
+
+    Items are mirrored once per server and library. Which libraries each
+    linked account may see is kept per account, and lookups only search the
+    caller's libraries, so accounts with different permissions on the same
+    server never match each other's items.
+    """
+
+    def __init__(self, path: str, sync_interval: float = 300,
+                 full_sync_interval: float = 86400, page_size: int = 500):
+        """
+        Initialize the catalog
+
+        Args:
+            path: Path of the SQLite database file
+            sync_interval: Seconds between incremental syncs of a library
+            full_sync_interval: Seconds between full syncs, which also drop
+                items that were removed from the server
+            page_size: Items fetched per upstream page while syncing
+        """
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.page_size = page_size
+        self.fts = False
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS items (
+                    id INTEGER PRIMARY KEY,
+                    base_url TEXT NOT NULL,
+                    library_id TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    media_type TEXT,
+                    title TEXT,
+                    author TEXT,
+                    series TEXT,
+                    duration REAL,
+                    cover_path TEXT,
+                    updated_at INTEGER,
+                    synced_at INTEGER,
+                    UNIQUE (base_url, item_id)
+                );
+                CREATE INDEX IF NOT EXISTS items_library
+                    ON items (base_url, library_id);
+                CREATE TABLE IF NOT EXISTS libraries (
+                    base_url TEXT NOT NULL,
+                    library_id TEXT NOT NULL,
+                    name TEXT,
+                    media_type TEXT,
+                    display_order INTEGER,
+                    fetched_at REAL,
+                    PRIMARY KEY (base_url, library_id)
+                );
+                CREATE TABLE IF NOT EXISTS account_libraries (
+                    base_url TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    library_id TEXT NOT NULL,
+                    PRIMARY KEY (base_url, account, library_id)
+                );
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    base_url TEXT NOT NULL,
+                    library_id TEXT NOT NULL,
+                    watermark INTEGER DEFAULT 0,
+                    last_sync REAL DEFAULT 0,
+                    last_full_sync REAL DEFAULT 0,
+                    lease_until REAL DEFAULT 0,
+                    PRIMARY KEY (base_url, library_id)
+                );
+            ''')
+
+        try:
+            with conn:
+                conn.executescript('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+                        title, author, series, content='items', content_rowid='id'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS items_ai AFTER INSERT ON items BEGIN
+                        INSERT INTO items_fts (rowid, title, author, series)
+                        VALUES (new.id, new.title, new.author, new.series);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS items_ad AFTER DELETE ON items BEGIN
+                        INSERT INTO items_fts (items_fts, rowid, title, author, series)
+                        VALUES ('delete', old.id, old.title, old.author, old.series);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS items_au AFTER UPDATE ON items BEGIN
+                        INSERT INTO items_fts (items_fts, rowid, title, author, series)
+                        VALUES ('delete', old.id, old.title, old.author, old.series);
+                        INSERT INTO items_fts (rowid, title, author, series)
+                        VALUES (new.id, new.title, new.author, new.series);
+                    END;
+                ''')
+            self.fts = True
+        except Exception as e:
+            # SQLite builds without FTS5 fall back to LIKE matching
+            logger.warning(f'FTS5 unavailable, catalog search uses LIKE: {e}')
+
+    # -------------------------------------------------------------------------
+    # Lookups
+    # -------------------------------------------------------------------------
+
+    def get_libraries(self, client: AudioBookshelfClient) -> List[Dict]:
+        """
+        Get the libraries the client's account can access, fetching them only if none are stored
+
+        Args:
+            client: AudioBookshelf client for the server and account
+
+        Returns:
+            List of library objects with 'id', 'name' and 'mediaType'
+        """
+        libraries = self.stored_libraries(client.base_url, client.token)
+        if libraries:
+            return libraries
+
+        libraries = client.get_libraries()
+        self.store_libraries(client.base_url, client.token, libraries)
+        return libraries
+
+    def stored_libraries(self, base_url: str, token: str) -> List[Dict]:
+        """
+        Get the libraries mirrored for an account on a server, without calling it
+
+        Args:
+            base_url: AudioBookshelf base URL
+            token: Token identifying the linked account
+
+        Returns:
+            List of library objects, empty if none are stored yet
+        """
+        rows = self.connection().execute(
+            'SELECT libraries.library_id, name, media_type FROM account_libraries '
+            'JOIN libraries ON libraries.base_url = account_libraries.base_url '
+            'AND libraries.library_id = account_libraries.library_id '
+            'WHERE account_libraries.base_url = ? AND account = ? ORDER BY display_order',
+            (base_url, _account(token))
+        ).fetchall()
+        return [{'id': row['library_id'], 'name': row['name'], 'mediaType': row['media_type']}
+                for row in rows]
+
+    def updated_at(self, base_url: str, item_id: str) -> Optional[int]:
+        """
+        Get when the server last changed an item, as of the latest sync
+
+        Args:
+            base_url: AudioBookshelf base URL
+            item_id: The library item ID
+
+        Returns:
+            updatedAt in milliseconds, or None if the item is not mirrored
+        """
+        row = self.connection().execute(
+            'SELECT updated_at FROM items WHERE base_url = ? AND item_id = ?',
+            (base_url, item_id)
+        ).fetchone()
+        return row['updated_at'] if row else None
+
+    def find_item(self, client: AudioBookshelfClient, library_ids: List[str], query: str,
+                  media_type: Optional[str] = 'book') -> Optional[Item]:
+        """
+        Find the best matching item in the local mirror
+
+        Also schedules a background sync of each library when it is due.
+
+        Args:
+            client: AudioBookshelf client for the server
+            library_ids: The library IDs to search in
+            query: Spoken title, author or series
+            media_type: Restrict matches to 'book' or 'podcast'; None for any
+
+        Returns:
+            Library item, or None on a miss
+        """
+        for library_id in library_ids:
+            self.ensure_synced(client, library_id)
+        results = self.search(client.base_url, library_ids, query, media_type, limit=1)
+        observe_cache('catalog', bool(results))
+        return results[0] if results else None
+
+    def search(self, base_url: str, library_ids: List[str], query: str,
+               media_type: Optional[str] = None, limit: int = 10) -> List[Item]:
+        """
+        Search the local mirror, best match first
+
+        Args:
+            base_url: AudioBookshelf base URL
+            library_ids: Libraries to search in
+            query: Search query
+            media_type: Restrict matches to 'book' or 'podcast'; None for any
+            limit: Maximum number of results
+
+        Returns:
+            List of library items
+        """
+        words = re.findall(r'\w+', query.lower())
+        if not words or not library_ids:
+            return []
+
+        placeholders = ','.join('?' * len(library_ids))
+        media_filter = 'AND items.media_type = ?' if media_type else ''
+
+        if self.fts:
+            match = ' '.join(f'"{word}"*' for word in words)
+            sql = f'''
+                SELECT items.*, lower(items.title) = ? AS exact
+                FROM items_fts JOIN items ON items.id = items_fts.rowid
+                WHERE items_fts MATCH ? AND items.base_url = ?
+                    AND items.library_id IN ({placeholders}) {media_filter}
+                ORDER BY exact DESC, bm25(items_fts, 10.0, 4.0, 2.0)
+                LIMIT ?
+            '''
+            params = [query.strip().lower(), match]
+        else:
+            like = ' AND '.join(
+                '(lower(items.title) LIKE ? OR lower(items.author) LIKE ? '
+                'OR lower(items.series) LIKE ?)' for _ in words
+            )
+            sql = f'''
+                SELECT items.*, lower(items.title) = ? AS exact
+                FROM items
+                WHERE {like} AND items.base_url = ?
+                    AND items.library_id IN ({placeholders}) {media_filter}
+                ORDER BY exact DESC, length(items.title)
+                LIMIT ?
+            '''
+            params = [query.strip().lower()]
+            for word in words:
+                params.extend([f'%{word}%'] * 3)
+
+        params.append(base_url)
+        params.extend(library_ids)
+        if media_type:
+            params.append(media_type)
+        params.append(limit)
+
+        rows = self.connection().execute(sql, params).fetchall()
+        return [self._row_to_item(row) for row in rows]
+
+    # -------------------------------------------------------------------------
+    # Sync
+    # -------------------------------------------------------------------------
+
+    def ensure_synced(self, client: AudioBookshelfClient, library_id: str) -> None:
+        """
+        Start a background sync of a library if one is due
+
+        Only one worker syncs a library at a time; the rest keep serving
+        lookups from whatever is already mirrored.
+
+        Args:
+            client: AudioBookshelf client for the server
+            library_id: The library ID
+        """
+        now = time.time()
+        state = self._get_state(client.base_url, library_id)
+
+        full = now - state['last_full_sync'] >= self.full_sync_interval
+        if not full and now - state['last_sync'] < self.sync_interval:
+            return
+
+        if not self._claim(client.base_url, library_id, now):
+            return
+
+        thread = threading.Thread(
+            target=self._sync_in_background,
+            args=(client, library_id, full),
+            daemon=True
+        )
+        thread.start()
+
+    def sync_library(self, client: AudioBookshelfClient, library_id: str,
+                     full: bool = False) -> int:
+        """
+        Mirror items changed on the server since the last sync
+
+        Pages through the library newest-first by updatedAt and stops at the
+        first item that is not newer than the stored watermark. A full sync
+        walks every page and drops items the server no longer has.
+
+        Args:
+            client: AudioBookshelf client for the server
+            library_id: The library ID
+            full: Re-read the whole library instead of the changes only
+
+        Returns:
+            Number of items written to the mirror
+        """
+        base_url = client.base_url
+        watermark = 0 if full else self._get_state(base_url, library_id)['watermark']
+        started = int(time.time() * 1000)
+        newest = watermark
+        written = 0
+        page = 0
+
+        while True:
+            data = client.get_library_items(library_id, page=page, limit=self.page_size)
+            results = data.get('results', [])
+
+            rows = []
+            reached_watermark = False
+            for item in results:
+                updated_at = item.get('updatedAt') or 0
+                if not full and updated_at <= watermark:
+                    reached_watermark = True
+                    break
+                rows.append(self._item_to_row(base_url, library_id, item, started))
+                newest = max(newest, updated_at)
+
+            self._upsert_items(rows)
+            written += len(rows)
+            page += 1
+
+            if reached_watermark or len(results) < self.page_size:
+                break
+
+        conn = self.connection()
+        with conn:
+            if full:
+                conn.execute(
+                    'DELETE FROM items WHERE base_url = ? AND library_id = ? AND synced_at < ?',
+                    (base_url, library_id, started)
+                )
+            conn.execute(
+                'UPDATE sync_state SET watermark = ?, last_sync = ?, '
+                'last_full_sync = CASE WHEN ? THEN ? ELSE last_full_sync END '
+                'WHERE base_url = ? AND library_id = ?',
+                (newest, time.time(), full, time.time(), base_url, library_id)
+            )
+
+        logger.info(f"Catalog {'full' if full else 'incremental'} sync of library "
+                    f"{library_id}: {written} item(s)")
+        return written
+
+    def _sync_in_background(self, client: AudioBookshelfClient, library_id: str,
+                            full: bool) -> None:
+        try:
+            self.store_libraries(client.base_url, client.token, client.get_libraries())
+            self.sync_library(client, library_id, full=full)
+        except Exception as e:
+            logger.error(f'Catalog sync failed: {e}')
+        finally:
+            conn = self.connection()
+            with conn:
+                conn.execute(
+                    'UPDATE sync_state SET lease_until = 0 WHERE base_url = ? AND library_id = ?',
+                    (client.base_url, library_id)
+                )
+
+    def _claim(self, base_url: str, library_id: str, now: float) -> bool:
+        """
+        Take the sync lease for a library; False if another worker holds it
+        """
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO sync_state (base_url, library_id) VALUES (?, ?)',
+                (base_url, library_id)
+            )
+            cursor = conn.execute(
+                'UPDATE sync_state SET lease_until = ? '
+                'WHERE base_url = ? AND library_id = ? AND lease_until < ?',
+                (now + SYNC_LEASE_SECONDS, base_url, library_id, now)
+            )
+        return cursor.rowcount == 1
+
+    def _get_state(self, base_url: str, library_id: str) -> Dict:
+        row = self.connection().execute(
+            'SELECT watermark, last_sync, last_full_sync FROM sync_state '
+            'WHERE base_url = ? AND library_id = ?',
+            (base_url, library_id)
+        ).fetchone()
+        if not row:
+            return {'watermark': 0, 'last_sync': 0, 'last_full_sync': 0}
+        return dict(row)
+
+    def store_libraries(self, base_url: str, token: str, libraries: List[Dict]) -> None:
+        """
+        Replace the libraries mirrored for an account on a server
+
+        Args:
+            base_url: AudioBookshelf base URL
+            token: Token identifying the linked account
+            libraries: Library objects the server returned for the account
+        """
+        account = _account(token)
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO libraries (base_url, library_id, name, media_type, '
+                'display_order, fetched_at) VALUES (?, ?, ?, ?, ?, ?)',
+                [(base_url, library['id'], library.get('name'), library.get('mediaType'),
+                  library.get('displayOrder', index), time.time())
+                 for index, library in enumerate(libraries)]
+            )
+            conn.execute('DELETE FROM account_libraries WHERE base_url = ? AND account = ?',
+                         (base_url, account))
+            conn.executemany(
+                'INSERT INTO account_libraries (base_url, account, library_id) VALUES (?, ?, ?)',
+                [(base_url, account, library['id']) for library in libraries]
+            )
+            # Libraries no linked account can see any more
+            conn.execute(
+                'DELETE FROM libraries WHERE base_url = ? AND library_id NOT IN '
+                '(SELECT library_id FROM account_libraries WHERE base_url = ?)',
+                (base_url, base_url)
+            )
+
+    def _upsert_items(self, rows: List[tuple]) -> None:
+        if not rows:
+            return
+        conn = self.connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO items (base_url, library_id, item_id, media_type, title,
+                                   author, series, duration, cover_path, updated_at, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (base_url, item_id) DO UPDATE SET
+                    library_id = excluded.library_id,
+                    media_type = excluded.media_type,
+                    title = excluded.title,
+                    author = excluded.author,
+                    series = excluded.series,
+                    duration = excluded.duration,
+                    cover_path = excluded.cover_path,
+                    updated_at = excluded.updated_at,
+                    synced_at = excluded.synced_at
+            ''', rows)
+
+    @staticmethod
+    def _item_to_row(base_url: str, library_id: str, item: Dict, synced_at: int) -> tuple:
+        media = item.get('media') or {}
+        metadata = media.get('metadata') or {}
+        return (
+            base_url,
+            item.get('libraryId') or library_id,
+            item['id'],
+            item.get('mediaType'),
+            metadata.get('title'),
+            metadata.get('authorName') or metadata.get('author'),
+            metadata.get('seriesName'),
+            media.get('duration'),
+            media.get('coverPath'),
+            item.get('updatedAt') or 0,
+            synced_at
+        )
+
+    @staticmethod
+    def _row_to_item(row) -> Item:
+        return Item(
+            id=row['item_id'],
+            library_id=row['library_id'],
+            media_type=row['media_type'] or 'book',
+            title=row['title'],
+            author=row['author'],
+            series=row['series'],
+            cover_path=row['cover_path'],
+            duration=row['duration'] or 0,
+            updated_at=row['updated_at']
+        )
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> Catalog:
+    """
+    Get the process-wide catalog, configured from the environment
+
+    Returns:
+        Catalog instance
+    """
+    global _catalog
+
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = Catalog(
+                    os.getenv('CATALOG_DB_PATH') or data_path('catalog.db'),
+                    sync_interval=float(os.getenv('CATALOG_SYNC_INTERVAL', 300)),
+                    full_sync_interval=float(os.getenv('CATALOG_FULL_SYNC_INTERVAL', 86400))
+                )
+
+    return _catalog
@@ -0,0 +1,134 @@
+"""
+Chapter index of a book, kept in its cached track list entry
+Finds the chapter at an offset by binary search so seeks are answered without calling AudioBookshelf
+"""
+
+from bisect import bisect_right
+from typing import Dict, Iterable, NamedTuple, Optional
+
+# Seconds into a chapter after which "previous chapter" restarts it instead
+RESTART_THRESHOLD = 3
+
+
+class ChapterPosition(NamedTuple):
+    """A chapter and where it starts"""
+
+    # 0-based position in the book
+    index: int
+    start_ms: int
+    title: Optional[str]
+
+
+def build_chapter_index(chapters: Iterable[Dict]) -> Dict:
+    """
+    Build the chapter index stored with a track list entry
+
+    Args:
+        chapters: AudioBookshelf chapter objects with 'start' and 'title'
+
+    Returns:
+        Dict with parallel 'starts' (seconds, ascending) and 'titles' lists
+    """
+    ordered = sorted(chapters, key=lambda chapter: chapter.get('start') or 0)
+    return {
+        'starts': [chapter.get('start') or 0 for chapter in ordered],
+        'titles': [chapter.get('title') for chapter in ordered]
+    }
+
+
+def chapter_count(entry: Optional[Dict]) -> int:
+    """
+    Get the number of chapters of a cached track list entry
+    """
+    return len(((entry or {}).get('chapters') or {}).get('starts') or [])
+
+
+def chapter(entry: Optional[Dict], index: int) -> Optional[ChapterPosition]:
+    """
+    Get a chapter by its 0-based position
+
+    Args:
+        entry: Cached track list of the item
+        index: Chapter position in the book
+
+    Returns:
+        ChapterPosition, or None if the book has no such chapter
+    """
+    if not 0 <= index < chapter_count(entry):
+        return None
+    index_data = entry['chapters']
+    return ChapterPosition(index, int(index_data['starts'][index] * 1000),
+                           index_data['titles'][index])
+
+
+def chapter_at(entry: Optional[Dict], offset_ms: int) -> Optional[ChapterPosition]:
+    """
+    Get the chapter playing at an offset
+
+    Args:
+        entry: Cached track list of the item
+        offset_ms: Position within the book in milliseconds
+
+    Returns:
+        Last chapter starting at or before the offset (the first chapter for
+        offsets before it), or None for books without chapters
+    """
+    if not chapter_count(entry):
+        return None
+    position = bisect_right(entry['chapters']['starts'], max(0, offset_ms) / 1000) - 1
+    return chapter(entry, max(0, position))
+
+
+def next_chapter(entry: Optional[Dict], offset_ms: int) -> Optional[ChapterPosition]:
+    """
+    Get the chapter after the one playing at an offset
+
+    Returns:
+        ChapterPosition, or None in the last chapter or for books without chapters
+    """
+    current = chapter_at(entry, offset_ms)
+    return chapter(entry, current.index + 1) if current else None
+
+
+def previous_chapter(entry: Optional[Dict], offset_ms: int) -> Optional[ChapterPosition]:
+    """
+    Get the chapter to go back to from an offset
+
+    Like a CD player: more than RESTART_THRESHOLD seconds into a chapter this
+    is the start of the same chapter, otherwise the one before it.
+
+    Returns:
+        ChapterPosition, or None for books without chapters
+    """
+    current = chapter_at(entry, offset_ms)
+    if current is None:
+        return None
+    if offset_ms - current.start_ms > RESTART_THRESHOLD * 1000 or current.index == 0:
+        return current
+    return chapter(entry, current.index - 1)
+
+
+def clamp_offset(entry: Optional[Dict], offset_ms: int, episode_id: Optional[str] = None) -> int:
+    """
+    Keep an offset within the item, or within a podcast episode
+
+    Args:
+        entry: Cached track list of the item
+        offset_ms: Requested position in milliseconds
+        episode_id: Podcast episode the offset is in, if any
+
+    Returns:
+        Offset between the start and the last second of the item; unbounded
+        above when its duration is unknown
+    """
+    offset_ms = max(0, int(offset_ms))
+    entry = entry or {}
+    if episode_id:
+        duration = next((track['duration'] for track in entry.get('tracks') or []
+                         if track['episode_id'] == episode_id), 0)
+    else:
+        duration = entry.get('duration') or 0
+    duration_ms = int(duration * 1000)
+    if duration_ms > 1000:
+        offset_ms = min(offset_ms, duration_ms - 1000)
+    return offset_ms
@@ -0,0 +1,167 @@
+"""
+Process-wide registry of AudioBookshelf clients
+Reuses keep-alive HTTP sessions across Alexa requests
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from audiobookshelf_client import AudioBookshelfClient, DEFAULT_POOL_SIZE
+from metrics import observe_cache
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """LRU registry of AudioBookshelf clients keyed by (base_url, token)"""
+
+    def __init__(self, max_clients: int = 32, idle_ttl: float = 900,
+                 pool_size: int = DEFAULT_POOL_SIZE, hedge_delay: float = 0):
+        """
+        Initialize the client registry
+
+        Args:
+            max_clients: Maximum number of clients kept alive at once
+            idle_ttl: Seconds a client may sit unused before it is evicted
+            pool_size: Keep-alive connections per client
+            hedge_delay: Seconds a client waits on a GET before sending a second copy
+        """
+        self.max_clients = max_clients
+        self.idle_ttl = idle_ttl
+        self.pool_size = pool_size
+        self.hedge_delay = hedge_delay
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def get(self, base_url: str, token: str) -> AudioBookshelfClient:
+        """
+        Get a pooled client, creating it on first use
+
+        Args:
+            base_url: The base URL of the AudioBookshelf server
+            token: JWT token or API token for authentication
+
+        Returns:
+            AudioBookshelfClient instance shared by this process
+        """
+        key = (base_url.rstrip('/'), token)
+        now = time.monotonic()
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._forget_all()
+
+            entry = self._clients.get(key)
+            if entry:
+                client, _ = entry
+                self._clients[key] = (client, now)
+                self._clients.move_to_end(key)
+                observe_cache('abs_clients', True)
+                return client
+
+            client = AudioBookshelfClient(key[0], token, pool_size=self.pool_size,
+                                          hedge_delay=self.hedge_delay)
+            self._clients[key] = (client, now)
+            self._evict(now)
+
+        observe_cache('abs_clients', False)
+        return client
+
+    def clear(self) -> None:
+        """
+        Close and remove every client in the registry, e.g. at shutdown
+
+        Unlike eviction this closes the clients, so only call it once no
+        request is using them.
+        """
+        with self._lock:
+            clients = [client for client, _ in self._clients.values()]
+            self._clients.clear()
+
+        for client in clients:
+            client.close()
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+    def _evict(self, now: float) -> None:
+        """
+        Drop idle and least recently used clients (caller holds the lock)
+
+        Dropped clients are not closed: callers that got them earlier may
+        still be mid-request, and their connections are closed once the last
+        reference is gone.
+        """
+        evicted = 0
+
+        # Oldest entries sit at the front, so stop at the first fresh one
+        while self._clients:
+            key, (_, last_used) = next(iter(self._clients.items()))
+            if len(self._clients) <= self.max_clients and now - last_used < self.idle_ttl:
+                break
+            del self._clients[key]
+            evicted += 1
+
+        if evicted:
+            logger.debug(f'Evicted {evicted} AudioBookshelf client(s)')
+
+    def _forget_all(self) -> None:
+        """
+        Drop clients inherited from a parent process without closing them
+
+        Sockets opened before a fork are shared with the parent, so the child
+        must not reuse or shut them down.
+        """
+        self._clients = OrderedDict()
+        self._pid = os.getpid()
+
+    def _after_fork(self) -> None:
+        # The parent's lock may have been held by another thread at fork time
+        self._lock = threading.Lock()
+        self._forget_all()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> ClientRegistry:
+    """
+    Get the process-wide client registry, configured from the environment
+
+    Returns:
+        ClientRegistry instance
+    """
+    global _registry
+
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                registry = ClientRegistry(
+                    max_clients=int(os.getenv('ABS_CLIENT_CACHE_SIZE', 32)),
+                    idle_ttl=float(os.getenv('ABS_CLIENT_IDLE_TTL', 900)),
+                    pool_size=int(os.getenv('ABS_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                    hedge_delay=float(os.getenv('ABS_HEDGE_DELAY_MS', 0)) / 1000
+                )
+                if hasattr(os, 'register_at_fork'):
+                    os.register_at_fork(after_in_child=registry._after_fork)
+                _registry = registry
+
+    return _registry
+
+
+def get_client(base_url: str, token: str) -> AudioBookshelfClient:
+    """
+    Get a pooled AudioBookshelf client from the process-wide registry
+
+    Args:
+        base_url: The base URL of the AudioBookshelf server
+        token: JWT token or API token for authentication
+
+    Returns:
+        AudioBookshelfClient instance
+    """
+    return get_registry().get(base_url, token)
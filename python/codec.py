@@ -0,0 +1,227 @@
+"""
+Fast codec for Alexa request and response envelopes
+Turns raw request bodies into RequestEnvelope objects in one pass and
+writes ResponseEnvelope objects straight to JSON bytes
+"""
+
+import json
+import decimal
+from datetime import date, datetime
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Tuple
+
+from ask_sdk_core.exceptions import SerializationException
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model import RequestEnvelope, ResponseEnvelope
+
+# Shared generic serializer, for callers that need the SDK's own behaviour
+serializer = DefaultSerializer()
+
+PRIMITIVE_TYPES = (float, bool, bytes, str, int)
+NATIVE_TYPES = {
+    'int': int,
+    'float': float,
+    'str': str,
+    'bool': bool,
+    'object': object
+}
+
+
+def decode_request(body: bytes) -> RequestEnvelope:
+    """
+    Decode a raw Alexa request body into a RequestEnvelope
+
+    Produces the same objects as DefaultSerializer.deserialize, but parses
+    the JSON once and reuses compiled per-class field plans.
+
+    Args:
+        body: Raw HTTP request body
+
+    Returns:
+        RequestEnvelope instance
+
+    Raises:
+        SerializationException: If the body is not a valid envelope
+    """
+    try:
+        payload = json.loads(body)
+    except Exception:
+        raise SerializationException("Couldn't parse request body")
+
+    try:
+        return _decode_model(payload, RequestEnvelope)
+    except SerializationException:
+        raise
+    except Exception as e:
+        raise SerializationException(str(e))
+
+
+def encode_response(response_envelope: ResponseEnvelope) -> bytes:
+    """
+    Encode a ResponseEnvelope into JSON bytes
+
+    Args:
+        response_envelope: Response returned by skill.invoke
+
+    Returns:
+        UTF-8 encoded JSON body
+    """
+    return json.dumps(_encode(response_envelope), separators=(',', ':')).encode('utf-8')
+
+
+# =============================================================================
+# DECODING
+# =============================================================================
+
+@lru_cache(maxsize=None)
+def _load_class(class_name: str) -> type:
+    module_name, _, resolved_class_name = class_name.rpartition('.')
+    try:
+        module = __import__(module_name, fromlist=[resolved_class_name])
+        return getattr(module, resolved_class_name)
+    except Exception as e:
+        raise SerializationException(
+            f"Unable to resolve class {class_name} from installed modules: {e}")
+
+
+@lru_cache(maxsize=None)
+def _decoder(type_spec: str) -> Callable[[Any], Any]:
+    """
+    Compile a decoder for a deserialized_types entry such as 'list[a.b.C]'
+    """
+    if type_spec.startswith('list[') and ',' not in type_spec:
+        item_decoder = _decoder(type_spec[5:-1].strip())
+        return lambda payload: [item_decoder(sub) for sub in payload]
+
+    if type_spec.startswith('dict('):
+        value_decoder = _decoder(type_spec[5:-1].split(',', 1)[1].strip())
+        return lambda payload: {key: value_decoder(val) for key, val in payload.items()}
+
+    if type_spec.startswith('list['):
+        # Tuple-like lists are rare enough to leave to the generic serializer
+        return lambda payload: serializer.deserialize(json.dumps(payload), type_spec)
+
+    if type_spec == 'object':
+        return lambda payload: payload
+
+    if type_spec in NATIVE_TYPES:
+        return _primitive_decoder(NATIVE_TYPES[type_spec])
+
+    if type_spec in ('datetime', 'date'):
+        return _datetime_decoder(type_spec == 'date')
+
+    obj_type = _load_class(type_spec)
+
+    if issubclass(obj_type, Enum):
+        return obj_type
+
+    if hasattr(obj_type, 'deserialized_types'):
+        return lambda payload: _decode_model(payload, obj_type)
+
+    return lambda payload: payload
+
+
+def _primitive_decoder(obj_type: type) -> Callable[[Any], Any]:
+    def decode(payload):
+        try:
+            return obj_type(payload)
+        except TypeError:
+            return payload
+        except ValueError:
+            raise SerializationException(
+                f"Failed to parse {payload} into '{obj_type.__name__}' object")
+    return decode
+
+
+def _datetime_decoder(as_date: bool) -> Callable[[Any], Any]:
+    def decode(payload):
+        try:
+            # Alexa timestamps are plain ISO 8601, so skip dateutil when possible
+            parsed = datetime.fromisoformat(payload.replace('Z', '+00:00'))
+        except (AttributeError, ValueError):
+            from dateutil.parser import parse
+            parsed = parse(payload)
+        return parsed.date() if as_date else parsed
+    return decode
+
+
+@lru_cache(maxsize=None)
+def _model_plan(obj_type: type) -> Tuple[List[Tuple[str, str, Callable]], frozenset]:
+    """
+    Compile (attribute, json key, decoder) triples for a model class
+    """
+    attribute_map = dict(getattr(obj_type, 'attribute_map', {}))
+    for name in obj_type.deserialized_types:
+        attribute_map.setdefault(name, name)
+
+    fields = [(name, key, _decoder(obj_type.deserialized_types[name]))
+              for name, key in attribute_map.items()]
+    return fields, frozenset(attribute_map.values())
+
+
+def _decode_model(payload: Dict, obj_type: type) -> Any:
+    if payload is None:
+        return None
+
+    if hasattr(obj_type, 'get_real_child_model'):
+        class_name = obj_type.get_real_child_model(payload)
+        if not class_name:
+            raise SerializationException(
+                f"Couldn't resolve object by discriminator type for {obj_type} class")
+        obj_type = _load_class(class_name)
+
+    fields, known_keys = _model_plan(obj_type)
+    model = obj_type()
+
+    for name, key, decode in fields:
+        value = payload.get(key)
+        if value is not None:
+            setattr(model, name, decode(value))
+        elif key in payload:
+            setattr(model, name, None)
+
+    for key in payload:
+        if key not in known_keys:
+            setattr(model, key, payload[key])
+
+    return model
+
+
+# =============================================================================
+# ENCODING
+# =============================================================================
+
+@lru_cache(maxsize=None)
+def _writer_plan(obj_type: type) -> Tuple[Tuple[str, str], ...]:
+    """
+    Compile (attribute, json key) pairs for a model class
+    """
+    attribute_map = getattr(obj_type, 'attribute_map', {})
+    return tuple((name, attribute_map.get(name, name)) for name in obj_type.deserialized_types)
+
+
+def _encode(obj: Any) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, PRIMITIVE_TYPES):
+        return obj
+    if isinstance(obj, list):
+        return [_encode(sub) for sub in obj]
+    if isinstance(obj, tuple):
+        return tuple(_encode(sub) for sub in obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    if isinstance(obj, dict):
+        return {key: _encode(val) for key, val in obj.items()}
+
+    encoded = {}
+    for name, key in _writer_plan(type(obj)):
+        value = getattr(obj, name)
+        if value is not None:
+            encoded[key] = _encode(value)
+    return encoded
@@ -13,6 +13,37 @@ SESSION_KEYS = {
     'OFFSET': 'offsetInMilliseconds'
 }
 
+# MIME types Alexa's AudioPlayer streams without transcoding (MP3, AAC/MP4, HLS)
+ALEXA_MIME_TYPES = [
+    'audio/mpeg',
+    'audio/mp3',
+    'audio/mp4',
+    'audio/aac',
+    'audio/x-aac',
+    'audio/x-m4a',
+    'audio/x-m4b',
+    'application/vnd.apple.mpegurl',
+    'application/x-mpegurl'
+]
+
+# Square cover art sizes offered to Alexa devices, in pixels
+ALEXA_ART_SIZES = {
+    'X_SMALL': 480,
+    'SMALL': 720,
+    'LARGE': 1200
+}
+
+# AudioBookshelf playback session play methods
+PLAY_METHODS = {
+    'DIRECT_PLAY': 0,
+    'DIRECT_STREAM': 1,
+    'TRANSCODE': 2,
+    'LOCAL': 3
+}
+
+# Seconds skipped when a skip intent names no duration
+DEFAULT_SKIP_SECONDS = 30
+
 # Skill states
 STATES = {
     'START': '_START',
@@ -24,11 +55,13 @@ STATES = {
 # Response messages
 MESSAGES = {
     'WELCOME': 'Welcome to Audio Bookshelf. You can ask me to play an audiobook or continue where you left off. What would you like to do?',
-    'HELP': 'You can say things like: play a book, continue my book, or search for books. What would you like to do?',
+    'HELP': 'You can say things like: play a book, continue my book, skip forward thirty seconds, or next chapter. What would you like to do?',
     'GOODBYE': 'Goodbye!',
     'FALLBACK': "Sorry, I didn't understand that. You can say play a book, continue my book, or ask for help.",
     'ERROR': 'Sorry, something went wrong. Please try again.',
     'NO_ITEMS_IN_PROGRESS': "You don't have any books in progress. You can ask me to search for a book to play.",
     'SEARCH_NO_RESULTS': "I couldn't find any books matching that search.",
+    'NOTHING_PLAYING': "There's nothing playing. You can ask me to play a book or continue your current book.",
+    'NO_CHAPTERS': "This title doesn't have chapters.",
     'NOT_CONFIGURED': "Your AudioBookshelf account isn't linked yet. Please configure the skill with your server details."
 }
@@ -0,0 +1,306 @@
+"""
+Cover art proxy with a size-bounded on-disk LRU cache
+Each cover is fetched from AudioBookshelf once and stored resized to Alexa's art sizes
+"""
+
+import io
+import os
+import hashlib
+import logging
+import threading
+from typing import Optional, Tuple
+
+from audiobookshelf_client import AudioBookshelfClient
+from constants import ALEXA_ART_SIZES
+from metrics import observe_cache
+from storage import data_path
+
+logger = logging.getLogger(__name__)
+
+JPEG_QUALITY = 85
+
+# Fraction of the budget kept after an eviction pass, so passes stay rare
+EVICT_TO = 0.9
+
+_key = None
+_key_lock = threading.Lock()
+
+
+def _url_key() -> bytes:
+    """
+    Get the key sealing accounts into cover URLs, creating it on first use
+
+    COVER_URL_KEY wins; otherwise a key is generated once into the data
+    directory, readable only by the skill's user and shared by all workers.
+    """
+    global _key
+
+    if _key is None:
+        with _key_lock:
+            if _key is None:
+                key = os.getenv('COVER_URL_KEY')
+                if key:
+                    _key = key.encode('ascii')
+                else:
+                    _key = _load_or_create_key(data_path('cover_url.key'))
+
+    return _key
+
+
+def _load_or_create_key(path: str) -> bytes:
+    from cryptography.fernet import Fernet
+
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+
+    key = Fernet.generate_key()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def seal_account(base_url: str, token: str) -> str:
+    """
+    Seal an account into an opaque value for a /cover URL
+
+    The value is encrypted and authenticated, so devices cannot read the
+    token from it or forge one for another account.
+
+    Args:
+        base_url: AudioBookshelf base URL
+        token: The account's AudioBookshelf token
+
+    Returns:
+        URL-safe string for the 'a' query parameter
+    """
+    from cryptography.fernet import Fernet
+
+    account = f'{base_url.rstrip("/")}\n{token}'.encode('utf-8')
+    return Fernet(_url_key()).encrypt(account).decode('ascii').rstrip('=')
+
+
+def open_account(sealed: str) -> Optional[Tuple[str, str]]:
+    """
+    Recover the account from a value made by seal_account
+
+    Args:
+        sealed: The 'a' query parameter of a /cover URL
+
+    Returns:
+        Tuple of (base_url, token), or None if the value was not sealed by this skill
+    """
+    from cryptography.fernet import Fernet, InvalidToken
+
+    try:
+        account = Fernet(_url_key()).decrypt(sealed + '=' * (-len(sealed) % 4))
+    except (InvalidToken, ValueError):
+        return None
+    base_url, _, token = account.decode('utf-8').partition('\n')
+    return (base_url, token) if base_url and token else None
+
+
+def nearest_size(size: Optional[int]) -> int:
+    """
+    Snap a requested width to the closest offered art size
+
+    Args:
+        size: Requested width in pixels, or None for the largest
+
+    Returns:
+        One of the ALEXA_ART_SIZES values
+    """
+    sizes = sorted(ALEXA_ART_SIZES.values())
+    if not size:
+        return sizes[-1]
+    return min(sizes, key=lambda offered: abs(offered - size))
+
+
+def resize(data: bytes, size: int) -> bytes:
+    """
+    Fit an image into a size x size square and encode it as JPEG
+
+    Images smaller than the square are re-encoded but not enlarged.
+
+    Args:
+        data: Original image bytes
+        size: Edge of the square in pixels
+
+    Returns:
+        JPEG bytes
+    """
+    # Pillow is only needed when a cover is not cached yet
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+class CoverCache:
+    """Resized covers as files, evicting the least recently served first"""
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Initialize the cover cache
+
+        Args:
+            directory: Directory holding the cached files
+            max_bytes: Total size of cached files before the oldest are evicted
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def etag(self, base_url: str, item_id: str, version: str, size: int) -> str:
+        """
+        Get the entity tag of a cover without reading it
+
+        Args:
+            base_url: AudioBookshelf base URL
+            item_id: The library item ID
+            version: Cover version, e.g. the item's updatedAt
+            size: Art size in pixels
+
+        Returns:
+            Entity tag, also used as the file name
+        """
+        key = f'{base_url}\n{item_id}\n{version}\n{size}'
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, etag: str) -> Optional[bytes]:
+        """
+        Get a cached cover and mark it recently used
+
+        Args:
+            etag: Entity tag from etag()
+
+        Returns:
+            JPEG bytes, or None on a miss
+        """
+        path = self._path(etag)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # The modification time doubles as the LRU timestamp
+            os.utime(path)
+        except OSError:
+            observe_cache('covers', False)
+            return None
+
+        observe_cache('covers', True)
+        return data
+
+    def load(self, client: AudioBookshelfClient, item_id: str, version: str,
+             size: int) -> Optional[bytes]:
+        """
+        Get a cover, fetching and resizing it on a miss
+
+        A miss stores every art size from a single fetch, since a device
+        usually asks for another size of the same cover soon after.
+
+        Args:
+            client: AudioBookshelf client for the server
+            item_id: The library item ID
+            version: Cover version, e.g. the item's updatedAt
+            size: Art size in pixels
+
+        Returns:
+            JPEG bytes, or None if the item has no usable cover
+        """
+        data = self.get(self.etag(client.base_url, item_id, version, size))
+        if data is not None:
+            return data
+
+        try:
+            original = client.get_cover(item_id)
+        except Exception as e:
+            logger.warning(f'Failed to fetch cover of {item_id}: {e}')
+            return None
+
+        for offered in ALEXA_ART_SIZES.values():
+            try:
+                resized = resize(original, offered)
+            except Exception as e:
+                logger.warning(f'Failed to resize cover of {item_id}: {e}')
+                return None
+            self._store(self.etag(client.base_url, item_id, version, offered), resized)
+            if offered == size:
+                data = resized
+
+        self._evict()
+        return data
+
+    def _path(self, etag: str) -> str:
+        return os.path.join(self.directory, f'{etag}.jpg')
+
+    def _store(self, etag: str, data: bytes) -> None:
+        # Write then rename, so other workers never serve a partial file
+        path = self._path(etag)
+        temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+
+    def _evict(self) -> None:
+        with self._evict_lock:
+            files = []
+            total = 0
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.jpg'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            files.sort()
+            target = self.max_bytes * EVICT_TO
+            evicted = 0
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                evicted += 1
+
+            logger.info(f'Evicted {evicted} cached cover(s)')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cover_cache() -> CoverCache:
+    """
+    Get the process-wide cover cache, configured from the environment
+
+    Returns:
+        CoverCache instance
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CoverCache(
+                    os.getenv('COVER_CACHE_DIR') or data_path('covers'),
+                    max_bytes=int(float(os.getenv('COVER_CACHE_MAX_MB', 256)) * 1024 * 1024)
+                )
+
+    return _cache
@@ -0,0 +1,80 @@
+"""
+Request-scoped deadline for upstream calls
+Alexa waits about 8 seconds; every AudioBookshelf call takes its timeout from what is left
+"""
+
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+# Leaves headroom under Alexa's ~8 second limit for encoding and the network
+DEFAULT_BUDGET = 7.0
+
+# Upper bound on the TCP connect phase of a single call
+DEFAULT_CONNECT_TIMEOUT = 3.0
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's time budget is used up before an upstream call"""
+
+
+@contextmanager
+def request_deadline(budget: Optional[float] = None):
+    """
+    Start a deadline for the current request
+
+    The deadline follows the request through contextvars, so it reaches
+    every client call made on the same thread or task. Background threads
+    started from a request do not inherit it.
+
+    Args:
+        budget: Seconds available; defaults to ALEXA_DEADLINE_SECONDS
+    """
+    if budget is None:
+        budget = float(os.getenv('ALEXA_DEADLINE_SECONDS', DEFAULT_BUDGET))
+
+    token = _deadline.set(time.monotonic() + budget)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """
+    Get the seconds left in the current request's budget
+
+    Returns:
+        Seconds left (may be negative), or None outside a request
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def call_timeout(default: float) -> Tuple[float, float]:
+    """
+    Get (connect, read) timeouts for one upstream call
+
+    Args:
+        default: Timeout in seconds used outside a request, e.g. background syncs
+
+    Returns:
+        Tuple of connect and read timeouts in seconds
+
+    Raises:
+        DeadlineExceeded: If the budget is already used up
+    """
+    budget = remaining()
+    if budget is None:
+        budget = default
+    elif budget <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+
+    connect = min(budget, float(os.getenv('ABS_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)))
+    return connect, budget
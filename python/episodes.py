@@ -0,0 +1,387 @@
+"""
+Episode lists of podcasts and each account's queue of unplayed episodes
+A podcast is only re-read when its updatedAt moves, so picking an episode needs no full item fetch
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from audiobookshelf_client import AudioBookshelfClient
+from catalog import get_catalog
+from metrics import observe_cache
+from storage import SQLiteStore, data_path
+from tracks import get_track_cache
+
+logger = logging.getLogger(__name__)
+
+
+def unplayed_order(episodes: List[Dict], progress: Dict[str, Dict]) -> List[List]:
+    """
+    Order a podcast's unfinished episodes by what to play next
+
+    Episodes already started come first, most recently played first. Then
+    the unplayed episodes published after the newest one the user has
+    played, oldest first, so a series is followed in order. Older unplayed
+    episodes come last, newest first.
+
+    Args:
+        episodes: Episodes of the podcast, oldest first
+        progress: The account's progress in the podcast, keyed by episode ID
+
+    Returns:
+        [episode ID, offset in milliseconds] pairs, next episode first
+    """
+    started, unplayed = [], []
+    newest_played = -1
+    for position, episode in enumerate(episodes):
+        state = progress.get(episode['id'])
+        if state and (state['is_finished'] or state['current_time'] > 0):
+            newest_played = position
+        if state and state['is_finished']:
+            continue
+        if state and state['current_time'] > 0:
+            started.append((-(state['last_update'] or 0), episode['id'],
+                            int(state['current_time'] * 1000)))
+        else:
+            unplayed.append(position)
+
+    started.sort()
+    following = [position for position in unplayed if position > newest_played]
+    earlier = [position for position in reversed(unplayed) if position < newest_played]
+    return ([[episode_id, offset_ms] for _, episode_id, offset_ms in started]
+            + [[episodes[position]['id'], 0] for position in following + earlier])
+
+
+class EpisodeCache(SQLiteStore):
+    """Podcast episode lists and per-account unplayed queues, shared by workers"""
+
+    def __init__(self, path: str, ttl: float = 21600, progress_ttl: float = 300):
+        """
+        Initialize the episode cache
+
+        Args:
+            path: Path of the SQLite database file
+            ttl: Seconds before an episode list is re-read when the podcast's
+                updatedAt is unknown
+            progress_ttl: Seconds before an account's episode progress is
+                fetched again
+        """
+        self.ttl = ttl
+        self.progress_ttl = progress_ttl
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS podcast_episodes (
+                    base_url TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    item_updated_at INTEGER,
+                    episodes TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (base_url, item_id)
+                );
+                CREATE TABLE IF NOT EXISTS episode_progress (
+                    base_url TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    progress TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    changed_at REAL NOT NULL,
+                    PRIMARY KEY (base_url, token)
+                );
+                CREATE TABLE IF NOT EXISTS episode_queues (
+                    base_url TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    queue TEXT NOT NULL,
+                    episodes_version REAL NOT NULL,
+                    progress_version REAL NOT NULL,
+                    PRIMARY KEY (base_url, token, item_id)
+                );
+            ''')
+
+    # -------------------------------------------------------------------------
+    # Episode lists
+    # -------------------------------------------------------------------------
+
+    def episodes(self, client: AudioBookshelfClient, item_id: str,
+                 updated_at: Optional[int] = None) -> Tuple[List[Dict], float]:
+        """
+        Get a podcast's episodes, re-reading the podcast only if it changed
+
+        The podcast counts as changed when its updatedAt, from a search hit or
+        the catalog mirror, is newer than the one the list was read at. Only
+        when neither knows the podcast does the list expire by TTL.
+
+        Args:
+            client: AudioBookshelf client for the server
+            item_id: The podcast's library item ID
+            updated_at: The podcast's updatedAt in milliseconds, if known
+
+        Returns:
+            Episodes oldest first, each with 'id', 'title' and 'duration', and
+            when the list was read
+
+        Raises:
+            Exception: If the podcast has to be read and cannot be
+        """
+        if updated_at is None:
+            updated_at = get_catalog().updated_at(client.base_url, item_id)
+
+        row = self.connection().execute(
+            'SELECT item_updated_at, episodes, fetched_at FROM podcast_episodes '
+            'WHERE base_url = ? AND item_id = ?',
+            (client.base_url, item_id)
+        ).fetchone()
+
+        if row is not None:
+            if updated_at is not None:
+                fresh = (row['item_updated_at'] or 0) >= updated_at
+            else:
+                fresh = row['fetched_at'] > time.time() - self.ttl
+            observe_cache('episodes', fresh)
+            if fresh:
+                return json.loads(row['episodes']), row['fetched_at']
+        else:
+            observe_cache('episodes', False)
+
+        try:
+            return self._fetch(client, item_id)
+        except Exception:
+            if row is None:
+                raise
+            logger.warning(f'Serving stale episodes of {item_id}')
+            return json.loads(row['episodes']), row['fetched_at']
+
+    def _fetch(self, client: AudioBookshelfClient, item_id: str) -> Tuple[List[Dict], float]:
+        item = client.get_library_item(item_id)
+        # The same read refreshes the track list the episodes are streamed from
+        get_track_cache().put(client.base_url, item)
+
+        episodes = [{'id': track.episode_id, 'title': track.title, 'duration': track.duration}
+                    for track in item.tracks if track.episode_id]
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO podcast_episodes (base_url, item_id, item_updated_at, episodes,
+                                              fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (base_url, item_id) DO UPDATE SET
+                    item_updated_at = excluded.item_updated_at,
+                    episodes = excluded.episodes,
+                    fetched_at = excluded.fetched_at
+            ''', (client.base_url, item_id, item.updated_at, json.dumps(episodes), now))
+
+        logger.info(f'Read {len(episodes)} episode(s) of {item_id}')
+        return episodes, now
+
+    # -------------------------------------------------------------------------
+    # Progress
+    # -------------------------------------------------------------------------
+
+    def progress(self, client: AudioBookshelfClient) -> Tuple[Dict[str, Dict], float]:
+        """
+        Get an account's progress in podcast episodes
+
+        Fetched from the server once per progress TTL. Positions recorded
+        locally since then win over older ones from the server, which may
+        not have received them yet.
+
+        Args:
+            client: AudioBookshelf client of the account
+
+        Returns:
+            Progress keyed by podcast item ID, then episode ID, and when it last changed
+        """
+        row = self._progress_row(client)
+        if row is not None and row['fetched_at'] > time.time() - self.progress_ttl:
+            observe_cache('episode_progress', True)
+            return json.loads(row['progress']), row['changed_at']
+        observe_cache('episode_progress', False)
+
+        local = json.loads(row['progress']) if row else {}
+        try:
+            fetched = client.get_media_progress()
+        except Exception as e:
+            logger.warning(f'Failed to refresh episode progress: {e}')
+            return local, row['changed_at'] if row else 0
+
+        progress = {}
+        for item_id, entry in fetched:
+            if entry.episode_id:
+                progress.setdefault(item_id, {})[entry.episode_id] = {
+                    'current_time': entry.current_time,
+                    'is_finished': entry.is_finished,
+                    'last_update': entry.last_update or 0
+                }
+        for item_id, states in local.items():
+            for episode_id, state in states.items():
+                known = progress.get(item_id, {}).get(episode_id)
+                if known is None or known['last_update'] < state['last_update']:
+                    progress.setdefault(item_id, {})[episode_id] = state
+
+        now = time.time()
+        self._store_progress(client, progress, now, now)
+        return progress, now
+
+    def record_progress(self, client: AudioBookshelfClient, item_id: str, episode_id: str,
+                        current_time: float, is_finished: bool = False) -> None:
+        """
+        Record a position the skill reported for an episode
+
+        Keeps the unplayed queue current between fetches from the server.
+
+        Args:
+            client: AudioBookshelf client of the account
+            item_id: The podcast's library item ID
+            episode_id: The episode ID
+            current_time: Position in seconds
+            is_finished: Whether the episode was played to the end
+        """
+        row = self._progress_row(client)
+        if row is None:
+            # Nothing cached to correct; the next read fetches the server's copy
+            return
+
+        progress = json.loads(row['progress'])
+        progress.setdefault(item_id, {})[episode_id] = {
+            'current_time': current_time,
+            'is_finished': is_finished,
+            'last_update': int(time.time() * 1000)
+        }
+        self._store_progress(client, progress, row['fetched_at'], time.time())
+
+    def _progress_row(self, client: AudioBookshelfClient):
+        return self.connection().execute(
+            'SELECT progress, fetched_at, changed_at FROM episode_progress '
+            'WHERE base_url = ? AND token = ?',
+            (client.base_url, client.token)
+        ).fetchone()
+
+    def _store_progress(self, client: AudioBookshelfClient, progress: Dict,
+                        fetched_at: float, changed_at: float) -> None:
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO episode_progress (base_url, token, progress, fetched_at, changed_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (base_url, token) DO UPDATE SET
+                    progress = excluded.progress,
+                    fetched_at = excluded.fetched_at,
+                    changed_at = excluded.changed_at
+            ''', (client.base_url, client.token, json.dumps(progress), fetched_at, changed_at))
+
+    # -------------------------------------------------------------------------
+    # Episode selection
+    # -------------------------------------------------------------------------
+
+    def latest(self, client: AudioBookshelfClient, item_id: str,
+               updated_at: Optional[int] = None) -> Optional[Dict]:
+        """
+        Get a podcast's newest episode
+
+        Args:
+            client: AudioBookshelf client for the server
+            item_id: The podcast's library item ID
+            updated_at: The podcast's updatedAt in milliseconds, if known
+
+        Returns:
+            Episode dict, or None if the podcast has no episodes
+        """
+        episodes, _ = self.episodes(client, item_id, updated_at)
+        return episodes[-1] if episodes else None
+
+    def next_unplayed(self, client: AudioBookshelfClient, item_id: str,
+                      updated_at: Optional[int] = None) -> Optional[Tuple[Dict, int]]:
+        """
+        Get the episode of a podcast to play next, and where to start it
+
+        Reads the account's precomputed queue, which is only rebuilt after
+        the episode list or the account's progress changed.
+
+        Args:
+            client: AudioBookshelf client of the account
+            item_id: The podcast's library item ID
+            updated_at: The podcast's updatedAt in milliseconds, if known
+
+        Returns:
+            Episode dict and offset in milliseconds, or None if every episode is played
+        """
+        episodes, episodes_version = self.episodes(client, item_id, updated_at)
+        progress, progress_version = self.progress(client)
+
+        row = self.connection().execute(
+            'SELECT queue FROM episode_queues WHERE base_url = ? AND token = ? AND item_id = ? '
+            'AND episodes_version = ? AND progress_version = ?',
+            (client.base_url, client.token, item_id, episodes_version, progress_version)
+        ).fetchone()
+
+        observe_cache('episode_queue', row is not None)
+        if row is not None:
+            queue = json.loads(row['queue'])
+        else:
+            queue = unplayed_order(episodes, progress.get(item_id) or {})
+            conn = self.connection()
+            with conn:
+                conn.execute('''
+                    INSERT INTO episode_queues (base_url, token, item_id, queue,
+                                                episodes_version, progress_version)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (base_url, token, item_id) DO UPDATE SET
+                        queue = excluded.queue,
+                        episodes_version = excluded.episodes_version,
+                        progress_version = excluded.progress_version
+                ''', (client.base_url, client.token, item_id, json.dumps(queue),
+                      episodes_version, progress_version))
+
+        if not queue:
+            return None
+        episode_id, offset_ms = queue[0]
+        episode = next(episode for episode in episodes if episode['id'] == episode_id)
+        return episode, offset_ms
+
+    def recent_podcast(self, client: AudioBookshelfClient) -> Optional[str]:
+        """
+        Get the podcast the account listened to most recently
+
+        Args:
+            client: AudioBookshelf client of the account
+
+        Returns:
+            The podcast's library item ID, or None if no episode was ever played
+        """
+        progress, _ = self.progress(client)
+        latest = max(((state['last_update'] or 0, item_id)
+                      for item_id, states in progress.items() for state in states.values()),
+                     default=None)
+        return latest[1] if latest else None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_episode_cache() -> EpisodeCache:
+    """
+    Get the process-wide episode cache, configured from the environment
+
+    Returns:
+        EpisodeCache instance
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EpisodeCache(
+                    os.getenv('EPISODE_CACHE_DB_PATH') or data_path('episodes.db'),
+                    ttl=float(os.getenv('EPISODE_CACHE_TTL', 21600)),
+                    progress_ttl=float(os.getenv('EPISODE_PROGRESS_TTL', 300))
+                )
+
+    return _cache
@@ -0,0 +1,28 @@
+"""
+Gunicorn settings, read automatically when gunicorn starts in this directory
+Preloads and warms the skill in the master so restarted workers serve their first request warm
+"""
+
+import os
+
+# Build the skill once in the master; workers are forked with it already loaded.
+# Set GUNICORN_PRELOAD=False to import the app in every worker instead
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+
+def when_ready(server):
+    """
+    Warm the preloaded skill before the first worker is forked
+    """
+    if server.cfg.preload_app:
+        from startup import warm_up
+        warm_up()
+
+
+def post_fork(server, worker):
+    """
+    Reconnect a freshly forked worker to AudioBookshelf
+    """
+    if server.cfg.preload_app:
+        from startup import after_fork
+        after_fork()
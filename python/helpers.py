@@ -3,28 +3,104 @@ Helper functions for the Alexa skill
 """
 
 import os
-from typing import Optional, Dict
+import re
+from typing import Optional, Dict, Tuple
 from audiobookshelf_client import AudioBookshelfClient
-from constants import SESSION_KEYS
+from client_registry import get_client
+from constants import SESSION_KEYS, ALEXA_ART_SIZES
+from covers import seal_account
+from models import Item
 
+# ISO 8601 durations as filled into AMAZON.DURATION slots, e.g. PT30S or PT1H20M
+ISO_DURATION = re.compile(
+    r'^P(?:(?P<days>\d+(?:\.\d+)?)D)?'
+    r'(?:T(?:(?P<hours>\d+(?:\.\d+)?)H)?(?:(?P<minutes>\d+(?:\.\d+)?)M)?'
+    r'(?:(?P<seconds>\d+(?:\.\d+)?)S)?)?$'
+)
 
-def get_audiobookshelf_client(session_attributes: Dict) -> Optional[AudioBookshelfClient]:
+
+def get_server_config(session_attributes: Dict) -> Tuple[Optional[str], Optional[str]]:
     """
-    Get AudioBookshelf client from session attributes or environment
+    Get AudioBookshelf base URL and token from session attributes or environment
 
     Args:
         session_attributes: Session attributes dictionary
 
     Returns:
-        AudioBookshelfClient instance or None if not configured
+        Tuple of (base_url, token); either may be None if not configured
     """
     base_url = session_attributes.get(SESSION_KEYS['BASE_URL']) or os.getenv('AUDIOBOOKSHELF_URL')
     token = session_attributes.get(SESSION_KEYS['TOKEN']) or os.getenv('AUDIOBOOKSHELF_TOKEN')
+    return base_url, token
+
+
+def get_audiobookshelf_client(session_attributes: Dict) -> Optional[AudioBookshelfClient]:
+    """
+    Get AudioBookshelf client from session attributes or environment
+
+    Args:
+        session_attributes: Session attributes dictionary
+
+    Returns:
+        Pooled AudioBookshelfClient instance or None if not configured
+    """
+    base_url, token = get_server_config(session_attributes)
 
     if not base_url or not token:
         return None
 
-    return AudioBookshelfClient(base_url, token)
+    return get_client(base_url, token)
+
+
+def get_session_attributes(handler_input) -> Dict:
+    """
+    Get session attributes, tolerating requests that arrive without a session
+
+    AudioPlayer events are sent outside of a dialog session, where the SDK
+    refuses to hand out session attributes.
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+
+    Returns:
+        Session attributes dictionary (empty for out-of-session requests)
+    """
+    if handler_input.request_envelope.session is None:
+        return {}
+    return handler_input.attributes_manager.session_attributes
+
+
+def get_user_id(handler_input) -> Optional[str]:
+    """
+    Get the Alexa userId of a request, with or without a session
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+
+    Returns:
+        Alexa userId or None
+    """
+    envelope = handler_input.request_envelope
+    if envelope.context and envelope.context.system and envelope.context.system.user:
+        return envelope.context.system.user.user_id
+    if envelope.session and envelope.session.user:
+        return envelope.session.user.user_id
+    return None
+
+
+def get_slot_value(handler_input, name: str) -> Optional[str]:
+    """
+    Get the value of an intent slot
+
+    Args:
+        handler_input: The ask-sdk HandlerInput of an IntentRequest
+        name: Slot name
+
+    Returns:
+        Slot value, or None if the slot is missing or unfilled
+    """
+    slots = handler_input.request_envelope.request.intent.slots or {}
+    return slots[name].value if slots.get(name) else None
 
 
 def format_duration(seconds: float) -> str:
@@ -48,6 +124,25 @@ def format_duration(seconds: float) -> str:
         return f"{minutes} minute{'s' if minutes > 1 else ''}"
 
 
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse an AMAZON.DURATION slot value
+
+    Args:
+        value: ISO 8601 duration, e.g. "PT30S" or "PT1H20M"
+
+    Returns:
+        Duration in seconds, or None if the value is missing or not a duration
+        Alexa sends for spoken times (weeks, months and years are rejected)
+    """
+    match = ISO_DURATION.match(value or '')
+    if not match or value in ('P', 'PT') or value.endswith('T'):
+        return None
+    parts = {name: float(amount or 0) for name, amount in match.groupdict().items()}
+    return (parts['days'] * 86400 + parts['hours'] * 3600 + parts['minutes'] * 60
+            + parts['seconds'])
+
+
 def get_progress_percent(current: float, total: float) -> int:
     """
     Get progress percentage
@@ -64,9 +159,9 @@ def get_progress_percent(current: float, total: float) -> int:
     return round((current / total) * 100)
 
 
-def get_item_title(item: Dict) -> str:
+def get_item_title(item: Item) -> str:
     """
-    Extract book/podcast title from library item
+    Get the book/podcast title of a library item
 
     Args:
         item: Library item from AudioBookshelf
@@ -74,14 +169,12 @@ def get_item_title(item: Dict) -> str:
     Returns:
         Title
     """
-    if item.get('media', {}).get('metadata', {}).get('title'):
-        return item['media']['metadata']['title']
-    return 'Unknown Title'
+    return item.title or 'Unknown Title'
 
 
-def get_item_author(item: Dict) -> str:
+def get_item_author(item: Item) -> str:
     """
-    Extract author from library item
+    Get the author of a library item
 
     Args:
         item: Library item from AudioBookshelf
@@ -89,23 +182,56 @@ def get_item_author(item: Dict) -> str:
     Returns:
         Author name
     """
-    if item.get('media', {}).get('metadata', {}).get('authorName'):
-        return item['media']['metadata']['authorName']
-    return 'Unknown Author'
+    return item.author or 'Unknown Author'
 
 
-def get_item_cover_url(item: Dict, base_url: str) -> Optional[str]:
+def get_cover_art(item_id: str, cover_path: Optional[str], base_url: str,
+                  version: Optional[str] = None, token: Optional[str] = None) -> Optional[Dict]:
     """
-    Get cover art URL from library item
+    Get the AudioItemMetadata art of a library item
+
+    Points at the skill's /cover proxy when SKILL_PUBLIC_URL is set and the
+    account is known; otherwise at AudioBookshelf directly. Proxied URLs
+    carry the account sealed, so /cover fetches from the account's own
+    server with its own token.
+
+    Args:
+        item_id: The library item ID
+        cover_path: Cover path from the item's media, if any
+        base_url: AudioBookshelf base URL
+        version: Changes whenever the cover may have changed, e.g. updatedAt
+        token: AudioBookshelf token of the account the item was found with
+
+    Returns:
+        Art dict with 'sources', or None if the item has no cover
+    """
+    if not cover_path:
+        return None
+
+    public_url = os.getenv('SKILL_PUBLIC_URL')
+    if not public_url or not base_url or not token:
+        return {"sources": [{"url": f"{base_url}{cover_path}"}]}
+
+    query = f"&v={version}" if version else ''
+    query += f"&a={seal_account(base_url, token)}"
+    return {"sources": [{
+        "url": f"{public_url.rstrip('/')}/cover/{item_id}?size={pixels}{query}",
+        "size": size,
+        "widthPixels": pixels,
+        "heightPixels": pixels
+    } for size, pixels in ALEXA_ART_SIZES.items()]}
+
+
+def get_item_cover_art(item: Item, base_url: str, token: Optional[str] = None) -> Optional[Dict]:
+    """
+    Get the AudioItemMetadata art of a library item, see get_cover_art
 
     Args:
         item: Library item from AudioBookshelf
         base_url: AudioBookshelf base URL
+        token: AudioBookshelf token of the account the item was found with
 
     Returns:
-        Cover art URL or None
+        Art dict with 'sources', or None if the item has no cover
     """
-    cover_path = item.get('media', {}).get('coverPath')
-    if cover_path:
-        return f"{base_url}{cover_path}"
-    return None
+    return get_cover_art(item.id, item.cover_path, base_url, item.updated_at, token)
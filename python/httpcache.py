@@ -0,0 +1,358 @@
+"""
+HTTP cache for AudioBookshelf GETs
+Keeps parsed responses with their validators so unchanged data costs a 304 instead of a full download
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+from metrics import observe_cache
+from storage import SQLiteStore
+
+# Seconds a response is used without asking the server when it sends no
+# freshness of its own. Libraries rarely change and item details only on a
+# rescan; progress changes with every listen, so it is always revalidated.
+LIBRARIES_FRESHNESS = 300
+ITEM_FRESHNESS = 60
+ITEMS_IN_PROGRESS_FRESHNESS = 0
+
+
+def _cache_control(headers: Mapping[str, str]) -> Dict[str, Optional[str]]:
+    directives = {}
+    for directive in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"') or None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def is_storable(status: int, headers: Mapping[str, str]) -> bool:
+    """
+    Check whether a response to a GET may be stored (RFC 9111, section 3)
+
+    Args:
+        status: HTTP status code
+        headers: Response headers
+
+    Returns:
+        True for 200 responses without no-store or Vary: *
+    """
+    if status != 200 or (headers.get('Vary') or '').strip() == '*':
+        return False
+    return 'no-store' not in _cache_control(headers)
+
+
+def freshness_lifetime(headers: Mapping[str, str], default: float) -> float:
+    """
+    Get how long a response stays fresh (RFC 9111, section 4.2.1)
+
+    Authorization is per account and this cache is private to the skill, so
+    s-maxage and private do not apply.
+
+    Args:
+        headers: Response headers
+        default: Heuristic lifetime used when the server states none
+
+    Returns:
+        Lifetime in seconds, less the age the response already had
+    """
+    directives = _cache_control(headers)
+    age = _number(headers.get('Age')) or 0
+
+    if 'no-cache' in directives:
+        return 0
+    max_age = _number(directives.get('max-age'))
+    if max_age is not None:
+        return max_age - age
+
+    expires = headers.get('Expires')
+    if expires is not None:
+        expires_at = _http_date(expires)
+        date = _http_date(headers.get('Date')) or time.time()
+        # An invalid Expires means already expired
+        return (expires_at - date - age) if expires_at is not None else 0
+
+    return default - age
+
+
+def _number(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class CacheEntry:
+    """A parsed response and what is needed to revalidate it"""
+
+    __slots__ = ('value', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, value: Any, etag: Optional[str], last_modified: Optional[str],
+                 expires_at: float):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """
+        Get the headers that make a GET conditional on this entry
+
+        Returns:
+            If-None-Match and/or If-Modified-Since headers; empty if the
+            response carried neither validator
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCacheStore(SQLiteStore):
+    """Response bodies and validators on disk, shared by workers and kept across restarts"""
+
+    def create_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    body BLOB NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            ''')
+
+    def get(self, key: str):
+        return self.connection().execute(
+            'SELECT etag, last_modified, expires_at, body FROM responses WHERE key = ?', (key,)
+        ).fetchone()
+
+    def put(self, key: str, entry: CacheEntry, body: bytes) -> None:
+        with self.connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, etag, last_modified, expires_at, body, stored_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (key, entry.etag, entry.last_modified, entry.expires_at, body, time.time())
+            )
+
+    def touch(self, key: str, entry: CacheEntry) -> None:
+        with self.connection() as conn:
+            conn.execute(
+                'UPDATE responses SET etag = ?, last_modified = ?, expires_at = ?, stored_at = ? '
+                'WHERE key = ?',
+                (entry.etag, entry.last_modified, entry.expires_at, time.time(), key)
+            )
+
+    def delete(self, key: str) -> None:
+        with self.connection() as conn:
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+
+
+class HttpCache:
+    """Parsed GET responses per account in an in-process LRU, backed by an optional disk store"""
+
+    def __init__(self, max_entries: int = 512, store: Optional[HttpCacheStore] = None):
+        """
+        Initialize the cache
+
+        Args:
+            max_entries: Maximum number of responses kept in memory
+            store: Disk store for the response bodies, if any
+        """
+        self.max_entries = max_entries
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key: Hashable, parse: Callable[[str], Any]) -> Optional[CacheEntry]:
+        """
+        Get the stored response for a request, fresh or not
+
+        Args:
+            key: Identifies the request, including server and account
+            parse: Turns a response body (text) into the value callers get
+
+        Returns:
+            CacheEntry, or None if nothing is stored
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if self.store is None:
+            return None
+        row = self.store.get(_store_key(key))
+        if row is None:
+            return None
+        try:
+            value = parse(bytes(row['body']).decode('utf-8'))
+        except Exception:
+            self.store.delete(_store_key(key))
+            return None
+
+        entry = CacheEntry(value, row['etag'], row['last_modified'], row['expires_at'])
+        self._remember(key, entry)
+        return entry
+
+    def store_response(self, key: Hashable, headers: Mapping[str, str], body: bytes,
+                       value: Any, default_freshness: float) -> None:
+        """
+        Store a full response, if it may be stored
+
+        Args:
+            key: Identifies the request, including server and account
+            headers: Response headers
+            body: Response body, already decoded from its content encoding
+            value: Parsed body
+            default_freshness: Seconds the response stays fresh when the
+                server states no lifetime
+        """
+        if not is_storable(200, headers):
+            self.forget(key)
+            return
+
+        entry = CacheEntry(value, headers.get('ETag'), headers.get('Last-Modified'),
+                           time.time() + freshness_lifetime(headers, default_freshness))
+        self._remember(key, entry)
+        if self.store is not None:
+            self.store.put(_store_key(key), entry, body)
+
+    def revalidated(self, key: Hashable, entry: CacheEntry, headers: Mapping[str, str],
+                    default_freshness: float) -> CacheEntry:
+        """
+        Freshen a stored response after a 304 (RFC 9111, section 4.3.4)
+
+        Args:
+            key: Identifies the request, including server and account
+            entry: The stored response the 304 confirmed
+            headers: Headers of the 304, which replace the stored ones
+            default_freshness: Seconds the response stays fresh when the
+                server states no lifetime
+
+        Returns:
+            The freshened entry
+        """
+        entry = CacheEntry(entry.value, headers.get('ETag') or entry.etag,
+                           headers.get('Last-Modified') or entry.last_modified,
+                           time.time() + freshness_lifetime(headers, default_freshness))
+        self._remember(key, entry)
+        if self.store is not None:
+            self.store.touch(_store_key(key), entry)
+        return entry
+
+    def forget(self, key: Hashable) -> None:
+        """
+        Drop the stored response for a request
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.store is not None:
+            self.store.delete(_store_key(key))
+
+    def _remember(self, key: Hashable, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _store_key(key: Hashable) -> str:
+    # Keys include the account's token and path; a digest keeps them short
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+def lookup(cache: HttpCache, key: Hashable,
+           parse: Callable[[str], Any]) -> Tuple[Optional[CacheEntry], bool]:
+    """
+    Look up a request before sending it
+
+    Args:
+        cache: The HTTP cache
+        key: Identifies the request, including server and account
+        parse: Turns a response body (text) into the value callers get
+
+    Returns:
+        The stored entry (None on a miss), and whether it can be used
+        without asking the server
+    """
+    entry = cache.lookup(key, parse)
+    fresh = entry is not None and entry.is_fresh()
+    observe_cache('http', fresh)
+    return entry, fresh
+
+
+def resolve(cache: HttpCache, key: Hashable, entry: Optional[CacheEntry], status: int,
+            headers: Mapping[str, str], body: bytes, parse: Callable[[str], Any],
+            default_freshness: float) -> Any:
+    """
+    Get the value of a successful response, storing or freshening the cache
+
+    Args:
+        cache: The HTTP cache
+        key: Identifies the request, including server and account
+        entry: The entry the request was made conditional on, if any
+        status: HTTP status code, 200 or 304
+        headers: Response headers
+        body: Response body, already decoded from its content encoding
+        parse: Turns a response body (text) into the value callers get
+        default_freshness: Seconds the response stays fresh when the server
+            states no lifetime
+
+    Returns:
+        The parsed body, or the stored value on a 304
+    """
+    if entry is not None:
+        observe_cache('http_revalidated', status == 304)
+        if status == 304:
+            return cache.revalidated(key, entry, headers, default_freshness).value
+
+    value = parse(body.decode('utf-8'))
+    cache.store_response(key, headers, body, value, default_freshness)
+    return value
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_http_cache() -> Optional[HttpCache]:
+    """
+    Get the process-wide HTTP cache, configured from the environment
+
+    Returns:
+        HttpCache instance, or None if HTTP_CACHE_SIZE is 0
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                size = int(os.getenv('HTTP_CACHE_SIZE', 512))
+                if size <= 0:
+                    return None
+                path = os.getenv('HTTP_CACHE_DB_PATH')
+                _cache = HttpCache(size, HttpCacheStore(path) if path else None)
+
+    return _cache
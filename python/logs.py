@@ -0,0 +1,225 @@
+"""
+Structured request logging that never blocks a request on I/O
+Records pass through a queue to one writer thread, tagged with the Alexa requestId and sampled per request type
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import zlib
+import atexit
+import logging
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+# One summary line per Alexa request
+request_logger = logging.getLogger('request')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
+
+# Attributes every LogRecord has; anything else was passed in extra=
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id'
+}
+
+_request_id: ContextVar[Optional[str]] = ContextVar('log_request_id', default=None)
+_sampled: ContextVar[bool] = ContextVar('log_sampled', default=True)
+_upstream_calls: ContextVar[Optional[List[Dict]]] = ContextVar('log_upstream_calls', default=None)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """
+    Parse LOG_SAMPLE_RATES
+
+    Args:
+        spec: Comma-separated request types and rates, e.g.
+            'AudioPlayer.PlaybackStarted=0.1,AudioPlayer.PlaybackStopped=0.5'
+
+    Returns:
+        Fraction of requests to log, keyed by request type
+    """
+    rates = {}
+    for entry in spec.split(','):
+        request_type, _, rate = entry.strip().partition('=')
+        if request_type and rate:
+            rates[request_type] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the current requestId and drops those of unsampled requests"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get() or '-'
+        # Warnings and errors are kept whatever the sample
+        return record.levelno >= logging.WARNING or _sampled.get()
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of waiting when the writer falls behind"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render message and traceback here, but leave layout to the writer's formatter
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            from metrics import LOG_RECORDS_DROPPED
+            LOG_RECORDS_DROPPED.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any extra= fields as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestLog:
+    """Correlation id, sampling decision and upstream timings of one Alexa request"""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        self.sample_rates = sample_rates
+        self.request_type = 'Invalid'
+        self.upstream_calls = []
+        self._start = time.perf_counter()
+        self._tokens = []
+
+    def __enter__(self) -> 'RequestLog':
+        self._tokens.append((_upstream_calls, _upstream_calls.set(self.upstream_calls)))
+        return self
+
+    def bind(self, request_id: Optional[str], request_type: str) -> None:
+        """
+        Tag the rest of the request's records once its envelope is decoded
+
+        Args:
+            request_id: Alexa requestId, used as the correlation id
+            request_type: Request type, e.g. 'AudioPlayer.PlaybackStarted'
+        """
+        self.request_type = request_type
+        self._tokens.append((_request_id, _request_id.set(request_id)))
+
+        rate = self.sample_rates.get(request_type, 1.0)
+        if rate < 1.0:
+            # Decided by requestId, so every worker and retry agrees
+            sampled = zlib.crc32((request_id or '').encode('utf-8')) % 10000 < rate * 10000
+            self._tokens.append((_sampled, _sampled.set(sampled)))
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        upstream_ms = sum(call['duration_ms'] for call in self.upstream_calls)
+        request_logger.info(
+            f'{self.request_type} handled in {duration_ms:.1f} ms, '
+            f'{len(self.upstream_calls)} upstream call(s) taking {upstream_ms:.1f} ms',
+            extra={'request_type': self.request_type, 'duration_ms': round(duration_ms, 1),
+                   'upstream': self.upstream_calls}
+        )
+        for var, token in reversed(self._tokens):
+            var.reset(token)
+
+
+def record_upstream(method: str, seconds: float, failed: bool) -> None:
+    """
+    Add an AudioBookshelf call to the current request's log entry
+
+    Args:
+        method: Client method name
+        seconds: Time the call took
+        failed: Whether the call raised
+    """
+    calls = _upstream_calls.get()
+    if calls is not None:
+        call = {'method': method, 'duration_ms': round(seconds * 1000, 1)}
+        if failed:
+            call['error'] = True
+        calls.append(call)
+
+
+_listener = None
+_sample_rates = {}
+
+
+def configure_logging() -> None:
+    """
+    Route all logging through a bounded queue to a single writer thread
+
+    Configured from LOG_LEVEL, LOG_FORMAT (text or json), LOG_FILE (default:
+    stderr), LOG_QUEUE_SIZE and LOG_SAMPLE_RATES. Safe to call more than once.
+    """
+    global _listener, _sample_rates
+
+    if _listener is not None:
+        return
+
+    if os.getenv('LOG_FILE'):
+        target = logging.FileHandler(os.getenv('LOG_FILE'))
+    else:
+        target = logging.StreamHandler(sys.stderr)
+    if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', 10000))))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    _sample_rates = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+
+    _listener = QueueListener(handler.queue, target, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: _after_fork(handler, target))
+
+
+def request_log() -> RequestLog:
+    """
+    Start the log context of an Alexa request
+
+    Returns:
+        RequestLog to use as a context manager around the request
+    """
+    return RequestLog(_sample_rates)
+
+
+def _stop() -> None:
+    # Write out whatever is still queued before the process exits
+    if _listener is not None:
+        _listener.stop()
+
+
+def _after_fork(handler: NonBlockingQueueHandler, target: logging.Handler) -> None:
+    global _listener
+
+    # The writer thread stays behind in the parent, and records queued there
+    # must not be written twice
+    handler.queue = queue.Queue(handler.queue.maxsize)
+    _listener = QueueListener(handler.queue, target, respect_handler_level=True)
+    _listener.start()
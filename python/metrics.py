@@ -0,0 +1,426 @@
+"""
+Prometheus-style metrics shared by all gunicorn workers
+Workers count in memory and periodically add their deltas to a shared SQLite file
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Sequence, Tuple
+
+from logs import record_upstream
+from storage import SQLiteStore, data_path
+
+logger = logging.getLogger(__name__)
+
+# Prometheus client defaults, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsStore(SQLiteStore):
+    """SQLite table of series values summed over every worker"""
+
+    def create_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS metrics (
+                    family TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    le TEXT NOT NULL DEFAULT '',
+                    value REAL NOT NULL,
+                    PRIMARY KEY (name, labels, le)
+                )
+            ''')
+
+    def add(self, deltas: Dict[Tuple[str, str, str, str], float]) -> None:
+        """
+        Add per-series increments in one transaction
+
+        Args:
+            deltas: Increment keyed by (family, name, labels, le)
+        """
+        conn = self.connection()
+        with conn:
+            conn.executemany('''
+                INSERT INTO metrics (family, name, labels, le, value) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (name, labels, le) DO UPDATE SET value = value + excluded.value
+            ''', [key + (value,) for key, value in deltas.items()])
+
+    def series(self) -> List:
+        """
+        Get every stored series
+        """
+        return self.connection().execute(
+            'SELECT family, name, labels, le, value FROM metrics'
+        ).fetchall()
+
+
+class MetricsRegistry:
+    """Metric families plus this process's unflushed increments"""
+
+    def __init__(self):
+        self.families = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._flusher = None
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+
+    def register(self, family: str, metric_type: str, documentation: str) -> None:
+        self.families[family] = (metric_type, documentation)
+
+    def add(self, family: str, increments: List[Tuple[str, str, str, float]]) -> None:
+        """
+        Record increments for a family's series in memory
+
+        Args:
+            family: Metric family name
+            increments: (series name, labels, le, amount) tuples
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Counts inherited over a fork belong to the parent
+                self._pending = {}
+                self._pid = os.getpid()
+            for name, labels, le, amount in increments:
+                key = (family, name, labels, le)
+                self._pending[key] = self._pending.get(key, 0) + amount
+
+        self._start_flusher()
+
+    def flush(self) -> None:
+        """
+        Add this process's pending increments to the shared store
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return
+
+        try:
+            self.store().add(pending)
+        except Exception as e:
+            logger.warning(f'Metrics flush failed, will retry: {e}')
+            with self._lock:
+                for key, value in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + value
+
+    def store(self) -> MetricsStore:
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = MetricsStore(
+                        os.getenv('METRICS_DB_PATH') or data_path('metrics.db')
+                    )
+        return self._store
+
+    def render(self) -> str:
+        """
+        Render every worker's totals in the Prometheus text format
+
+        This worker's own increments are flushed first; other workers'
+        lag behind by at most METRICS_FLUSH_INTERVAL seconds.
+
+        Returns:
+            Exposition text
+        """
+        self.flush()
+
+        by_family = {}
+        for row in self.store().series():
+            by_family.setdefault(row['family'], []).append(row)
+
+        lines = []
+        for family, (metric_type, documentation) in self.families.items():
+            lines.append(f'# HELP {family} {documentation}')
+            lines.append(f'# TYPE {family} {metric_type}')
+            rows = sorted(by_family.get(family, []), key=_series_order)
+            for row in rows:
+                labels = row['labels']
+                if row['le']:
+                    labels = f'{labels},le="{row["le"]}"' if labels else f'le="{row["le"]}"'
+                lines.append(f'{row["name"]}{{{labels}}} {_format_value(row["value"])}'
+                             if labels else f'{row["name"]} {_format_value(row["value"])}')
+        return '\n'.join(lines) + '\n'
+
+    def _start_flusher(self) -> None:
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+
+        with self._flusher_lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+            self._flusher_pid = pid
+            self._flusher.start()
+
+    def _run(self) -> None:
+        interval = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+
+def _format_labels(labelnames: Tuple[str, ...], labels: Dict[str, str]) -> str:
+    return ','.join(f'{name}="{_escape(labels.get(name, ""))}"' for name in labelnames)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _series_order(row) -> Tuple:
+    le = row['le']
+    bound = float('inf') if le == '+Inf' else float(le) if le else 0.0
+    return row['labels'], row['name'], bound
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush)
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        registry.register(name, 'counter', documentation)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        registry.add(self.name, [(self.name, _format_labels(self.labelnames, labels), '', amount)])
+
+
+class Histogram:
+    """Latency histogram with labels and cumulative buckets"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.labelnames = tuple(labelnames)
+        self.buckets = [(bound, _format_value(bound)) for bound in sorted(buckets)]
+        registry.register(name, 'histogram', documentation)
+
+    def observe(self, value: float, **labels) -> None:
+        label_text = _format_labels(self.labelnames, labels)
+        bucket = f'{self.name}_bucket'
+        increments = [(bucket, label_text, le, 1) for bound, le in self.buckets if value <= bound]
+        increments += [
+            (bucket, label_text, '+Inf', 1),
+            (f'{self.name}_sum', label_text, '', value),
+            (f'{self.name}_count', label_text, '', 1)
+        ]
+        registry.add(self.name, increments)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a with block
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+# =============================================================================
+# METRICS
+# =============================================================================
+
+REQUEST_LATENCY = Histogram(
+    'alexa_request_duration_seconds',
+    'Time to decode, handle and encode an Alexa request',
+    ['request_type']
+)
+
+REQUEST_VERIFICATION_FAILURES = Counter(
+    'alexa_request_verification_failures_total',
+    'Requests rejected as not sent by Alexa, by failed check (signature or timestamp)',
+    ['check']
+)
+
+HANDLER_LATENCY = Histogram(
+    'alexa_handler_duration_seconds',
+    'Time spent in a request handler',
+    ['handler']
+)
+
+HANDLER_ERRORS = Counter(
+    'alexa_handler_errors_total',
+    'Exceptions raised by a request handler',
+    ['handler']
+)
+
+UPSTREAM_LATENCY = Histogram(
+    'audiobookshelf_request_duration_seconds',
+    'Time spent in an AudioBookshelf client call',
+    ['method']
+)
+
+UPSTREAM_ERRORS = Counter(
+    'audiobookshelf_request_errors_total',
+    'AudioBookshelf client calls that raised',
+    ['method']
+)
+
+HEDGED_REQUESTS = Counter(
+    'audiobookshelf_hedged_requests_total',
+    'Hedged GETs by which attempt answered first (first, hedge or failed)',
+    ['result']
+)
+
+DEDUPLICATED_REQUESTS = Counter(
+    'audiobookshelf_deduplicated_requests_total',
+    'GETs answered by an identical request already in flight, by where it ran (thread, task or worker)',
+    ['scope']
+)
+
+CIRCUIT_BREAKER_EVENTS = Counter(
+    'audiobookshelf_circuit_breaker_events_total',
+    'Circuit breaker transitions (opened, closed) and calls refused while open (rejected)',
+    ['event']
+)
+
+RATE_LIMIT_WAIT = Histogram(
+    'audiobookshelf_rate_limit_wait_seconds',
+    'Time AudioBookshelf calls queued for their host\'s rate limit, by priority (interactive or background)',
+    ['priority']
+)
+
+RATE_LIMIT_REJECTED = Counter(
+    'audiobookshelf_rate_limit_rejected_total',
+    'AudioBookshelf calls given up because the rate limit left no slot in time, by priority',
+    ['priority']
+)
+
+TOKEN_REFRESHES = Counter(
+    'audiobookshelf_token_refreshes_total',
+    'Rejected tokens by outcome (refreshed, shared from another request, or failed)',
+    ['result']
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total',
+    'Log records discarded because the log writer fell behind'
+)
+
+CACHE_REQUESTS = Counter(
+    'cache_requests_total',
+    'Cache lookups by cache and result (hit or miss)',
+    ['cache', 'result']
+)
+
+
+def observe_cache(cache: str, hit: bool) -> None:
+    """
+    Count a cache lookup
+
+    Args:
+        cache: Cache name, e.g. 'catalog' or 'playback_state'
+        hit: Whether the lookup was served from the cache
+    """
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def observe_upstream(func):
+    """
+    Decorator timing an AudioBookshelf client method, counting its errors and
+    adding it to the current request's log entry
+    """
+    method = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = False
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            UPSTREAM_ERRORS.inc(method=method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            UPSTREAM_LATENCY.observe(elapsed, method=method)
+            record_upstream(method, elapsed, failed)
+
+    return wrapper
+
+
+def observe_upstream_async(func):
+    """
+    Decorator timing an async AudioBookshelf client method, see observe_upstream
+    """
+    method = func.__name__
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            failed = True
+            UPSTREAM_ERRORS.inc(method=method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            UPSTREAM_LATENCY.observe(elapsed, method=method)
+            record_upstream(method, elapsed, failed)
+
+    return wrapper
+
+
+def instrument_skill(skill) -> None:
+    """
+    Time every request handler registered on a skill
+
+    Args:
+        skill: Skill returned by SkillBuilder.create()
+    """
+    for mapper in skill.request_dispatcher.request_mappers:
+        for chain in mapper.request_handler_chains:
+            handler = chain.request_handler
+            handler.handle = _timed_handle(handler.handle, type(handler).__name__)
+
+
+def _timed_handle(handle, name: str):
+    @wraps(handle)
+    def wrapper(handler_input):
+        start = time.perf_counter()
+        try:
+            return handle(handler_input)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+
+    return wrapper
+
+
+def render_metrics() -> str:
+    """
+    Render metrics for the /metrics route
+
+    Returns:
+        Prometheus exposition text
+    """
+    return registry.render()
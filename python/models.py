@@ -0,0 +1,257 @@
+"""
+Compact records for the parts of AudioBookshelf payloads the skill uses
+Slotted classes keep items in progress, search hits and track lists small
+"""
+
+from typing import Dict, List, Optional
+
+
+class Progress:
+    """A user's progress in an item or episode"""
+
+    __slots__ = ('current_time', 'duration', 'progress', 'is_finished', 'episode_id',
+                 'last_update')
+
+    def __init__(self, current_time: float = 0, duration: float = 0, progress: float = 0,
+                 is_finished: bool = False, episode_id: Optional[str] = None,
+                 last_update: Optional[int] = None):
+        self.current_time = current_time
+        self.duration = duration
+        self.progress = progress
+        self.is_finished = is_finished
+        self.episode_id = episode_id
+        self.last_update = last_update
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'Progress':
+        """
+        Build from an AudioBookshelf mediaProgress object
+        """
+        return cls(
+            current_time=data.get('currentTime') or 0,
+            duration=data.get('duration') or 0,
+            progress=data.get('progress') or 0,
+            is_finished=bool(data.get('isFinished')),
+            episode_id=data.get('episodeId'),
+            last_update=data.get('lastUpdate')
+        )
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Progress':
+        return cls(**data)
+
+
+class Track:
+    """One audio file of a book, or one podcast episode"""
+
+    __slots__ = ('index', 'start', 'duration', 'content_url', 'mime_type', 'episode_id',
+                 'title')
+
+    def __init__(self, index: int, start: float, duration: float, content_url: str,
+                 mime_type: Optional[str] = None, episode_id: Optional[str] = None,
+                 title: Optional[str] = None):
+        self.index = index
+        self.start = start
+        self.duration = duration
+        self.content_url = content_url
+        self.mime_type = mime_type
+        self.episode_id = episode_id
+        self.title = title
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Track':
+        return cls(**data)
+
+
+class Chapter:
+    """A chapter of a book, by offset within the whole book"""
+
+    __slots__ = ('start', 'end', 'title')
+
+    def __init__(self, start: float, end: float = 0, title: Optional[str] = None):
+        self.start = start
+        self.end = end
+        self.title = title
+
+    @classmethod
+    def from_json(cls, data: Dict) -> 'Chapter':
+        """
+        Build from an AudioBookshelf chapter object
+        """
+        return cls(start=data.get('start') or 0, end=data.get('end') or 0,
+                   title=data.get('title'))
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Chapter':
+        return cls(**data)
+
+
+class Item:
+    """A library item with only the fields the skill reads"""
+
+    __slots__ = ('id', 'library_id', 'media_type', 'title', 'author', 'series', 'cover_path',
+                 'duration', 'updated_at', 'progress', 'tracks', 'chapters', 'match_key')
+
+    def __init__(self, id: str, library_id: Optional[str] = None, media_type: str = 'book',
+                 title: Optional[str] = None, author: Optional[str] = None,
+                 series: Optional[str] = None, cover_path: Optional[str] = None,
+                 duration: float = 0, updated_at: Optional[int] = None,
+                 progress: Optional[Progress] = None, tracks: Optional[List[Track]] = None,
+                 chapters: Optional[List[Chapter]] = None, match_key: Optional[str] = None):
+        self.id = id
+        self.library_id = library_id
+        self.media_type = media_type
+        self.title = title
+        self.author = author
+        self.series = series
+        self.cover_path = cover_path
+        self.duration = duration
+        self.updated_at = updated_at
+        # Only set for items in progress
+        self.progress = progress
+        # Only filled from expanded items (get_library_item)
+        self.tracks = tracks or []
+        # Only filled from expanded books, ordered by start
+        self.chapters = chapters or []
+        # Only set for search hits
+        self.match_key = match_key
+
+    @classmethod
+    def from_json(cls, data: Dict, match_key: Optional[str] = None) -> 'Item':
+        """
+        Build from an AudioBookshelf library item, minified or expanded
+
+        Args:
+            data: Library item object
+            match_key: Field a search matched on, for search hits
+
+        Returns:
+            Item record
+        """
+        media = data.get('media') or {}
+        metadata = media.get('metadata') or {}
+        progress = data.get('userMediaProgress')
+        chapters = media.get('chapters')
+
+        return cls(
+            id=data['id'],
+            library_id=data.get('libraryId'),
+            media_type=data.get('mediaType') or 'book',
+            title=metadata.get('title'),
+            author=metadata.get('authorName') or metadata.get('author'),
+            series=metadata.get('seriesName'),
+            cover_path=media.get('coverPath'),
+            duration=media.get('duration') or 0,
+            updated_at=data.get('updatedAt'),
+            progress=Progress.from_json(progress) if progress else None,
+            tracks=tracks_from_media(data['id'], data.get('mediaType'), media),
+            chapters=sorted((Chapter.from_json(chapter) for chapter in chapters),
+                            key=lambda chapter: chapter.start) if chapters else None,
+            match_key=match_key
+        )
+
+    def to_dict(self) -> Dict:
+        """
+        Convert to plain JSON types, e.g. for a SQLite cache
+        """
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['progress'] = self.progress.to_dict() if self.progress else None
+        data['tracks'] = [track.to_dict() for track in self.tracks]
+        data['chapters'] = [chapter.to_dict() for chapter in self.chapters]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Item':
+        """
+        Rebuild from to_dict output
+        """
+        data = dict(data)
+        if data.get('progress'):
+            data['progress'] = Progress.from_dict(data['progress'])
+        data['tracks'] = [Track.from_dict(track) for track in data.get('tracks') or []]
+        data['chapters'] = [Chapter.from_dict(chapter) for chapter in data.get('chapters') or []]
+        return cls(**data)
+
+
+def tracks_from_media(item_id: str, media_type: Optional[str], media: Dict) -> List[Track]:
+    """
+    Build the ordered track list of an item's media
+
+    Books get one track per audio file with its start offset in the book.
+    Podcasts get one track per episode, oldest first. Minified items carry
+    no files and get none.
+
+    Args:
+        item_id: The library item ID
+        media_type: 'book' or 'podcast'
+        media: The item's media object
+
+    Returns:
+        List of Track records
+    """
+    if media_type == 'podcast':
+        episodes = sorted(media.get('episodes') or [],
+                          key=lambda ep: (ep.get('publishedAt') or 0, ep.get('index') or 0))
+        tracks = []
+        for episode in episodes:
+            audio_file = episode.get('audioFile') or {}
+            audio_track = episode.get('audioTrack') or {}
+            content_url = (audio_track.get('contentUrl')
+                           or (f"/api/items/{item_id}/file/{audio_file['ino']}"
+                               if audio_file.get('ino') else None))
+            if not content_url:
+                continue
+            tracks.append(Track(
+                index=len(tracks),
+                start=0,
+                duration=audio_file.get('duration') or episode.get('duration') or 0,
+                content_url=content_url,
+                mime_type=audio_track.get('mimeType') or audio_file.get('mimeType'),
+                episode_id=episode.get('id'),
+                title=episode.get('title')
+            ))
+        return tracks
+
+    if media.get('tracks'):
+        return [Track(
+            index=position,
+            start=track.get('startOffset') or 0,
+            duration=track.get('duration') or 0,
+            content_url=track['contentUrl'],
+            mime_type=track.get('mimeType'),
+            title=track.get('title')
+        ) for position, track in enumerate(
+            sorted(media['tracks'], key=lambda track: track.get('index') or 0)
+        )]
+
+    # Minified items carry no files
+    if not media.get('audioFiles'):
+        return []
+
+    tracks = []
+    start = 0
+    audio_files = sorted(
+        (audio_file for audio_file in media.get('audioFiles') or []
+         if not audio_file.get('exclude') and audio_file.get('ino')),
+        key=lambda audio_file: audio_file.get('index') or 0
+    )
+    for audio_file in audio_files:
+        tracks.append(Track(
+            index=len(tracks),
+            start=start,
+            duration=audio_file.get('duration') or 0,
+            content_url=f"/api/items/{item_id}/file/{audio_file['ino']}",
+            mime_type=audio_file.get('mimeType'),
+            title=(audio_file.get('metadata') or {}).get('filename')
+        ))
+        start += audio_file.get('duration') or 0
+    return tracks
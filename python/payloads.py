@@ -0,0 +1,94 @@
+"""
+Parsers from AudioBookshelf responses to records
+Decodes a response with the C JSON decoder and keeps only compact records of the fields the skill reads
+"""
+
+import json
+from typing import Dict, List, Tuple
+
+from models import Item, Progress
+
+
+def parse_items_in_progress(text: str) -> List[Item]:
+    """
+    Parse a /api/me/items-in-progress response
+
+    Args:
+        text: Response body
+
+    Returns:
+        Items in progress, most recent first, with their progress
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    return [Item.from_json(data) for data in json.loads(text).get('libraryItems') or []]
+
+
+def parse_search(text: str) -> Dict[str, List[Item]]:
+    """
+    Parse a /api/libraries/<id>/search response
+
+    Args:
+        text: Response body
+
+    Returns:
+        Dict with 'book' and 'podcast' hits in server order, each with match_key set
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    result = json.loads(text)
+    return {kind: [Item.from_json(hit['libraryItem'], hit.get('matchKey'))
+                   for hit in result.get(kind) or []]
+            for kind in ('book', 'podcast')}
+
+
+def parse_item(text: str) -> Item:
+    """
+    Parse a /api/items/<id> response
+
+    Args:
+        text: Response body
+
+    Returns:
+        Item with its track list
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    return Item.from_json(json.loads(text))
+
+
+def parse_media_progress(text: str) -> List[Tuple[str, Progress]]:
+    """
+    Parse the progress entries of a /api/me response
+
+    Args:
+        text: Response body
+
+    Returns:
+        (library item ID, progress) for every book and episode the user has
+        progress in
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    return [(data.get('libraryItemId'), Progress.from_json(data))
+            for data in json.loads(text).get('mediaProgress') or []]
+
+
+def parse_libraries(text: str) -> List[Dict]:
+    """
+    Parse a /api/libraries response
+
+    Args:
+        text: Response body
+
+    Returns:
+        Library objects as sent by the server
+
+    Raises:
+        ValueError: If the body is not valid JSON
+    """
+    return json.loads(text).get('libraries', [])
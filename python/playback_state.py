@@ -0,0 +1,169 @@
+"""
+Per-user playback state shared by all gunicorn workers
+AudioPlayer events carry no session, so positions are kept here instead
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from metrics import observe_cache
+from storage import SQLiteStore, data_path
+
+
+class PlaybackStateStore(SQLiteStore):
+    """SQLite store of each Alexa user's current item, episode and offset"""
+
+    def __init__(self, path: str, cache_size: int = 1024):
+        """
+        Initialize the playback state store
+
+        Args:
+            path: Path of the SQLite database file
+            cache_size: Maximum number of users kept in the in-process cache
+        """
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS playback_state (
+                    user_id TEXT PRIMARY KEY,
+                    item_id TEXT NOT NULL,
+                    offset_ms INTEGER NOT NULL DEFAULT 0,
+                    library_id TEXT,
+                    episode_id TEXT,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            # Databases created before podcast episodes were tracked
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(playback_state)')}
+            if 'episode_id' not in columns:
+                conn.execute('ALTER TABLE playback_state ADD COLUMN episode_id TEXT')
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        """
+        Get a user's playback state, reading through the in-process cache
+
+        Args:
+            user_id: Alexa userId
+
+        Returns:
+            Dict with 'item_id', 'episode_id', 'offset_ms', 'library_id' and
+            'updated_at', or None if the user has never played anything
+        """
+        if not user_id:
+            return None
+
+        self._invalidate_if_changed()
+
+        with self._cache_lock:
+            if user_id in self._cache:
+                self._cache.move_to_end(user_id)
+                observe_cache('playback_state', True)
+                return self._cache[user_id]
+
+        observe_cache('playback_state', False)
+
+        row = self.connection().execute(
+            'SELECT item_id, episode_id, offset_ms, library_id, updated_at FROM playback_state '
+            'WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        state = dict(row) if row else None
+
+        if state:
+            self._remember(user_id, state)
+        return state
+
+    def save(self, user_id: str, item_id: str, offset_ms: int,
+             library_id: Optional[str] = None, episode_id: Optional[str] = None) -> None:
+        """
+        Record a user's current item and offset
+
+        Args:
+            user_id: Alexa userId
+            item_id: The library item ID being played
+            offset_ms: Playback offset in milliseconds, within the episode for podcasts
+            library_id: Library the item belongs to, if known
+            episode_id: Podcast episode being played, if any
+        """
+        if not user_id or not item_id:
+            return
+
+        state = {
+            'item_id': item_id,
+            'episode_id': episode_id,
+            'offset_ms': int(offset_ms or 0),
+            'library_id': library_id,
+            'updated_at': time.time()
+        }
+
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO playback_state
+                    (user_id, item_id, episode_id, offset_ms, library_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    item_id = excluded.item_id,
+                    episode_id = excluded.episode_id,
+                    offset_ms = excluded.offset_ms,
+                    library_id = COALESCE(excluded.library_id,
+                                          CASE WHEN item_id = excluded.item_id
+                                               THEN library_id END),
+                    updated_at = excluded.updated_at
+            ''', (user_id, item_id, episode_id, state['offset_ms'], library_id,
+                  state['updated_at']))
+
+        with self._cache_lock:
+            self._cache.pop(user_id, None)
+
+    def _remember(self, user_id: str, state: Dict) -> None:
+        with self._cache_lock:
+            self._cache[user_id] = state
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _invalidate_if_changed(self) -> None:
+        """
+        Drop the cache when another connection has committed since last checked
+
+        PRAGMA data_version only changes for commits made by other
+        connections, which covers writes from every other worker. A thread
+        that has not checked yet (e.g. right after a fork) also starts cold.
+        """
+        version = self.connection().execute('PRAGMA data_version').fetchone()[0]
+        if getattr(self._local, 'data_version', None) != version:
+            with self._cache_lock:
+                self._cache.clear()
+        self._local.data_version = version
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_playback_state_store() -> PlaybackStateStore:
+    """
+    Get the process-wide playback state store, configured from the environment
+
+    Returns:
+        PlaybackStateStore instance
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PlaybackStateStore(
+                    os.getenv('PLAYBACK_STATE_DB_PATH') or data_path('playback_state.db')
+                )
+
+    return _store
@@ -0,0 +1,372 @@
+"""
+Speculative prefetch of in-progress items shared by all gunicorn workers
+LaunchRequest and a scheduled warmer fill the cache that ContinueBookIntent reads
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import List, Optional, TYPE_CHECKING
+
+from audiobookshelf_client import AudioBookshelfClient
+from client_registry import get_client
+from metrics import observe_cache
+from models import Item
+from storage import SQLiteStore, data_path
+from tracks import get_track_cache
+
+# Only the async serving mode needs httpx, so WSGI workers never import it
+if TYPE_CHECKING:
+    from async_audiobookshelf_client import AsyncAudioBookshelfClient
+
+logger = logging.getLogger(__name__)
+
+# Listening habits are learned per quarter hour of the week (UTC)
+SLOT_SECONDS = 900
+WEEK_SECONDS = 7 * 24 * 3600
+
+# Visits within this window of the previous one count as the same visit
+VISIT_GAP_SECONDS = 12 * 3600
+
+# Slots not visited for this long are no longer warmed
+HABIT_MAX_AGE = 28 * 24 * 3600
+
+# How long a worker may hold a refresh lease before others take over
+REFRESH_LEASE_SECONDS = 30
+
+
+def slot_of(timestamp: float) -> int:
+    """
+    Get the quarter-hour-of-the-week slot of a Unix timestamp
+    """
+    return int(timestamp % WEEK_SECONDS // SLOT_SECONDS)
+
+
+class PrefetchCache(SQLiteStore):
+    """Short-lived per-account cache of items in progress and listening habits"""
+
+    def __init__(self, path: str, ttl: float = 300, lead: float = 300,
+                 min_visits: int = 3, warm_interval: float = 60):
+        """
+        Initialize the prefetch cache
+
+        Args:
+            path: Path of the SQLite database file
+            ttl: Seconds a prefetched entry may be served
+            lead: Seconds ahead of a usual listening time to start warming
+            min_visits: Visits to a time slot before it counts as a habit
+            warm_interval: Seconds between warmer passes
+        """
+        self.ttl = ttl
+        self.lead = lead
+        self.min_visits = min_visits
+        self.warm_interval = warm_interval
+        self._warmer = None
+        self._warmer_pid = None
+        self._warmer_lock = threading.Lock()
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS prefetch (
+                    base_url TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    items TEXT,
+                    fetched_at REAL NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (base_url, token)
+                );
+                CREATE TABLE IF NOT EXISTS listening_slots (
+                    user_id TEXT NOT NULL,
+                    slot INTEGER NOT NULL,
+                    base_url TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    visits INTEGER NOT NULL DEFAULT 1,
+                    last_seen REAL NOT NULL,
+                    PRIMARY KEY (user_id, slot)
+                );
+                CREATE INDEX IF NOT EXISTS listening_slots_slot
+                    ON listening_slots (slot);
+            ''')
+
+    def get(self, client: AudioBookshelfClient, allow_stale: bool = False) -> Optional[List[Item]]:
+        """
+        Get prefetched items in progress, if fresh
+
+        Args:
+            client: AudioBookshelf client of the account
+            allow_stale: Also return entries that are past the TTL or were
+                invalidated, however old
+
+        Returns:
+            Items in progress, most recent first, or None on a miss
+        """
+        row = self.connection().execute(
+            'SELECT items FROM prefetch WHERE base_url = ? AND token = ? '
+            'AND fetched_at > ? AND items IS NOT NULL',
+            (client.base_url, client.token, -1 if allow_stale else time.time() - self.ttl)
+        ).fetchone()
+
+        observe_cache('prefetch_stale' if allow_stale else 'prefetch', row is not None)
+        return [Item.from_dict(item) for item in json.loads(row['items'])] if row else None
+
+    def load(self, client: AudioBookshelfClient) -> List[Item]:
+        """
+        Get items in progress from the cache, the server, or failing that a stale entry
+
+        While the server is down or its circuit is open, the last items seen
+        are better than an error: AudioPlayer events keep the local playback
+        state current, and progress writes wait in the queue.
+
+        Args:
+            client: AudioBookshelf client of the account
+
+        Returns:
+            Items in progress, most recent first
+
+        Raises:
+            Exception: If the server fails and nothing was ever cached
+        """
+        items = self.get(client)
+        if items is not None:
+            return items
+
+        try:
+            items = client.get_items_in_progress()
+        except Exception as e:
+            return self._stale_or_raise(client, e)
+
+        self.put(client, items)
+        return items
+
+    async def load_async(self, client: 'AsyncAudioBookshelfClient') -> List[Item]:
+        """
+        Get items in progress with the async client, see load
+
+        Args:
+            client: Async AudioBookshelf client of the account
+
+        Returns:
+            Items in progress, most recent first
+
+        Raises:
+            Exception: If the server fails and nothing was ever cached
+        """
+        items = self.get(client)
+        if items is not None:
+            return items
+
+        try:
+            items = await client.get_items_in_progress()
+        except Exception as e:
+            return self._stale_or_raise(client, e)
+
+        self.put(client, items)
+        return items
+
+    def _stale_or_raise(self, client, error: Exception) -> List[Item]:
+        items = self.get(client, allow_stale=True)
+        if items is None:
+            raise error
+        logger.warning(f'Serving stale items in progress for {client.base_url}: {error}')
+        return items
+
+    def put(self, client: AudioBookshelfClient, items: List[Item]) -> None:
+        """
+        Store items in progress
+
+        Args:
+            client: AudioBookshelf client of the account
+            items: Items in progress, most recent first
+        """
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO prefetch (base_url, token, items, fetched_at, lease_until)
+                VALUES (?, ?, ?, ?, 0)
+                ON CONFLICT (base_url, token) DO UPDATE SET
+                    items = excluded.items,
+                    fetched_at = excluded.fetched_at,
+                    lease_until = 0
+            ''', (client.base_url, client.token, json.dumps([entry.to_dict() for entry in items]),
+                  time.time()))
+
+    def invalidate(self, client: AudioBookshelfClient) -> None:
+        """
+        Drop an account's entry after its progress changed
+
+        Args:
+            client: AudioBookshelf client of the account
+        """
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                'UPDATE prefetch SET fetched_at = 0 WHERE base_url = ? AND token = ?',
+                (client.base_url, client.token)
+            )
+
+    def refresh(self, client: AudioBookshelfClient) -> None:
+        """
+        Fetch items in progress into the cache, and the first item's track
+        list into the track cache
+
+        Args:
+            client: AudioBookshelf client of the account
+        """
+        items = client.get_items_in_progress()
+        self.put(client, items)
+
+        # Continue then also finds the item's files without asking the server
+        if items:
+            get_track_cache().put(client.base_url, client.get_library_item(items[0].id))
+
+    def prefetch_in_background(self, client: AudioBookshelfClient) -> None:
+        """
+        Refresh an account's entry on a background thread unless it is fresh
+        or another worker is already refreshing it
+
+        Args:
+            client: AudioBookshelf client of the account
+        """
+        if not self._claim(client, time.time() - self.ttl / 2):
+            return
+
+        threading.Thread(
+            target=self._refresh_quietly, args=(client,), name='prefetch', daemon=True
+        ).start()
+
+    def record_visit(self, user_id: str, client: AudioBookshelfClient,
+                     timestamp: Optional[float] = None) -> None:
+        """
+        Remember that a user started listening at this time of the week
+
+        Args:
+            user_id: Alexa userId
+            client: AudioBookshelf client the user listens with
+            timestamp: Time of the visit; defaults to now
+        """
+        if not user_id:
+            return
+
+        now = timestamp or time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO listening_slots (user_id, slot, base_url, token, last_seen)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, slot) DO UPDATE SET
+                    visits = visits + (excluded.last_seen - last_seen > ?),
+                    base_url = excluded.base_url,
+                    token = excluded.token,
+                    last_seen = excluded.last_seen
+            ''', (user_id, slot_of(now), client.base_url, client.token, now,
+                  VISIT_GAP_SECONDS))
+
+    def warm(self) -> int:
+        """
+        Refresh entries of accounts whose users usually listen soon
+
+        Returns:
+            Number of accounts refreshed
+        """
+        now = time.time()
+        slots = {slot_of(now + offset) for offset in range(0, int(self.lead) + 1, SLOT_SECONDS)}
+        slots.add(slot_of(now + self.lead))
+
+        rows = self.connection().execute(f'''
+            SELECT DISTINCT base_url, token FROM listening_slots
+            WHERE slot IN ({','.join('?' * len(slots))})
+            AND visits >= ? AND last_seen > ?
+        ''', (*slots, self.min_visits, now - HABIT_MAX_AGE)).fetchall()
+
+        warmed = 0
+        for row in rows:
+            client = get_client(row['base_url'], row['token'])
+            if not self._claim(client, now - self.ttl / 2):
+                continue
+            if self._refresh_quietly(client):
+                warmed += 1
+
+        if warmed:
+            logger.info(f'Warmed {warmed} in-progress cache(s)')
+        return warmed
+
+    def start_warmer(self) -> None:
+        """
+        Start this process's background warmer if it is not running
+        """
+        pid = os.getpid()
+        if self._warmer_pid == pid and self._warmer.is_alive():
+            return
+
+        with self._warmer_lock:
+            if self._warmer_pid == pid and self._warmer.is_alive():
+                return
+            self._warmer = threading.Thread(target=self._run, name='prefetch-warmer', daemon=True)
+            self._warmer_pid = pid
+            self._warmer.start()
+
+    def _claim(self, client: AudioBookshelfClient, stale_before: float) -> bool:
+        """
+        Take the refresh lease for an account whose entry is older than stale_before
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO prefetch (base_url, token) VALUES (?, ?)',
+                (client.base_url, client.token)
+            )
+            cursor = conn.execute(
+                'UPDATE prefetch SET lease_until = ? WHERE base_url = ? AND token = ? '
+                'AND fetched_at < ? AND lease_until < ?',
+                (now + REFRESH_LEASE_SECONDS, client.base_url, client.token, stale_before, now)
+            )
+        return cursor.rowcount == 1
+
+    def _refresh_quietly(self, client: AudioBookshelfClient) -> bool:
+        try:
+            self.refresh(client)
+            return True
+        except Exception as e:
+            logger.warning(f'Prefetch from {client.base_url} failed: {e}')
+            return False
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.warm_interval)
+            try:
+                self.warm()
+            except Exception as e:
+                logger.error(f'Prefetch warmer error: {e}')
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prefetch_cache() -> PrefetchCache:
+    """
+    Get the process-wide prefetch cache, configured from the environment
+
+    Returns:
+        PrefetchCache instance with its warmer running
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PrefetchCache(
+                    os.getenv('PREFETCH_DB_PATH') or data_path('prefetch.db'),
+                    ttl=float(os.getenv('PREFETCH_TTL', 300)),
+                    lead=float(os.getenv('PREFETCH_LEAD', 300)),
+                    min_visits=int(os.getenv('PREFETCH_MIN_VISITS', 3)),
+                    warm_interval=float(os.getenv('PREFETCH_WARM_INTERVAL', 60))
+                )
+
+    _cache.start_warmer()
+    return _cache
@@ -0,0 +1,324 @@
+"""
+Write-behind queue for playback progress
+Handlers enqueue positions; a background flusher sends them to AudioBookshelf
+"""
+
+import os
+import time
+import uuid
+import atexit
+import random
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from audiobookshelf_client import AudioBookshelfClient
+from breaker import get_breaker
+from client_registry import get_client
+from storage import SQLiteStore, data_path
+
+logger = logging.getLogger(__name__)
+
+# How long a flusher may hold claimed rows before another worker retries them
+FLUSH_LEASE_SECONDS = 60
+
+# Client errors that may succeed when sent again; other 4xx answers are final
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+
+# Client errors that apply to the account rather than to one item
+ACCOUNT_ERRORS = (401, 403)
+
+
+def _http_status(error: Exception) -> Optional[int]:
+    """
+    Get the HTTP status behind a failed client call, if the server answered
+    """
+    cause = error.__cause__ or error.__context__
+    response = getattr(cause, 'response', None)
+    return getattr(response, 'status_code', None)
+
+
+def _is_permanent(status: Optional[int]) -> bool:
+    return status is not None and 400 <= status < 500 and status not in RETRYABLE_CLIENT_ERRORS
+
+
+class ProgressQueue(SQLiteStore):
+    """Persistent, coalescing queue of progress updates shared by all workers"""
+
+    def __init__(self, path: str, flush_interval: float = 5, batch_size: int = 50,
+                 max_backoff: float = 300):
+        """
+        Initialize the progress queue
+
+        Args:
+            path: Path of the SQLite database file
+            flush_interval: Seconds between background flushes
+            batch_size: Maximum updates sent in one batch request
+            max_backoff: Upper bound in seconds for the retry delay
+        """
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._flusher = None
+        self._flusher_pid = None
+        self._flusher_lock = threading.Lock()
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS progress_queue (
+                    base_url TEXT NOT NULL,
+                    token TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    episode_id TEXT NOT NULL DEFAULT '',
+                    position REAL NOT NULL,
+                    duration REAL,
+                    is_finished INTEGER,
+                    updated_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    claim TEXT,
+                    PRIMARY KEY (base_url, token, item_id, episode_id)
+                );
+                CREATE INDEX IF NOT EXISTS progress_queue_due
+                    ON progress_queue (next_attempt);
+            ''')
+
+    def enqueue(self, client: AudioBookshelfClient, item_id: str, current_time: float,
+                duration: Optional[float] = None, is_finished: Optional[bool] = None,
+                episode_id: Optional[str] = None) -> None:
+        """
+        Queue a progress update, replacing any pending update for the same item
+
+        Args:
+            client: AudioBookshelf client the update belongs to
+            item_id: The library item ID
+            current_time: Current time in seconds
+            duration: Total duration in seconds, if known
+            is_finished: Mark the item finished or unfinished, if known
+            episode_id: Podcast episode ID, if any
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO progress_queue (base_url, token, item_id, episode_id,
+                                            position, duration, is_finished,
+                                            updated_at, next_attempt)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (base_url, token, item_id, episode_id) DO UPDATE SET
+                    position = excluded.position,
+                    duration = COALESCE(excluded.duration, duration),
+                    is_finished = COALESCE(excluded.is_finished, is_finished),
+                    updated_at = excluded.updated_at,
+                    attempts = 0,
+                    next_attempt = excluded.next_attempt
+            ''', (client.base_url, client.token, item_id, episode_id or '', current_time,
+                  duration, None if is_finished is None else int(is_finished), now, now))
+
+        self.start_flusher()
+
+    def pending(self) -> int:
+        """
+        Get the number of updates waiting to be sent
+        """
+        return self.connection().execute('SELECT COUNT(*) FROM progress_queue').fetchone()[0]
+
+    def start_flusher(self) -> None:
+        """
+        Start this process's background flusher if it is not running
+        """
+        pid = os.getpid()
+        if self._flusher_pid == pid and self._flusher.is_alive():
+            return
+
+        with self._flusher_lock:
+            if self._flusher_pid == pid and self._flusher.is_alive():
+                return
+            self._flusher = threading.Thread(target=self._run, name='progress-flusher', daemon=True)
+            self._flusher_pid = pid
+            self._flusher.start()
+
+    def flush(self) -> int:
+        """
+        Send every due update, batched per server and token
+
+        Returns:
+            Number of updates the server accepted
+        """
+        now = time.time()
+        claim = uuid.uuid4().hex
+        conn = self.connection()
+
+        with conn:
+            conn.execute('''
+                UPDATE progress_queue SET claim = ?, lease_until = ?
+                WHERE rowid IN (
+                    SELECT rowid FROM progress_queue
+                    WHERE next_attempt <= ? AND lease_until < ?
+                    ORDER BY updated_at LIMIT ?
+                )
+            ''', (claim, now + FLUSH_LEASE_SECONDS, now, now, self.batch_size))
+
+        rows = conn.execute(
+            'SELECT * FROM progress_queue WHERE claim = ?', (claim,)
+        ).fetchall()
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row['base_url'], row['token']), []).append(row)
+
+        sent = 0
+        for (base_url, token), group in groups.items():
+            if get_breaker(base_url).is_open():
+                # Keep the rows without counting an attempt; they go out once it closes
+                continue
+            try:
+                get_client(base_url, token).batch_update_progress(
+                    [self._to_payload(row) for row in group]
+                )
+            except Exception as e:
+                status = _http_status(e)
+                if not _is_permanent(status):
+                    logger.warning(f'Progress flush to {base_url} failed, will retry: {e}')
+                    self._reschedule(group)
+                elif status in ACCOUNT_ERRORS or len(group) == 1:
+                    logger.error(f'Dropping {len(group)} progress update(s) for {base_url}: '
+                                 f'server answered {status}')
+                    self._delete(group)
+                else:
+                    # One bad item fails the whole batch; send the others on their own
+                    sent += self._send_singly(base_url, token, group)
+                continue
+
+            self._delete(group)
+            sent += len(group)
+
+        with conn:
+            conn.execute(
+                'UPDATE progress_queue SET claim = NULL, lease_until = 0 WHERE claim = ?',
+                (claim,)
+            )
+
+        if sent:
+            logger.info(f'Flushed {sent} progress update(s)')
+        return sent
+
+    def _send_singly(self, base_url: str, token: str, rows: List) -> int:
+        """
+        Send updates one request each, dropping those the server refuses for good
+
+        Returns:
+            Number of updates the server accepted
+        """
+        sent = 0
+        client = get_client(base_url, token)
+        for row in rows:
+            try:
+                client.batch_update_progress([self._to_payload(row)])
+            except Exception as e:
+                status = _http_status(e)
+                if _is_permanent(status):
+                    logger.error(f"Dropping progress update for {row['item_id']} on {base_url}: "
+                                 f'server answered {status}')
+                    self._delete([row])
+                else:
+                    self._reschedule([row])
+                continue
+
+            self._delete([row])
+            sent += 1
+        return sent
+
+    def _delete(self, rows: List) -> None:
+        """
+        Remove sent or refused rows; rows written again meanwhile stay queued
+        """
+        with self.connection() as conn:
+            conn.executemany(
+                'DELETE FROM progress_queue WHERE base_url = ? AND token = ? '
+                'AND item_id = ? AND episode_id = ? AND updated_at = ?',
+                [(row['base_url'], row['token'], row['item_id'], row['episode_id'],
+                  row['updated_at']) for row in rows]
+            )
+
+    def _reschedule(self, rows: List) -> None:
+        """
+        Push failed rows back with exponential backoff and jitter
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            for row in rows:
+                delay = min(self.max_backoff, self.flush_interval * 2 ** row['attempts'])
+                conn.execute(
+                    'UPDATE progress_queue SET attempts = attempts + 1, next_attempt = ? '
+                    'WHERE base_url = ? AND token = ? AND item_id = ? AND episode_id = ? '
+                    'AND updated_at = ?',
+                    (now + delay * random.uniform(0.5, 1.0), row['base_url'], row['token'],
+                     row['item_id'], row['episode_id'], row['updated_at'])
+                )
+
+    @staticmethod
+    def _to_payload(row) -> Dict:
+        payload = {
+            'libraryItemId': row['item_id'],
+            'currentTime': row['position']
+        }
+        if row['episode_id']:
+            payload['episodeId'] = row['episode_id']
+        if row['duration']:
+            payload['duration'] = row['duration']
+            payload['progress'] = min(1.0, row['position'] / row['duration'])
+        if row['is_finished'] is not None:
+            payload['isFinished'] = bool(row['is_finished'])
+        return payload
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                while self.flush() >= self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f'Progress flusher error: {e}')
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_progress_queue() -> ProgressQueue:
+    """
+    Get the process-wide progress queue, configured from the environment
+
+    Returns:
+        ProgressQueue instance
+    """
+    global _queue
+
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = ProgressQueue(
+                    os.getenv('PROGRESS_DB_PATH') or data_path('progress.db'),
+                    flush_interval=float(os.getenv('PROGRESS_FLUSH_INTERVAL', 5))
+                )
+                atexit.register(_flush_on_exit)
+
+                # Pick up updates left behind by a previous worker
+                if _queue.pending():
+                    _queue.start_flusher()
+
+    return _queue
+
+
+def _flush_on_exit() -> None:
+    # Best effort; anything left over is picked up after the restart
+    try:
+        if _queue is not None and _queue.pending():
+            _queue.flush()
+    except Exception as e:
+        logger.error(f'Failed to flush progress on exit: {e}')
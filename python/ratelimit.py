@@ -0,0 +1,247 @@
+"""
+Rate limiting of calls to each AudioBookshelf host
+A token bucket per host, shared out fairly between accounts, with calls made for an Alexa request served before background work
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+from urllib.parse import urlparse
+
+from deadline import remaining
+from metrics import RATE_LIMIT_WAIT, RATE_LIMIT_REJECTED
+
+# Waiting calls are served in this order
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = ('interactive', 'background')
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a call cannot be sent to its host before its time runs out"""
+
+
+class _Waiter:
+    __slots__ = ('account', 'priority', 'granted', 'event')
+
+    def __init__(self, account: str, priority: int):
+        self.account = account
+        self.priority = priority
+        self.granted = False
+        self.event = threading.Event()
+
+
+class HostRateLimiter:
+    """
+    Token bucket for one host with fair queuing of the calls that have to wait
+
+    While the bucket has tokens and nobody is waiting, calls go straight
+    through. Otherwise they queue by priority, and within a priority one
+    account at a time in turn, so a burst from one account only delays its
+    own later calls.
+    """
+
+    def __init__(self, host: str, rate: float, burst: int):
+        """
+        Initialize the rate limiter
+
+        Args:
+            host: Host the limit applies to, for logging
+            rate: Calls per second the bucket refills with
+            burst: Calls that may be made at once after a quiet period
+        """
+        self.host = host
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        # Per priority: account -> its waiting calls, accounts in serving order
+        self._queues = [OrderedDict(), OrderedDict()]
+        self._lock = threading.Lock()
+
+    def acquire(self, account: str, default_wait: float) -> None:
+        """
+        Wait for a slot to call the host
+
+        Calls made within an Alexa request are interactive and may wait for
+        what is left of its deadline; any other call is background work and
+        waits up to default_wait.
+
+        Args:
+            account: Token of the account making the call
+            default_wait: Seconds a background call may wait
+
+        Raises:
+            RateLimitExceeded: If no slot came in time
+        """
+        priority, max_wait = self._classify(default_wait)
+        waiter = self._enqueue(account, priority)
+        if waiter is None:
+            return
+
+        start = time.monotonic()
+        deadline = start + max_wait
+        while True:
+            delay = self._poll(waiter)
+            if delay is None:
+                break
+            now = time.monotonic()
+            if now >= deadline:
+                # Raises unless a token came in meanwhile
+                self._give_up(waiter)
+                continue
+            waiter.event.wait(min(delay, deadline - now))
+        RATE_LIMIT_WAIT.observe(time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+    async def acquire_async(self, account: str, default_wait: float) -> None:
+        """
+        Wait for a slot to call the host without blocking the event loop, see acquire
+
+        Args:
+            account: Token of the account making the call
+            default_wait: Seconds a background call may wait
+
+        Raises:
+            RateLimitExceeded: If no slot came in time
+        """
+        priority, max_wait = self._classify(default_wait)
+        waiter = self._enqueue(account, priority)
+        if waiter is None:
+            return
+
+        start = time.monotonic()
+        deadline = start + max_wait
+        while True:
+            delay = self._poll(waiter)
+            if delay is None:
+                break
+            now = time.monotonic()
+            if now >= deadline:
+                self._give_up(waiter)
+                continue
+            await asyncio.sleep(min(delay, deadline - now))
+        RATE_LIMIT_WAIT.observe(time.monotonic() - start, priority=PRIORITY_NAMES[priority])
+
+    def _classify(self, default_wait: float):
+        budget = remaining()
+        if budget is None:
+            return BACKGROUND, default_wait
+        return INTERACTIVE, max(0.0, budget)
+
+    def _enqueue(self, account: str, priority: int) -> Optional[_Waiter]:
+        """
+        Take a token at once if nobody is waiting, or join the queue
+
+        Returns:
+            None if the call may go ahead, else its place in the queue
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1 and not any(self._queues):
+                self._tokens -= 1
+                return None
+
+            waiter = _Waiter(account, priority)
+            self._queues[priority].setdefault(account, deque()).append(waiter)
+            return waiter
+
+    def _poll(self, waiter: _Waiter) -> Optional[float]:
+        """
+        Hand out the tokens that have come in since the last poll
+
+        Returns:
+            None once the waiter holds a token, else seconds until the next one
+        """
+        with self._lock:
+            self._refill()
+            while self._tokens >= 1:
+                served = self._next_waiter()
+                if served is None:
+                    break
+                self._tokens -= 1
+                served.granted = True
+                served.event.set()
+
+            if waiter.granted:
+                return None
+            return (1 - self._tokens) / self.rate
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """
+        Take the next call to serve off the queues (caller holds the lock)
+        """
+        for queue in self._queues:
+            if not queue:
+                continue
+            account, waiting = next(iter(queue.items()))
+            waiter = waiting.popleft()
+            if waiting:
+                # The account goes to the back of the line for its next call
+                queue.move_to_end(account)
+            else:
+                del queue[account]
+            return waiter
+        return None
+
+    def _give_up(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if waiter.granted:
+                return
+            queue = self._queues[waiter.priority]
+            waiting = queue.get(waiter.account)
+            if waiting is not None:
+                waiting.remove(waiter)
+                if not waiting:
+                    del queue[waiter.account]
+
+        RATE_LIMIT_REJECTED.inc(priority=PRIORITY_NAMES[waiter.priority])
+        raise RateLimitExceeded(f'Rate limit for {self.host} left no slot in time')
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+
+_limiters = {}
+_limiters_pid = None
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(base_url: str) -> Optional[HostRateLimiter]:
+    """
+    Get this process's rate limiter for a server's host, configured from the environment
+
+    Args:
+        base_url: The base URL of the AudioBookshelf server
+
+    Returns:
+        HostRateLimiter instance, or None if ABS_RATE_LIMIT is 0
+    """
+    global _limiters, _limiters_pid
+
+    rate = float(os.getenv('ABS_RATE_LIMIT', 20))
+    if rate <= 0:
+        return None
+
+    host = urlparse(base_url).netloc or base_url
+    pid = os.getpid()
+    limiter = _limiters.get(host) if _limiters_pid == pid else None
+    if limiter is not None:
+        return limiter
+
+    with _limiters_lock:
+        if _limiters_pid != pid:
+            # Each worker has its own buckets; waiters of the parent do not exist here
+            _limiters = {}
+            _limiters_pid = pid
+
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = HostRateLimiter(host, rate, int(os.getenv('ABS_RATE_BURST', rate * 2)))
+            _limiters[host] = limiter
+
+    return limiter
@@ -0,0 +1,398 @@
+"""
+Response builders shared by the sync (Flask) and async (ASGI) handlers
+"""
+
+from typing import Dict, Optional, Tuple
+
+from ask_sdk_model.interfaces.audioplayer import (
+    PlayDirective, PlayBehavior, AudioItem, Stream, AudioItemMetadata
+)
+from ask_sdk_model.ui import LinkAccountCard
+
+from audiobookshelf_client import AudioBookshelfClient
+from chapters import clamp_offset
+from helpers import (
+    get_server_config, get_session_attributes, get_user_id, get_item_title,
+    get_item_author, get_item_cover_art, get_cover_art, get_progress_percent
+)
+from playback_state import get_playback_state_store
+from models import Item
+from tracks import StreamChoice, StreamToken, choose_stream, get_track_cache
+from constants import MESSAGES, SESSION_KEYS
+
+
+def build_play_directive(item: Item, stream: StreamChoice, base_url: Optional[str],
+                         token: Optional[str] = None) -> PlayDirective:
+    """
+    Build an AudioPlayer.Play directive for a library item
+
+    Args:
+        item: Library item from AudioBookshelf
+        stream: Track, URL and offset Alexa should stream
+        base_url: AudioBookshelf base URL, used for cover art
+        token: The account's AudioBookshelf token, used for cover art
+
+    Returns:
+        PlayDirective replacing the current queue
+    """
+    title = get_item_title(item)
+    author = get_item_author(item)
+    art = get_item_cover_art(item, base_url, token)
+
+    audio_item = AudioItem(
+        stream=Stream(
+            token=stream.token,
+            url=stream.url,
+            offset_in_milliseconds=stream.offset_ms
+        ),
+        metadata=AudioItemMetadata(
+            title=title,
+            subtitle=f"by {author}",
+            art=art
+        )
+    )
+
+    return PlayDirective(
+        play_behavior=PlayBehavior.REPLACE_ALL,
+        audio_item=audio_item
+    )
+
+
+def build_enqueue_directive(entry: Dict, stream: StreamChoice, previous_token: str,
+                            base_url: Optional[str],
+                            token: Optional[str] = None) -> PlayDirective:
+    """
+    Build an AudioPlayer.Play directive that queues the next track
+
+    Args:
+        entry: Cached track list of the item (see tracks.TrackCache)
+        stream: Next track to stream
+        previous_token: Token of the stream that is playing now
+        base_url: AudioBookshelf base URL, used for cover art
+        token: The account's AudioBookshelf token, used for cover art
+
+    Returns:
+        PlayDirective appending to the current queue
+    """
+    return PlayDirective(
+        play_behavior=PlayBehavior.ENQUEUE,
+        audio_item=_entry_audio_item(entry, stream, base_url, token, previous_token)
+    )
+
+
+def build_replace_directive(entry: Optional[Dict], stream: StreamChoice,
+                            base_url: Optional[str],
+                            token: Optional[str] = None) -> PlayDirective:
+    """
+    Build an AudioPlayer.Play directive for a stream of a cached item, e.g. after a seek
+
+    Args:
+        entry: Cached track list of the item, if any
+        stream: Track, URL and offset Alexa should stream
+        base_url: AudioBookshelf base URL, used for cover art
+        token: The account's AudioBookshelf token, used for cover art
+
+    Returns:
+        PlayDirective replacing the current queue
+    """
+    return PlayDirective(
+        play_behavior=PlayBehavior.REPLACE_ALL,
+        audio_item=_entry_audio_item(entry, stream, base_url, token)
+    )
+
+
+def _entry_audio_item(entry: Optional[Dict], stream: StreamChoice, base_url: Optional[str],
+                      token: Optional[str] = None,
+                      previous_token: Optional[str] = None) -> AudioItem:
+    metadata = None
+    if entry:
+        art = get_cover_art(StreamToken.parse(stream.token).item_id, entry.get('cover_path'),
+                            base_url, token=token)
+        metadata = AudioItemMetadata(
+            title=entry['title'],
+            subtitle=f"by {entry['author']}",
+            art=art
+        )
+
+    return AudioItem(
+        stream=Stream(
+            token=stream.token,
+            url=stream.url,
+            offset_in_milliseconds=stream.offset_ms,
+            expected_previous_token=previous_token
+        ),
+        metadata=metadata
+    )
+
+
+def not_configured_response(handler_input):
+    """Response asking the user to link their AudioBookshelf account"""
+    return (handler_input.response_builder
+            .speak(MESSAGES['NOT_CONFIGURED'])
+            .set_card(LinkAccountCard())
+            .response)
+
+
+def error_response(handler_input):
+    """Generic error response"""
+    return (handler_input.response_builder
+            .speak(MESSAGES['ERROR'])
+            .ask(MESSAGES['HELP'])
+            .response)
+
+
+def no_items_in_progress_response(handler_input):
+    """Response for a continue request with nothing in progress"""
+    return (handler_input.response_builder
+            .speak(MESSAGES['NO_ITEMS_IN_PROGRESS'])
+            .ask('Would you like to search for a book?')
+            .response)
+
+
+def nothing_playing_response(handler_input):
+    """Response for a playback control with nothing played yet"""
+    return (handler_input.response_builder
+            .speak(MESSAGES['NOTHING_PLAYING'])
+            .ask(MESSAGES['HELP'])
+            .response)
+
+
+def book_not_found_response(handler_input, book_name: str):
+    """Response for a title search with no matches"""
+    return (handler_input.response_builder
+            .speak(f"I couldn't find any books matching {book_name}. Try searching for something else.")
+            .ask('What would you like to do?')
+            .response)
+
+
+def progress_position(item: Item, user_id: Optional[str] = None) -> Tuple[int, Optional[str]]:
+    """
+    Get where the user left off in an in-progress item
+
+    The skill's own playback state wins over the server's progress when it
+    is newer, e.g. while progress writes are still queued or the items in
+    progress are stale.
+
+    Args:
+        item: In-progress library item, including its progress
+        user_id: Alexa userId whose playback state to consult, if any
+
+    Returns:
+        Tuple of the offset in milliseconds and the podcast episode ID, if any
+    """
+    progress = item.progress
+    offset_ms = int((progress.current_time if progress else 0) * 1000)
+    episode_id = progress.episode_id if progress else None
+
+    state = get_playback_state_store().get(user_id) if user_id else None
+    if state and state['item_id'] == item.id and \
+            state['updated_at'] * 1000 > ((progress.last_update or 0) if progress else 0):
+        return int(state['offset_ms']), state['episode_id'] or episode_id
+    return offset_ms, episode_id
+
+
+def progress_offset_ms(item: Item, user_id: Optional[str] = None) -> int:
+    """
+    Get where the user left off in an in-progress item, in milliseconds
+
+    Args:
+        item: In-progress library item, including its progress
+        user_id: Alexa userId whose playback state to consult, if any
+
+    Returns:
+        Offset within the item (or its episode) in milliseconds, see progress_position
+    """
+    return progress_position(item, user_id)[0]
+
+
+def continue_response(handler_input, item: Item, stream: StreamChoice):
+    """
+    Start playback of an in-progress item where the user left off
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+        item: In-progress library item, including its progress
+        stream: Track, URL and offset Alexa should stream, from progress_offset_ms
+
+    Returns:
+        Response with speech and a Play directive
+    """
+    session_attr = get_session_attributes(handler_input)
+    title = get_item_title(item)
+    author = get_item_author(item)
+
+    # Get progress information
+    user_id = get_user_id(handler_input)
+    offset_ms = progress_offset_ms(item, user_id)
+    duration = item.progress.duration if item.progress else item.duration
+    progress_percent = get_progress_percent(offset_ms / 1000, duration)
+
+    # Store session attributes
+    session_attr[SESSION_KEYS['CURRENT_ITEM']] = item.id
+    session_attr[SESSION_KEYS['OFFSET']] = offset_ms
+    get_playback_state_store().save(user_id, item.id, offset_ms, item.library_id,
+                                    StreamToken.parse(stream.token).episode_id)
+
+    base_url, token = get_server_config(session_attr)
+    play_directive = build_play_directive(item, stream, base_url, token)
+
+    speech_text = (f"Continuing {title}. You're {progress_percent}% through."
+                   if progress_percent > 0
+                   else f"Playing {title} by {author}.")
+
+    return (handler_input.response_builder
+            .speak(speech_text)
+            .add_directive(play_directive)
+            .response)
+
+
+def play_response(handler_input, item: Item, stream: StreamChoice, library_id: str):
+    """
+    Start playback of a library item from the beginning
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+        item: Library item from AudioBookshelf
+        stream: Track, URL and offset Alexa should stream
+        library_id: Library the item was found in
+
+    Returns:
+        Response with speech and a Play directive
+    """
+    session_attr = get_session_attributes(handler_input)
+    title = get_item_title(item)
+    author = get_item_author(item)
+
+    # Store session attributes
+    session_attr[SESSION_KEYS['CURRENT_ITEM']] = item.id
+    session_attr[SESSION_KEYS['OFFSET']] = 0
+    session_attr[SESSION_KEYS['LIBRARY_ID']] = library_id
+    get_playback_state_store().save(get_user_id(handler_input), item.id, 0, library_id,
+                                    StreamToken.parse(stream.token).episode_id)
+
+    base_url, token = get_server_config(session_attr)
+    play_directive = build_play_directive(item, stream, base_url, token)
+
+    return (handler_input.response_builder
+            .speak(f"Playing {title} by {author}.")
+            .add_directive(play_directive)
+            .response)
+
+
+def current_position(handler_input) -> Optional[Tuple[StreamToken, int]]:
+    """
+    Get what the user is listening to and where, without calling AudioBookshelf
+
+    The AudioPlayer context sent with every request on a device that plays
+    audio wins, then the shared playback state, then the session.
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+
+    Returns:
+        Token naming the item (and episode), and the offset within the item
+        (or episode) in milliseconds; None if nothing has been played
+    """
+    context = handler_input.request_envelope.context
+    audio_player = context.audio_player if context else None
+    stream = StreamToken.parse(audio_player.token) if audio_player else None
+    if stream:
+        return stream, stream.absolute_ms(audio_player.offset_in_milliseconds)
+
+    state = get_playback_state_store().get(get_user_id(handler_input))
+    if state:
+        return StreamToken(state['item_id'], state['episode_id']), int(state['offset_ms'])
+
+    session_attr = get_session_attributes(handler_input)
+    item_id = session_attr.get(SESSION_KEYS['CURRENT_ITEM'])
+    if item_id:
+        return StreamToken(item_id), int(session_attr.get(SESSION_KEYS['OFFSET']) or 0)
+    return None
+
+
+def load_chapter_entry(client: AudioBookshelfClient, item_id: str) -> Optional[Dict]:
+    """
+    Get an item's cached track list, refetching entries cached without a chapter index
+
+    Args:
+        client: AudioBookshelf client for the server
+        item_id: The library item ID
+
+    Returns:
+        Track list entry, or None if the item could not be fetched
+    """
+    track_cache = get_track_cache()
+    entry = track_cache.load(client, item_id)
+    if entry is not None and 'chapters' not in entry:
+        entry = track_cache.fetch(client, item_id) or entry
+    return entry
+
+
+def seek_response(handler_input, client: AudioBookshelfClient, position: StreamToken,
+                  entry: Optional[Dict], offset_ms: int, speech: Optional[str] = None):
+    """
+    Move playback to another offset in the item that is playing
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+        client: AudioBookshelf client for the server
+        position: Token naming the item (and episode) that is playing
+        entry: Cached track list of the item, if any
+        offset_ms: Target offset within the item (or episode) in milliseconds
+        speech: What to say before playback moves, if anything
+
+    Returns:
+        Response with a Play directive replacing the queue
+    """
+    session_attr = get_session_attributes(handler_input)
+    offset_ms = clamp_offset(entry, offset_ms, position.episode_id)
+    stream = choose_stream(client, entry, position.item_id, offset_ms, position.episode_id)
+
+    session_attr[SESSION_KEYS['CURRENT_ITEM']] = position.item_id
+    session_attr[SESSION_KEYS['OFFSET']] = offset_ms
+    get_playback_state_store().save(get_user_id(handler_input), position.item_id, offset_ms,
+                                    episode_id=position.episode_id)
+
+    base_url, token = get_server_config(session_attr)
+    response_builder = handler_input.response_builder
+    if speech:
+        response_builder.speak(speech)
+    return (response_builder
+            .add_directive(build_replace_directive(entry, stream, base_url, token))
+            .response)
+
+
+def episode_response(handler_input, entry: Optional[Dict], episode: Dict, stream: StreamChoice,
+                     library_id: Optional[str]):
+    """
+    Start playback of a podcast episode
+
+    Args:
+        handler_input: The ask-sdk HandlerInput
+        entry: Cached track list of the podcast, if any
+        episode: Episode from the episode cache
+        stream: Track, URL and offset Alexa should stream
+        library_id: Library the podcast belongs to, if known
+
+    Returns:
+        Response with speech and a Play directive
+    """
+    session_attr = get_session_attributes(handler_input)
+    item_id = StreamToken.parse(stream.token).item_id
+
+    session_attr[SESSION_KEYS['CURRENT_ITEM']] = item_id
+    session_attr[SESSION_KEYS['OFFSET']] = stream.offset_ms
+    if library_id:
+        session_attr[SESSION_KEYS['LIBRARY_ID']] = library_id
+    get_playback_state_store().save(get_user_id(handler_input), item_id, stream.offset_ms,
+                                    library_id, StreamToken.parse(stream.token).episode_id)
+
+    base_url, token = get_server_config(session_attr)
+    podcast = (entry or {}).get('title')
+    speech_text = f"Playing {episode['title'] or 'the episode'}"
+    speech_text += f" from {podcast}." if podcast else '.'
+
+    return (handler_input.response_builder
+            .speak(speech_text)
+            .add_directive(build_replace_directive(entry, stream, base_url, token))
+            .response)
@@ -0,0 +1,222 @@
+"""
+Concurrent search across all libraries of a server
+Queries every library at once and merges book and podcast hits by relevance
+"""
+
+import os
+import re
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+from audiobookshelf_client import AudioBookshelfClient
+from models import Item
+
+if TYPE_CHECKING:
+    from async_audiobookshelf_client import AsyncAudioBookshelfClient
+
+logger = logging.getLogger(__name__)
+
+# Relevance of a hit; an exact title match ends the search early
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+TITLE_MATCH = 0.6
+OTHER_MATCH = 0.4
+
+# Hits requested from each library
+DEFAULT_LIMIT = 10
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    """
+    Get this process's thread pool for library searches
+    """
+    global _pool, _pool_pid
+
+    pid = os.getpid()
+    if _pool_pid != pid:
+        with _pool_lock:
+            if _pool_pid != pid:
+                # Threads do not survive a fork, so the child needs its own pool
+                _pool = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('ABS_SEARCH_THREADS', 16)),
+                    thread_name_prefix='abs-search'
+                )
+                _pool_pid = pid
+
+    return _pool
+
+
+def _words(text: Optional[str]) -> List[str]:
+    return re.findall(r'\w+', (text or '').lower())
+
+
+def search_order(libraries: List[Dict], preferred: Optional[str] = None) -> List[str]:
+    """
+    Get library IDs in search order, the user's current library first
+
+    Args:
+        libraries: Library objects in the server's display order
+        preferred: Library the user last played from, if any
+
+    Returns:
+        List of library IDs
+    """
+    library_ids = [library['id'] for library in libraries]
+    if preferred in library_ids:
+        library_ids.remove(preferred)
+        library_ids.insert(0, preferred)
+    return library_ids
+
+
+def score_hit(query: str, hit: Item) -> float:
+    """
+    Rate how well a search hit matches the spoken query
+
+    Args:
+        query: Spoken title, author or series
+        hit: Search hit with its match_key
+
+    Returns:
+        Score between OTHER_MATCH and EXACT_MATCH
+    """
+    title = _words(hit.title)
+    words = _words(query)
+
+    if title == words:
+        return EXACT_MATCH
+    if title[:len(words)] == words:
+        return PREFIX_MATCH
+    if hit.match_key in (None, 'title') and all(word in title for word in words):
+        return TITLE_MATCH
+    return OTHER_MATCH
+
+
+def merge_hits(query: str, results: List[Dict[str, List[Item]]],
+               library_ids: List[str]) -> List[Item]:
+    """
+    Merge per-library search results into one ranked list of library items
+
+    Ties go to the library listed first, then to the server's own order.
+
+    Args:
+        query: Spoken title, author or series
+        results: Search responses with 'book' and 'podcast' hits
+        library_ids: Libraries in order of preference
+
+    Returns:
+        Library items, best match first
+    """
+    order = {library_id: position for position, library_id in enumerate(library_ids)}
+    ranked = []
+    for result in results:
+        for kind in ('book', 'podcast'):
+            for position, hit in enumerate(result.get(kind) or []):
+                ranked.append((-score_hit(query, hit),
+                               order.get(hit.library_id, len(order)), position, hit))
+
+    ranked.sort(key=lambda entry: entry[:3])
+    return [entry[3] for entry in ranked]
+
+
+def _has_exact_match(query: str, result: Dict[str, List[Item]]) -> bool:
+    return any(score_hit(query, hit) == EXACT_MATCH
+               for kind in ('book', 'podcast') for hit in result.get(kind) or [])
+
+
+def search_libraries(client: AudioBookshelfClient, library_ids: List[str], query: str,
+                     limit: int = DEFAULT_LIMIT) -> List[Item]:
+    """
+    Search several libraries concurrently
+
+    Returns as soon as one library answers with an exact title match;
+    otherwise waits for all of them. A failing library is skipped unless
+    every library fails.
+
+    Args:
+        client: AudioBookshelf client for the server
+        library_ids: Libraries to search, in order of preference
+        query: Search query
+        limit: Maximum number of hits per library
+
+    Returns:
+        Library items, best match first
+
+    Raises:
+        Exception: If every library search fails
+    """
+    pool = _get_pool()
+    # Each search carries the request deadline into its pool thread
+    futures = [pool.submit(contextvars.copy_context().run,
+                           client.search_library, library_id, query, limit)
+               for library_id in library_ids]
+
+    results = []
+    failures = 0
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning(f'Library search failed: {e}')
+            failures += 1
+            continue
+
+        results.append(result)
+        if _has_exact_match(query, result):
+            for pending in futures:
+                pending.cancel()
+            break
+
+    if library_ids and failures == len(library_ids):
+        raise Exception('Failed to search libraries')
+    return merge_hits(query, results, library_ids)
+
+
+async def search_libraries_async(client: 'AsyncAudioBookshelfClient', library_ids: List[str],
+                                 query: str, limit: int = DEFAULT_LIMIT) -> List[Item]:
+    """
+    Search several libraries concurrently with the async client, see search_libraries
+
+    Args:
+        client: Async AudioBookshelf client for the server
+        library_ids: Libraries to search, in order of preference
+        query: Search query
+        limit: Maximum number of hits per library
+
+    Returns:
+        Library items, best match first
+
+    Raises:
+        Exception: If every library search fails
+    """
+    tasks = [asyncio.ensure_future(client.search_library(library_id, query, limit))
+             for library_id in library_ids]
+
+    results = []
+    failures = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = await next_done
+            except Exception as e:
+                logger.warning(f'Library search failed: {e}')
+                failures += 1
+                continue
+
+            results.append(result)
+            if _has_exact_match(query, result):
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if library_ids and failures == len(library_ids):
+        raise Exception('Failed to search libraries')
+    return merge_hits(query, results, library_ids)
@@ -0,0 +1,263 @@
+"""
+Single-flight deduplication of identical concurrent AudioBookshelf GETs
+Callers asking for what is already in flight wait for that request instead of sending their own
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from metrics import DEDUPLICATED_REQUESTS
+from storage import SQLiteStore, data_path
+
+# Seconds a worker may hold a request before others stop waiting for it
+SHARED_LEASE_SECONDS = 10
+
+# Seconds a shared response is kept for workers still polling for it
+SHARED_RESULT_TTL = 30
+
+# Seconds between checks while another worker's request is in flight
+POLL_INTERVAL = 0.01
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers share its outcome"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def do(self, key: Hashable, func: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Call func, or wait for the identical call already running in another thread
+
+        Args:
+            key: Identifies identical calls
+            func: Function to call when no identical call is in flight
+            timeout: Seconds to wait for another thread's call
+
+        Returns:
+            Result of func, possibly from another thread's call
+
+        Raises:
+            Exception: Whatever the shared call raised, or TimeoutError when
+                waiting took longer than timeout
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Calls in flight at fork time belong to the parent's threads
+                self._calls = {}
+                self._pid = os.getpid()
+
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+
+        if not leader:
+            DEDUPLICATED_REQUESTS.inc(scope='thread')
+            return future.result(timeout=timeout)
+
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._calls.get(key) is future:
+                    del self._calls[key]
+
+
+class AsyncSingleFlight:
+    """Runs one coroutine per key at a time on an event loop; concurrent awaiters share it"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await func(), or the identical call another task already started
+
+        Args:
+            key: Identifies identical calls
+            func: Coroutine function to run when no identical call is in flight
+
+        Returns:
+            Result of func, possibly from another task's call
+        """
+        task = self._calls.get(key)
+        if task is not None:
+            DEDUPLICATED_REQUESTS.inc(scope='task')
+            # Cancelling one awaiter must not cancel the call the others wait for
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+
+class SharedFlights(SQLiteStore):
+    """GET responses handed from the worker that sent the request to workers waiting for it"""
+
+    def create_schema(self, conn):
+        with conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS flights (
+                    key TEXT PRIMARY KEY,
+                    started_at REAL NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    completed_for REAL,
+                    completed_at REAL,
+                    status INTEGER,
+                    headers TEXT,
+                    body BLOB
+                );
+                CREATE INDEX IF NOT EXISTS flights_completed_at ON flights (completed_at);
+            ''')
+
+    def do(self, key: str, func: Callable[[], requests.Response],
+           timeout: float) -> requests.Response:
+        """
+        Send a GET, or wait for the identical one another worker is sending
+
+        If the other worker gives up or dies, the request is sent here once
+        its lease runs out.
+
+        Args:
+            key: Identifies identical requests, including server and token
+            func: Function sending the request
+            timeout: Seconds to wait for another worker's response
+
+        Returns:
+            HTTP response, possibly rebuilt from another worker's
+        """
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        wait_until = time.monotonic() + timeout
+
+        while True:
+            claimed, started_at = self._claim(key)
+            if claimed:
+                return self._send(key, started_at, func)
+
+            response = self._wait(key, started_at, wait_until)
+            if response is not None:
+                DEDUPLICATED_REQUESTS.inc(scope='worker')
+                return response
+            if time.monotonic() >= wait_until:
+                raise TimeoutError('Timed out waiting for a shared request')
+
+    def _send(self, key: str, started_at: float,
+              func: Callable[[], requests.Response]) -> requests.Response:
+        conn = self.connection()
+        try:
+            response = func()
+        except BaseException:
+            # Waiting workers then send the request themselves
+            with conn:
+                conn.execute('UPDATE flights SET lease_until = 0 WHERE key = ? AND started_at = ?',
+                             (key, started_at))
+            raise
+
+        now = time.time()
+        with conn:
+            conn.execute(
+                'UPDATE flights SET lease_until = 0, completed_for = ?, completed_at = ?, '
+                'status = ?, headers = ?, body = ? WHERE key = ? AND started_at = ?',
+                (started_at, now, response.status_code, json.dumps(dict(response.headers)),
+                 response.content, key, started_at)
+            )
+            conn.execute('DELETE FROM flights WHERE completed_at < ? AND lease_until < ?',
+                         (now - SHARED_RESULT_TTL, now))
+        return response
+
+    def _claim(self, key: str) -> Tuple[bool, float]:
+        """
+        Take the lease for a request
+
+        Returns:
+            Whether the lease was taken, and the start time of the request
+            now in flight, ours or another worker's
+        """
+        now = time.time()
+        conn = self.connection()
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO flights (key) VALUES (?)', (key,))
+            cursor = conn.execute(
+                'UPDATE flights SET started_at = ?, lease_until = ? '
+                'WHERE key = ? AND lease_until < ?',
+                (now, now + SHARED_LEASE_SECONDS, key, now)
+            )
+            if cursor.rowcount == 1:
+                return True, now
+            return False, conn.execute('SELECT started_at FROM flights WHERE key = ?',
+                                       (key,)).fetchone()['started_at']
+
+    def _wait(self, key: str, started_at: float,
+              wait_until: float) -> Optional[requests.Response]:
+        """
+        Poll for the response to the request started at started_at
+
+        Returns:
+            The response, or None once the lease is gone without one
+        """
+        while time.monotonic() < wait_until:
+            row = self.connection().execute(
+                'SELECT lease_until, completed_for, status, headers, body FROM flights '
+                'WHERE key = ?', (key,)
+            ).fetchone()
+            if row and row['completed_for'] == started_at:
+                return _rebuild(row)
+            if not row or row['lease_until'] < time.time():
+                return None
+            time.sleep(POLL_INTERVAL)
+        return None
+
+
+def _rebuild(row) -> requests.Response:
+    response = requests.Response()
+    response.status_code = row['status']
+    response.headers = CaseInsensitiveDict(json.loads(row['headers']))
+    response._content = bytes(row['body'])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    return response
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_flights() -> Optional[SharedFlights]:
+    """
+    Get the process-wide cross-worker store, if enabled in the environment
+
+    Returns:
+        SharedFlights instance, or None unless ABS_SINGLE_FLIGHT_SHARED is set
+    """
+    global _shared
+
+    if os.getenv('ABS_SINGLE_FLIGHT_SHARED', 'False').lower() != 'true':
+        return None
+
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SharedFlights(
+                    os.getenv('SINGLE_FLIGHT_DB_PATH') or data_path('singleflight.db')
+                )
+
+    return _shared
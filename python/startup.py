@@ -0,0 +1,140 @@
+"""
+Startup helpers for serving from pre-forked workers
+Warms the skill once in the gunicorn master and reconnects each worker after the fork
+"""
+
+import gc
+import os
+import json
+import time
+import logging
+import importlib
+import threading
+
+from ask_sdk_model import Response, ResponseEnvelope
+from ask_sdk_model.interfaces.audioplayer import (
+    AudioItem, AudioItemMetadata, PlayBehavior, PlayDirective, Stream
+)
+from ask_sdk_model.ui import SimpleCard, SsmlOutputSpeech
+
+from client_registry import get_client
+from codec import decode_request, encode_response
+from verifier import get_verifiers, verification_enabled
+
+logger = logging.getLogger(__name__)
+
+# Imported lazily by request handlers; loaded up front when the master warms the skill
+LAZY_MODULES = ('PIL.Image', 'PIL.JpegImagePlugin', 'PIL.PngImagePlugin', 'dateutil.parser')
+
+# Request types the skill handles; decoding one of each loads their model classes
+SAMPLE_REQUESTS = (
+    {'type': 'LaunchRequest'},
+    {'type': 'IntentRequest', 'dialogState': 'COMPLETED',
+     'intent': {'name': 'PlayBookIntent', 'confirmationStatus': 'NONE',
+                'slots': {'bookName': {'name': 'bookName', 'value': 'x',
+                                       'confirmationStatus': 'NONE'}}}},
+    {'type': 'SessionEndedRequest', 'reason': 'USER_INITIATED',
+     'error': {'type': 'INTERNAL_SERVICE_ERROR', 'message': ''}},
+    {'type': 'AudioPlayer.PlaybackStarted', 'token': 'x', 'offsetInMilliseconds': 0},
+    {'type': 'AudioPlayer.PlaybackFinished', 'token': 'x', 'offsetInMilliseconds': 0},
+    {'type': 'AudioPlayer.PlaybackStopped', 'token': 'x', 'offsetInMilliseconds': 0},
+    {'type': 'AudioPlayer.PlaybackNearlyFinished', 'token': 'x', 'offsetInMilliseconds': 0},
+    {'type': 'AudioPlayer.PlaybackFailed', 'token': 'x',
+     'error': {'type': 'MEDIA_ERROR_UNKNOWN', 'message': ''},
+     'currentPlaybackState': {'token': 'x', 'offsetInMilliseconds': 0,
+                              'playerActivity': 'PLAYING'}},
+    {'type': 'System.ExceptionEncountered',
+     'error': {'type': 'INVALID_RESPONSE', 'message': ''},
+     'cause': {'requestId': 'x'}},
+)
+
+SAMPLE_CONTEXT = {
+    'System': {
+        'application': {'applicationId': 'x'},
+        'user': {'userId': 'x', 'accessToken': 'x'},
+        'device': {'deviceId': 'x', 'supportedInterfaces': {'AudioPlayer': {}}},
+        'apiEndpoint': 'https://api.amazonalexa.com'
+    },
+    'AudioPlayer': {'token': 'x', 'offsetInMilliseconds': 0, 'playerActivity': 'PLAYING'}
+}
+
+
+def warm_up() -> float:
+    """
+    Do the one-off work of a first request ahead of time
+
+    Loads lazily imported modules and every model class a request can
+    decode into, compiles the codec's per-class plans, encodes a play
+    response and parses the trusted root certificates. Run in the gunicorn
+    master, all of this is shared by every worker it forks.
+
+    Returns:
+        Seconds taken
+    """
+    start = time.perf_counter()
+
+    for module in LAZY_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.debug(f'Not preloading {module}: {e}')
+
+    for request in SAMPLE_REQUESTS:
+        envelope = {
+            'version': '1.0',
+            'session': {'new': True, 'sessionId': 'x', 'application': {'applicationId': 'x'},
+                        'user': {'userId': 'x'}, 'attributes': {}},
+            'context': SAMPLE_CONTEXT,
+            'request': dict(request, requestId='x', timestamp='2026-01-01T00:00:00Z',
+                            locale='en-US')
+        }
+        decode_request(json.dumps(envelope).encode('utf-8'))
+
+    encode_response(ResponseEnvelope(version='1.0', response=Response(
+        output_speech=SsmlOutputSpeech(ssml='<speak>x</speak>'),
+        card=SimpleCard(title='x', content='x'),
+        directives=[PlayDirective(
+            play_behavior=PlayBehavior.REPLACE_ALL,
+            audio_item=AudioItem(
+                stream=Stream(token='x', url='https://x', offset_in_milliseconds=0),
+                metadata=AudioItemMetadata(title='x', subtitle='x')
+            )
+        )],
+        should_end_session=True
+    )))
+
+    if verification_enabled():
+        get_verifiers()[0].trust_store.load()
+
+    # Objects that survive start-up are never freed; keeping them out of the
+    # collector stops it from touching, and so copying, the pages workers share
+    gc.collect()
+    gc.freeze()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f'Warmed up the skill in {elapsed * 1000:.0f} ms')
+    return elapsed
+
+
+def after_fork() -> None:
+    """
+    Open this worker's keep-alive connection to the configured server
+
+    Connection pools inherited from the master are dropped by their own
+    fork hooks; this replaces them before the first request needs one, on
+    a background thread so the worker starts accepting at once.
+    """
+    base_url = os.getenv('AUDIOBOOKSHELF_URL')
+    token = os.getenv('AUDIOBOOKSHELF_TOKEN')
+    if not base_url or not token:
+        return
+
+    threading.Thread(target=_connect, args=(base_url, token),
+                     name='abs-connect', daemon=True).start()
+
+
+def _connect(base_url: str, token: str) -> None:
+    try:
+        get_client(base_url, token).get_libraries()
+    except Exception as e:
+        logger.warning(f'Failed to connect to AudioBookshelf after fork: {e}')
@@ -0,0 +1,91 @@
+"""
+Local SQLite storage shared by all gunicorn workers
+"""
+
+import os
+import sqlite3
+import threading
+
+
+def data_path(filename: str) -> str:
+    """
+    Get the path of a file in the skill's data directory
+
+    Args:
+        filename: Name of the file inside the data directory
+
+    Returns:
+        Absolute path, with the data directory created if needed
+    """
+    data_dir = os.getenv('DATA_DIR') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'data'
+    )
+    os.makedirs(data_dir, mode=0o700, exist_ok=True)
+    return os.path.join(data_dir, filename)
+
+
+def _make_private(path: str) -> None:
+    """
+    Create a database file readable only by the skill's user, or tighten an existing one
+
+    Several stores keep AudioBookshelf tokens next to their rows (progress,
+    prefetch, episodes, tokens), so no store file is left readable by
+    others. SQLite gives the -wal and -shm files the database's permissions.
+    """
+    try:
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+    except OSError:
+        # e.g. a file owned by another user; SQLite reports anything worse
+        pass
+
+
+class SQLiteStore:
+    """Base class for WAL-mode SQLite stores with per-thread connections"""
+
+    def __init__(self, path: str):
+        """
+        Initialize the store
+
+        Args:
+            path: Path of the SQLite database file
+        """
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+        _make_private(path)
+        with self.connection() as conn:
+            self.create_schema(conn)
+
+    def create_schema(self, conn: sqlite3.Connection) -> None:
+        """
+        Create tables and indexes; called once per process
+
+        Args:
+            conn: Open database connection
+        """
+        raise NotImplementedError
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        Get this thread's connection, opening it on first use
+
+        Connections are never shared across threads or carried over a fork.
+
+        Returns:
+            sqlite3 connection usable as a transaction context manager
+        """
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+
+        return conn
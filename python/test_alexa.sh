@@ -1,5 +1,7 @@
 #!/bin/bash
 
+# These requests are not signed by Alexa: run the server with
+# ALEXA_VERIFY_REQUESTS=False while testing, or /alexa answers 400
 BASE_URL="http://alx.sgrslab.in"
 
 echo "=== Testing Health Endpoint ==="
@@ -0,0 +1,270 @@
+"""
+AudioBookshelf access tokens shared by all gunicorn workers
+Logs in again once per expiry when the server rejects a token, however many requests notice it
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+from deadline import remaining
+from metrics import TOKEN_REFRESHES
+from storage import SQLiteStore, data_path
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may hold the refresh lease before another one takes over
+REFRESH_LEASE_SECONDS = 15
+
+# Seconds to wait after a failed login before trying again
+FAILURE_BACKOFF_SECONDS = 30
+
+# Seconds between checks while another worker is logging in
+POLL_INTERVAL = 0.05
+
+
+def token_from_login(data: Dict) -> str:
+    """
+    Get the access token from a /login response
+
+    Servers issuing short-lived JWTs return 'accessToken'; older ones only 'token'.
+
+    Args:
+        data: Login response with a 'user' object
+
+    Returns:
+        Access token
+
+    Raises:
+        Exception: If the response carries no token
+    """
+    user = (data or {}).get('user') or {}
+    token = user.get('accessToken') or user.get('token')
+    if not token:
+        raise Exception('Invalid login response')
+    return token
+
+
+class TokenManager(SQLiteStore):
+    """Current access token per configured token, refreshed single-flight"""
+
+    def __init__(self, path: str, server_url: Optional[str] = None,
+                 configured_token: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None):
+        """
+        Initialize the token manager
+
+        Args:
+            path: Path of the SQLite database file
+            server_url: AudioBookshelf base URL the credentials belong to
+            configured_token: Token configured for that server, used as the key
+            username: AudioBookshelf username used to log in again
+            password: AudioBookshelf password used to log in again
+        """
+        self.server_url = (server_url or '').rstrip('/')
+        self.configured_token = configured_token or ''
+        self.username = username
+        self.password = password
+        self._tokens = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._locks_pid = os.getpid()
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS access_tokens (
+                    base_url TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    token TEXT,
+                    refreshed_at REAL NOT NULL DEFAULT 0,
+                    lease_until REAL NOT NULL DEFAULT 0,
+                    retry_after REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (base_url, key)
+                )
+            ''')
+
+    def can_refresh(self, base_url: str, key: str) -> bool:
+        """
+        Check whether a token can be replaced by logging in again
+
+        Only the token configured in the environment can: account-linked
+        tokens belong to users whose passwords the skill does not know.
+
+        Args:
+            base_url: AudioBookshelf base URL
+            key: Token the client was created with
+
+        Returns:
+            True if credentials for this server and token are configured
+        """
+        return bool(self.username and self.password and key == self.configured_token
+                    and base_url.rstrip('/') == self.server_url)
+
+    def current(self, base_url: str, key: str) -> str:
+        """
+        Get the access token to send for a configured token
+
+        Args:
+            base_url: AudioBookshelf base URL
+            key: Token the client was created with
+
+        Returns:
+            The latest token any worker obtained, or the key itself
+        """
+        if not self.can_refresh(base_url, key):
+            return key
+
+        token = self._tokens.get((base_url, key))
+        if token is None:
+            row = self.connection().execute(
+                'SELECT token FROM access_tokens WHERE base_url = ? AND key = ?',
+                (base_url, key)
+            ).fetchone()
+            token = (row['token'] if row else None) or key
+            self._tokens[(base_url, key)] = token
+        return token
+
+    def refresh(self, base_url: str, key: str, failed_token: str,
+                login: Callable[[str, str], Dict]) -> Optional[str]:
+        """
+        Get a replacement for a token the server rejected
+
+        Within a process, one thread refreshes while the others wait for it.
+        Across processes, the worker holding the lease logs in and the rest
+        pick the new token up from the database.
+
+        Args:
+            base_url: AudioBookshelf base URL
+            key: Token the client was created with
+            failed_token: Token the server answered 401 to
+            login: Function taking username and password and returning the
+                /login response
+
+        Returns:
+            New access token, or None if it cannot be refreshed
+        """
+        if not self.can_refresh(base_url, key):
+            return None
+
+        with self._lock_for(base_url, key):
+            token = self._tokens.get((base_url, key))
+            if token and token != failed_token:
+                TOKEN_REFRESHES.inc(result='shared')
+                return token
+
+            budget = remaining()
+            wait_until = time.monotonic() + min(
+                REFRESH_LEASE_SECONDS, budget if budget is not None else REFRESH_LEASE_SECONDS
+            )
+            while True:
+                now = time.time()
+                row = self._get_row(base_url, key)
+                if row and row['token'] and row['token'] != failed_token:
+                    self._tokens[(base_url, key)] = row['token']
+                    TOKEN_REFRESHES.inc(result='shared')
+                    return row['token']
+
+                if row and row['retry_after'] > now:
+                    TOKEN_REFRESHES.inc(result='failed')
+                    return None
+
+                if self._claim(base_url, key, now):
+                    return self._login(base_url, key, login)
+
+                if time.monotonic() >= wait_until:
+                    logger.warning('Timed out waiting for another worker to refresh the token')
+                    TOKEN_REFRESHES.inc(result='failed')
+                    return None
+                time.sleep(POLL_INTERVAL)
+
+    def _login(self, base_url: str, key: str,
+               login: Callable[[str, str], Dict]) -> Optional[str]:
+        """
+        Log in while holding the lease and publish the new token
+        """
+        conn = self.connection()
+        try:
+            token = token_from_login(login(self.username, self.password))
+        except Exception as e:
+            logger.error(f'Failed to refresh AudioBookshelf token: {e}')
+            with conn:
+                conn.execute(
+                    'UPDATE access_tokens SET lease_until = 0, retry_after = ? '
+                    'WHERE base_url = ? AND key = ?',
+                    (time.time() + FAILURE_BACKOFF_SECONDS, base_url, key)
+                )
+            TOKEN_REFRESHES.inc(result='failed')
+            return None
+
+        with conn:
+            conn.execute(
+                'UPDATE access_tokens SET token = ?, refreshed_at = ?, lease_until = 0, '
+                'retry_after = 0 WHERE base_url = ? AND key = ?',
+                (token, time.time(), base_url, key)
+            )
+        self._tokens[(base_url, key)] = token
+        logger.info('Refreshed AudioBookshelf token')
+        TOKEN_REFRESHES.inc(result='refreshed')
+        return token
+
+    def _get_row(self, base_url: str, key: str):
+        return self.connection().execute(
+            'SELECT token, retry_after FROM access_tokens WHERE base_url = ? AND key = ?',
+            (base_url, key)
+        ).fetchone()
+
+    def _claim(self, base_url: str, key: str, now: float) -> bool:
+        """
+        Take the refresh lease for a token; False if another worker holds it
+        """
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO access_tokens (base_url, key) VALUES (?, ?)',
+                (base_url, key)
+            )
+            cursor = conn.execute(
+                'UPDATE access_tokens SET lease_until = ? '
+                'WHERE base_url = ? AND key = ? AND lease_until < ?',
+                (now + REFRESH_LEASE_SECONDS, base_url, key, now)
+            )
+        return cursor.rowcount == 1
+
+    def _lock_for(self, base_url: str, key: str) -> threading.Lock:
+        with self._locks_lock:
+            if self._locks_pid != os.getpid():
+                # Locks held by other threads at fork time would never be released
+                self._locks = {}
+                self._locks_pid = os.getpid()
+            return self._locks.setdefault((base_url, key), threading.Lock())
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_token_manager() -> TokenManager:
+    """
+    Get the process-wide token manager, configured from the environment
+
+    Returns:
+        TokenManager instance
+    """
+    global _manager
+
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = TokenManager(
+                    os.getenv('TOKEN_DB_PATH') or data_path('tokens.db'),
+                    server_url=os.getenv('AUDIOBOOKSHELF_URL'),
+                    configured_token=os.getenv('AUDIOBOOKSHELF_TOKEN'),
+                    username=os.getenv('AUDIOBOOKSHELF_USERNAME'),
+                    password=os.getenv('AUDIOBOOKSHELF_PASSWORD')
+                )
+
+    return _manager
@@ -0,0 +1,508 @@
+"""
+Track lists of multi-file audiobooks and podcasts
+Negotiated with AudioBookshelf play sessions so Alexa direct-plays files one at a time;
+items the server would transcode keep the whole-item stream
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, TYPE_CHECKING
+
+from audiobookshelf_client import AudioBookshelfClient
+from chapters import build_chapter_index
+from client_registry import get_client
+from constants import ALEXA_MIME_TYPES, PLAY_METHODS
+from helpers import get_item_title, get_item_author
+from metrics import observe_cache
+from models import Item
+from storage import SQLiteStore, data_path
+
+if TYPE_CHECKING:
+    from async_audiobookshelf_client import AsyncAudioBookshelfClient
+
+logger = logging.getLogger(__name__)
+
+TOKEN_SEPARATOR = '|'
+
+
+class StreamToken(NamedTuple):
+    """What an AudioPlayer token points at"""
+
+    item_id: str
+    episode_id: Optional[str] = None
+    # None for a whole-item stream
+    index: Optional[int] = None
+    # Where the track starts within the item
+    start_ms: int = 0
+
+    def encode(self) -> str:
+        """
+        Encode as an AudioPlayer token; whole-item streams keep the bare item ID
+        """
+        if self.index is None and not self.episode_id:
+            return self.item_id
+        return TOKEN_SEPARATOR.join([
+            self.item_id, self.episode_id or '',
+            '' if self.index is None else str(self.index), str(self.start_ms)
+        ])
+
+    @classmethod
+    def parse(cls, token: Optional[str]) -> Optional['StreamToken']:
+        """
+        Parse an AudioPlayer token
+
+        Args:
+            token: Token from an AudioPlayer request or context
+
+        Returns:
+            StreamToken, or None for an empty token
+        """
+        if not token:
+            return None
+
+        parts = token.split(TOKEN_SEPARATOR)
+        if len(parts) != 4:
+            return cls(token)
+
+        item_id, episode_id, index, start_ms = parts
+        return cls(item_id, episode_id or None, int(index) if index else None,
+                   int(start_ms or 0))
+
+    def absolute_ms(self, offset_ms: int) -> int:
+        """
+        Convert an offset within this stream to an offset within the item
+        """
+        return self.start_ms + int(offset_ms or 0)
+
+
+def is_alexa_playable(mime_type: Optional[str]) -> bool:
+    """
+    Check whether Alexa can stream a file as it is; unknown types are assumed playable
+    """
+    return not mime_type or mime_type.lower() in ALEXA_MIME_TYPES
+
+
+class StreamChoice(NamedTuple):
+    """Stream to hand Alexa for a position in an item"""
+
+    token: str
+    url: str
+    offset_ms: int
+
+
+def build_tracks(item: Item) -> List[Dict]:
+    """
+    Build the cached track list of an expanded library item
+
+    Books get one entry per audio file with its start offset in the book,
+    or none if any file needs transcoding for Alexa. Podcasts get one entry
+    per episode, oldest first.
+
+    Args:
+        item: Library item details from AudioBookshelf
+
+    Returns:
+        List of dicts with 'index', 'start', 'duration', 'content_url',
+        'episode_id' and 'title'
+    """
+    if item.media_type != 'podcast' and not all(is_alexa_playable(track.mime_type)
+                                                for track in item.tracks):
+        return []
+    return [track.to_dict() for track in item.tracks]
+
+
+def entry_from_session(session: Dict) -> Dict:
+    """
+    Build a track list entry from a negotiated playback session
+
+    Only direct-play sessions yield tracks: their file URLs outlive the
+    session. Anything the server transcodes is left to the whole-item
+    stream URL.
+
+    Args:
+        session: Playback session from AudioBookshelf
+
+    Returns:
+        Track list entry, see TrackCache.get
+    """
+    audio_tracks = sorted(session.get('audioTracks') or [],
+                          key=lambda track: track.get('index') or 0)
+    direct = (session.get('playMethod') == PLAY_METHODS['DIRECT_PLAY']
+              and all(is_alexa_playable(track.get('mimeType')) for track in audio_tracks))
+
+    return {
+        'tracks': [{
+            'index': position,
+            'start': track.get('startOffset') or 0,
+            'duration': track.get('duration') or 0,
+            'content_url': track['contentUrl'],
+            'episode_id': session.get('episodeId'),
+            'title': track.get('title')
+        } for position, track in enumerate(audio_tracks)] if direct else [],
+        'title': session.get('displayTitle'),
+        'author': session.get('displayAuthor'),
+        'cover_path': session.get('coverPath'),
+        'media_type': session.get('mediaType') or 'book',
+        'duration': session.get('duration') or 0,
+        'chapters': build_chapter_index(session.get('chapters') or [])
+    }
+
+
+class TrackCache(SQLiteStore):
+    """Track lists per library item, in SQLite with an in-process LRU in front"""
+
+    def __init__(self, path: str, ttl: float = 86400, cache_size: int = 256):
+        """
+        Initialize the track cache
+
+        Args:
+            path: Path of the SQLite database file
+            ttl: Seconds before a track list is fetched again
+            cache_size: Maximum number of items kept in memory
+        """
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._revalidating = set()
+        super().__init__(path)
+
+    def create_schema(self, conn):
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS item_tracks (
+                    base_url TEXT NOT NULL,
+                    item_id TEXT NOT NULL,
+                    entry TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (base_url, item_id)
+                )
+            ''')
+
+    def get(self, base_url: str, item_id: str, allow_stale: bool = False) -> Optional[Dict]:
+        """
+        Get a cached track list without calling AudioBookshelf
+
+        Args:
+            base_url: AudioBookshelf base URL
+            item_id: The library item ID
+            allow_stale: Also return entries older than the TTL
+
+        Returns:
+            Dict with 'tracks', 'title', 'author', 'cover_path', 'media_type',
+            'duration' (seconds) and 'chapters' (see chapters.build_chapter_index),
+            or None on a miss
+        """
+        key = (base_url, item_id)
+        stale_before = 0 if allow_stale else time.time() - self.ttl
+
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry and entry['updated_at'] > stale_before:
+                self._cache.move_to_end(key)
+                observe_cache('tracks', True)
+                return entry
+
+        row = self.connection().execute(
+            'SELECT entry, updated_at FROM item_tracks WHERE base_url = ? AND item_id = ? '
+            'AND updated_at > ?',
+            (base_url, item_id, stale_before)
+        ).fetchone()
+
+        observe_cache('tracks', row is not None)
+        if not row:
+            return None
+
+        entry = dict(json.loads(row['entry']), updated_at=row['updated_at'])
+        self._remember(key, entry)
+        return entry
+
+    def put(self, base_url: str, item: Item) -> Dict:
+        """
+        Store the track list of an expanded library item
+
+        Args:
+            base_url: AudioBookshelf base URL
+            item: Library item details from AudioBookshelf
+
+        Returns:
+            The stored entry
+        """
+        return self.store(base_url, item.id, {
+            'tracks': build_tracks(item),
+            'title': get_item_title(item),
+            'author': get_item_author(item),
+            'cover_path': item.cover_path,
+            'media_type': item.media_type,
+            'duration': item.duration,
+            'chapters': build_chapter_index(chapter.to_dict() for chapter in item.chapters)
+        })
+
+    def store(self, base_url: str, item_id: str, entry: Dict) -> Dict:
+        """
+        Store a track list entry
+
+        Args:
+            base_url: AudioBookshelf base URL
+            item_id: The library item ID
+            entry: Track list entry, see get
+
+        Returns:
+            The stored entry
+        """
+        now = time.time()
+
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO item_tracks (base_url, item_id, entry, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (base_url, item_id) DO UPDATE SET
+                    entry = excluded.entry,
+                    updated_at = excluded.updated_at
+            ''', (base_url, item_id, json.dumps(entry), now))
+
+        entry = dict(entry, updated_at=now)
+        self._remember((base_url, item_id), entry)
+        return entry
+
+    def load(self, client: AudioBookshelfClient, item_id: str) -> Optional[Dict]:
+        """
+        Get a track list, negotiating a playback session on a miss
+
+        An entry past its TTL is served as is while a fresh one is fetched in
+        the background, so playback never waits on a slow or unavailable server.
+
+        Args:
+            client: AudioBookshelf client for the server
+            item_id: The library item ID
+
+        Returns:
+            Track list entry, or None if the item could not be fetched
+        """
+        entry = self._get_or_revalidate(client, item_id)
+        if entry is not None:
+            return entry
+        return self.fetch(client, item_id)
+
+    def fetch(self, client: AudioBookshelfClient, item_id: str) -> Optional[Dict]:
+        """
+        Fetch and store a track list, negotiating a playback session
+
+        The session is only used to learn which files the server direct-plays
+        and is closed right away. Only direct play is negotiated: a
+        transcode session's stream dies with the session, so items the
+        server would transcode get no tracks and play from the whole-item
+        stream URL. Items the server will not open a session for without an
+        episode, i.e. podcasts, are fetched instead.
+
+        Args:
+            client: AudioBookshelf client for the server
+            item_id: The library item ID
+
+        Returns:
+            Track list entry, or None if the item could not be fetched
+        """
+        try:
+            session = client.start_play_session(item_id)
+        except Exception:
+            session = None
+
+        if session:
+            try:
+                return self.store(client.base_url, item_id, entry_from_session(session))
+            finally:
+                client.close_session(session['id'])
+
+        try:
+            return self.put(client.base_url, client.get_library_item(item_id))
+        except Exception as e:
+            logger.warning(f'Failed to load tracks of {item_id}: {e}')
+            return None
+
+    async def load_async(self, client: 'AsyncAudioBookshelfClient',
+                         item_id: str) -> Optional[Dict]:
+        """
+        Get a track list with the async client, see load
+
+        Args:
+            client: Async AudioBookshelf client for the server
+            item_id: The library item ID
+
+        Returns:
+            Track list entry, or None if the item could not be fetched
+        """
+        entry = self._get_or_revalidate(client, item_id)
+        if entry is not None:
+            return entry
+
+        try:
+            session = await client.start_play_session(item_id)
+        except Exception:
+            session = None
+
+        if session:
+            try:
+                return self.store(client.base_url, item_id, entry_from_session(session))
+            finally:
+                await client.close_session(session['id'])
+
+        try:
+            return self.put(client.base_url, await client.get_library_item(item_id))
+        except Exception as e:
+            logger.warning(f'Failed to load tracks of {item_id}: {e}')
+            return None
+
+    def load_in_background(self, client: AudioBookshelfClient, item_id: str) -> None:
+        """
+        Make sure an item's track list is cached, fetching on a background thread
+
+        Args:
+            client: AudioBookshelf client for the server
+            item_id: The library item ID
+        """
+        if self.get(client.base_url, item_id) is not None:
+            return
+
+        key = (client.base_url, item_id)
+        with self._cache_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+
+        threading.Thread(target=self._fetch_in_background, args=(client, item_id),
+                         name='track-loader', daemon=True).start()
+
+    def _get_or_revalidate(self, client, item_id: str) -> Optional[Dict]:
+        """
+        Get a cached entry, starting a background refresh if it is past its TTL
+        """
+        entry = self.get(client.base_url, item_id, allow_stale=True)
+        if entry is not None and entry['updated_at'] <= time.time() - self.ttl:
+            observe_cache('tracks_stale', True)
+            # The async client cannot be used from another thread
+            self.load_in_background(get_client(client.base_url, client.token), item_id)
+        return entry
+
+    def _fetch_in_background(self, client: AudioBookshelfClient, item_id: str) -> None:
+        try:
+            self.fetch(client, item_id)
+        finally:
+            with self._cache_lock:
+                self._revalidating.discard((client.base_url, item_id))
+
+    def _remember(self, key, entry: Dict) -> None:
+        with self._cache_lock:
+            self._cache[key] = entry
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def choose_stream(client: AudioBookshelfClient, entry: Optional[Dict], item_id: str,
+                  offset_ms: int, episode_id: Optional[str] = None) -> StreamChoice:
+    """
+    Pick the track and offset to stream for a position in an item
+
+    Falls back to a whole-item stream when the track list is unknown.
+
+    Args:
+        client: AudioBookshelf client for the server
+        entry: Cached track list of the item, if any
+        item_id: The library item ID
+        offset_ms: Position within the item (or episode) in milliseconds
+        episode_id: Podcast episode to play, if any
+
+    Returns:
+        StreamChoice with the token, URL and offset within the track
+    """
+    tracks = (entry or {}).get('tracks') or []
+    offset_ms = int(offset_ms or 0)
+
+    if episode_id:
+        track = next((track for track in tracks if track['episode_id'] == episode_id), None)
+    else:
+        # Last track starting at or before the offset, comparing whole ms like the tokens
+        track = next((track for track in reversed(tracks)
+                      if int(track['start'] * 1000) <= offset_ms),
+                     tracks[0] if tracks else None)
+
+    if track is None:
+        return StreamChoice(StreamToken(item_id).encode(), client.get_stream_url(item_id), offset_ms)
+
+    return track_stream(client, item_id, track, offset_ms)
+
+
+def track_stream(client: AudioBookshelfClient, item_id: str, track: Dict,
+                 offset_ms: Optional[int] = None) -> StreamChoice:
+    """
+    Build the stream of one track
+
+    Args:
+        client: AudioBookshelf client for the server
+        item_id: The library item ID
+        track: Track dict from the item's cached track list
+        offset_ms: Position within the item (or episode) in milliseconds;
+            the start of the track if not given
+
+    Returns:
+        StreamChoice with the token, URL and offset within the track
+    """
+    start_ms = int(track['start'] * 1000)
+    token = StreamToken(item_id, track['episode_id'], track['index'], start_ms)
+    offset_in_track = max(0, offset_ms - start_ms) if offset_ms is not None else 0
+    return StreamChoice(token.encode(), client.get_track_url(track['content_url']),
+                        offset_in_track)
+
+
+def next_track(entry: Optional[Dict], token: StreamToken) -> Optional[Dict]:
+    """
+    Get the track that follows a stream
+
+    Args:
+        entry: Cached track list of the item
+        token: Token of the stream that is playing
+
+    Returns:
+        Track dict, or None at the end of the item or for whole-item streams
+    """
+    if not entry or token.index is None:
+        return None
+
+    tracks = entry['tracks']
+    if token.episode_id:
+        position = next((i for i, track in enumerate(tracks)
+                         if track['episode_id'] == token.episode_id), None)
+    else:
+        position = token.index
+
+    if position is None or position + 1 >= len(tracks):
+        return None
+    return tracks[position + 1]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_track_cache() -> TrackCache:
+    """
+    Get the process-wide track cache, configured from the environment
+
+    Returns:
+        TrackCache instance
+    """
+    global _cache
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = TrackCache(
+                    os.getenv('TRACK_CACHE_DB_PATH') or data_path('tracks.db'),
+                    ttl=float(os.getenv('TRACK_CACHE_TTL', 86400))
+                )
+
+    return _cache
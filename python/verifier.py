@@ -0,0 +1,298 @@
+"""
+Verification that requests to /alexa were sent by Alexa
+Checks signatures and timestamps, keeping each validated signing certificate chain until it expires
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import timezone
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import requests
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.x509 import ExtensionOID
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_webservice_support.verifier import (
+    RequestVerifier, TimestampVerifier, VerificationException
+)
+from ask_sdk_webservice_support.verifier_constants import DEFAULT_TIMESTAMP_TOLERANCE_IN_MILLIS
+
+from metrics import REQUEST_VERIFICATION_FAILURES, observe_cache
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for Amazon to serve a certificate chain
+CERT_FETCH_TIMEOUT = 5
+
+# Certificate chains kept per process; Amazon signs with one or two at a time
+MAX_CACHED_CHAINS = 16
+
+
+def _expires_at(cert: x509.Certificate) -> float:
+    # cryptography returns naive datetimes in UTC
+    return cert.not_valid_after.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _starts_at(cert: x509.Certificate) -> float:
+    return cert.not_valid_before.replace(tzinfo=timezone.utc).timestamp()
+
+
+class TrustStore:
+    """Root certificates a signing chain must lead to, indexed by subject"""
+
+    def __init__(self, path: str):
+        """
+        Initialize the trust store
+
+        Args:
+            path: PEM bundle of trusted root certificates
+        """
+        self.path = path
+        self._roots = None
+        self._lock = threading.Lock()
+
+    def issuers_of(self, cert: x509.Certificate) -> List[x509.Certificate]:
+        """
+        Get the trusted roots that may have issued a certificate
+
+        Args:
+            cert: Certificate whose issuer is looked up
+
+        Returns:
+            Roots whose subject is the certificate's issuer
+        """
+        return self.load().get(cert.issuer, [])
+
+    def is_trusted(self, cert: x509.Certificate) -> bool:
+        """
+        Check whether a certificate is itself one of the trusted roots
+        """
+        return any(root == cert for root in self.issuers_of(cert))
+
+    def load(self) -> Dict[x509.Name, List[x509.Certificate]]:
+        """
+        Parse the bundle on first use
+
+        Returns:
+            Trusted roots keyed by subject
+        """
+        if self._roots is None:
+            with self._lock:
+                if self._roots is None:
+                    self._roots = self._parse()
+        return self._roots
+
+    def _parse(self) -> Dict[x509.Name, List[x509.Certificate]]:
+        with open(self.path, 'rb') as f:
+            roots = x509.load_pem_x509_certificates(f.read())
+
+        by_subject = {}
+        for root in roots:
+            by_subject.setdefault(root.subject, []).append(root)
+        logger.info(f'Loaded {len(roots)} trusted root certificates from {self.path}')
+        return by_subject
+
+
+class CachingRequestVerifier(RequestVerifier):
+    """
+    Signature verifier that validates each certificate chain once per process
+
+    The SDK verifier downloads and parses the chain on first use and never
+    validates it beyond the signing certificate. This one validates the whole
+    chain up to a trusted root, then serves the signing certificate from
+    memory until the first certificate in the chain expires.
+    """
+
+    def __init__(self, trust_store: TrustStore, session: Optional[requests.Session] = None,
+                 **kwargs):
+        """
+        Initialize the verifier
+
+        Args:
+            trust_store: Roots the certificate chains must lead to
+            session: HTTP session used to download certificate chains
+            **kwargs: Passed to RequestVerifier
+        """
+        super().__init__(**kwargs)
+        self.trust_store = trust_store
+        self.session = session or requests.Session()
+        self._chains = {}
+        self._chains_lock = threading.Lock()
+        self._fetches = SingleFlight()
+
+    def _retrieve_and_validate_certificate_chain(self, cert_url: str) -> x509.Certificate:
+        """
+        Get the validated signing certificate for a SignatureCertChainUrl
+
+        Args:
+            cert_url: SignatureCertChainUrl header of the request
+
+        Returns:
+            Signing certificate
+
+        Raises:
+            VerificationException: If the URL or the chain is not valid
+        """
+        now = time.time()
+        cached = self._chains.get(cert_url)
+        if cached is not None and cached[1] > now:
+            observe_cache('cert_chain', True)
+            return cached[0]
+
+        observe_cache('cert_chain', False)
+        self._validate_certificate_url(cert_url)
+        # Requests arriving together after a rotation wait for one download
+        signing_cert, expires_at = self._fetches.do(
+            cert_url, lambda: self._load_and_validate(cert_url), timeout=CERT_FETCH_TIMEOUT * 2
+        )
+
+        with self._chains_lock:
+            for url in [url for url, (_, expiry) in self._chains.items() if expiry <= now]:
+                del self._chains[url]
+            if len(self._chains) >= MAX_CACHED_CHAINS:
+                self._chains.pop(next(iter(self._chains)))
+            self._chains[cert_url] = (signing_cert, expires_at)
+        return signing_cert
+
+    def _after_fork(self) -> None:
+        # Sockets and locks inherited from the parent must not be used by the child
+        self.session = requests.Session()
+        self._chains_lock = threading.Lock()
+
+    def _load_and_validate(self, cert_url: str) -> Tuple[x509.Certificate, float]:
+        """
+        Download, parse and validate a certificate chain
+
+        Returns:
+            Signing certificate, and when the first certificate in its chain expires
+        """
+        try:
+            response = self.session.get(cert_url, timeout=CERT_FETCH_TIMEOUT)
+            response.raise_for_status()
+            chain = x509.load_pem_x509_certificates(response.content)
+        except (requests.RequestException, ValueError) as e:
+            raise VerificationException('Unable to load certificate chain from URL', e)
+
+        # Checks validity dates and the echo-api.amazon.com name
+        self._validate_cert_chain(chain[0])
+        expires_at = self._validate_path(chain)
+        logger.info(f'Validated certificate chain {cert_url}')
+        return chain[0], expires_at
+
+    def _validate_path(self, chain: List[x509.Certificate]) -> float:
+        """
+        Check that each certificate is issued by the next, ending at a trusted root
+
+        Returns:
+            When the first certificate on the path expires
+
+        Raises:
+            VerificationException: If the chain does not lead to a trusted root
+        """
+        now = time.time()
+        expires_at = _expires_at(chain[0])
+
+        for position, cert in enumerate(chain):
+            if not _starts_at(cert) <= now <= _expires_at(cert):
+                raise VerificationException('Certificate in chain is not valid now')
+            expires_at = min(expires_at, _expires_at(cert))
+            if position > 0:
+                _require_ca(cert)
+            if self.trust_store.is_trusted(cert):
+                return expires_at
+
+            issuers = chain[position + 1:position + 2] or self.trust_store.issuers_of(cert)
+            for issuer in issuers:
+                try:
+                    cert.verify_directly_issued_by(issuer)
+                except (ValueError, TypeError, InvalidSignature) as e:
+                    logger.debug(f'Certificate not issued by {issuer.subject}: {e}')
+                    continue
+                if issuer not in chain:
+                    # Signed by a trusted root the chain leaves out
+                    return min(expires_at, _expires_at(issuer))
+                break
+            else:
+                raise VerificationException('Certificate chain does not lead to a trusted root')
+
+        raise VerificationException('Certificate chain does not lead to a trusted root')
+
+
+def _require_ca(cert: x509.Certificate) -> None:
+    try:
+        constraints = cert.extensions.get_extension_for_oid(ExtensionOID.BASIC_CONSTRAINTS).value
+    except x509.ExtensionNotFound:
+        constraints = None
+    if constraints is None or not constraints.ca:
+        raise VerificationException('Certificate chain contains an issuer that is not a CA')
+
+
+_verifiers = None
+_verifiers_lock = threading.Lock()
+
+
+def verification_enabled() -> bool:
+    """
+    Check whether /alexa should reject requests that Alexa did not sign
+
+    Returns:
+        False only when ALEXA_VERIFY_REQUESTS is set to false, e.g. for local testing
+    """
+    return os.getenv('ALEXA_VERIFY_REQUESTS', 'True').lower() != 'false'
+
+
+def get_verifiers() -> Tuple[CachingRequestVerifier, TimestampVerifier]:
+    """
+    Get the process-wide verifiers, configured from the environment
+
+    Returns:
+        Signature verifier and timestamp verifier
+    """
+    global _verifiers
+
+    if _verifiers is None:
+        with _verifiers_lock:
+            if _verifiers is None:
+                trust_store = TrustStore(os.getenv('ALEXA_CA_BUNDLE') or requests.certs.where())
+                tolerance = int(os.getenv('ALEXA_TIMESTAMP_TOLERANCE_MS',
+                                          DEFAULT_TIMESTAMP_TOLERANCE_IN_MILLIS))
+                signature_verifier = CachingRequestVerifier(trust_store)
+                if hasattr(os, 'register_at_fork'):
+                    os.register_at_fork(after_in_child=signature_verifier._after_fork)
+                _verifiers = (signature_verifier, TimestampVerifier(tolerance))
+
+    return _verifiers
+
+
+def verify_request(headers: Mapping[str, str], body: bytes,
+                   request_envelope: RequestEnvelope) -> None:
+    """
+    Check that a request was signed by Alexa and sent within the allowed time
+
+    Args:
+        headers: HTTP request headers
+        body: Raw request body, exactly as received
+        request_envelope: Decoded request body
+
+    Raises:
+        VerificationException: If the request must be rejected
+    """
+    signature_verifier, timestamp_verifier = get_verifiers()
+
+    try:
+        timestamp_verifier.verify(headers, body, request_envelope)
+    except VerificationException:
+        REQUEST_VERIFICATION_FAILURES.inc(check='timestamp')
+        raise
+
+    try:
+        signature_verifier.verify(headers, body.decode('utf-8'), request_envelope)
+    except (VerificationException, UnicodeDecodeError, ValueError) as e:
+        REQUEST_VERIFICATION_FAILURES.inc(check='signature')
+        if isinstance(e, VerificationException):
+            raise
+        raise VerificationException('Malformed request signature', e)